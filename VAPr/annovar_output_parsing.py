@@ -74,7 +74,7 @@ class AnnovarTxtParser(object):
 
     @classmethod
     def read_chunk_of_annotations_to_dicts_list(cls, annovar_txt_file_like_obj, sample_names_list, chunk_index,
-                                                chunk_size):
+                                                chunk_size, chunk_start_offset=None, sparse_samples=False):
         annotations_dict_per_variant_list = []
         hgvsid_list = []
 
@@ -82,18 +82,26 @@ class AnnovarTxtParser(object):
         reader = csv.reader(annovar_txt_file_like_obj, delimiter='\t')
         normed_headers_list = cls._normalize_header(next(reader))
 
+        # if the byte offset of the chunk's first line is known, seek straight to it; otherwise, skip lines until
+        # reaching the chunk
+        if chunk_start_offset is not None:
+            annovar_txt_file_like_obj.seek(chunk_start_offset)
+            chunk_lines = itertools.islice(reader, chunk_size)
+        else:
+            chunk_lines = itertools.islice(reader, (chunk_index * chunk_size), ((chunk_index + 1) * chunk_size))
+
         # for each row in this chunk--which is to say, each variant
-        for curr_line_fields_list in itertools.islice(reader, (chunk_index * chunk_size),
-                                                      ((chunk_index + 1) * chunk_size)):
+        for curr_line_fields_list in chunk_lines:
             hgvs_id, annotations_dict_for_curr_variant = cls._parse_single_variant_record(
-                normed_headers_list, curr_line_fields_list, sample_names_list)
+                normed_headers_list, curr_line_fields_list, sample_names_list, sparse_samples)
             hgvsid_list.append(hgvs_id)
             annotations_dict_per_variant_list.append(annotations_dict_for_curr_variant)
 
         return hgvsid_list, annotations_dict_per_variant_list
 
     @classmethod
-    def _parse_single_variant_record(cls, normed_headers_list, curr_line_fields_list, sample_names_list):
+    def _parse_single_variant_record(cls, normed_headers_list, curr_line_fields_list, sample_names_list,
+                                     sparse_samples=False):
         # This code assumes that the VCF-produced format string and the genotype fields string(s) for the sample(s)
         # will be the last fields on every line and that they will NOT all have their own headers--rather, it
         # assumes the last header will indicate that the rest of the fields are "other info".  Here is a simplified
@@ -130,12 +138,12 @@ class AnnovarTxtParser(object):
         num_samples_plus_one = len(sample_names_list) + 1
         format_string = curr_line_fields_list[-num_samples_plus_one]
         genotype_field_strings_per_sample = curr_line_fields_list[-len(sample_names_list)::]
-        genotype_field_strings_by_sample_name = dict(zip(sample_names_list, genotype_field_strings_per_sample))
 
         # turn the dictionary of annovar fields into a dictionary of annotations for the variant, including
         # nested structures containing sample-specific genotype-related info
-        annotations_dict_for_curr_variant = AnnovarAnnotatedVariant.make_per_variant_annotation_dict(
-            cleaned_fields_dict, hgvs_id, format_string, genotype_field_strings_by_sample_name)
+        annotations_dict_for_curr_variant = AnnovarAnnotatedVariant.make_per_variant_annotation_dict_for_samples(
+            cleaned_fields_dict, hgvs_id, format_string, sample_names_list, genotype_field_strings_per_sample,
+            sparse_samples)
 
         return hgvs_id, annotations_dict_for_curr_variant
 
@@ -203,46 +211,105 @@ class AnnovarAnnotatedVariant(object):
 
     @classmethod
     def make_per_variant_annotation_dict(cls, fields_by_annovar_header, hgvs_id, format_string,
-                                         genotype_field_strings_by_sample_name):
+                                         genotype_field_strings_by_sample_name, sparse_samples=False):
+        return cls.make_per_variant_annotation_dict_for_samples(
+            fields_by_annovar_header, hgvs_id, format_string, list(genotype_field_strings_by_sample_name.keys()),
+            list(genotype_field_strings_by_sample_name.values()), sparse_samples)
+
+    @classmethod
+    def make_per_variant_annotation_dict_for_samples(cls, fields_by_annovar_header, hgvs_id, format_string,
+                                                     sample_names_list, genotype_field_strings_list,
+                                                     sparse_samples=False):
         result = fields_by_annovar_header
         result[cls.HGVS_ID_KEY] = hgvs_id
 
         # parse sample-level info into a list of per-sample dicts and add that list to the variant-level dict
-        sample_specific_dicts_list = []
-        for curr_sample_name, genotype_fields_string_for_curr_sample in genotype_field_strings_by_sample_name.items():
-            sample_specific_dict = cls._make_per_sample_annotation_dict(curr_sample_name, format_string,
-                                                                        genotype_fields_string_for_curr_sample)
+        result[cls.SAMPLES_KEY] = cls.make_per_sample_annotation_dicts(sample_names_list, format_string,
+                                                                       genotype_field_strings_list, sparse_samples)
+        return result
+
+    @classmethod
+    def make_per_sample_annotation_dicts(cls, sample_names_list, format_string, genotype_field_strings_list,
+                                         sparse_samples=False):
+        """Make the per-sample annotation dicts for all the samples at one site, parsing their genotype fields together.
 
-            if sample_specific_dict is not None:
-                sample_specific_dicts_list.append(sample_specific_dict)
+        Args:
+            sample_names_list (List[str]): The name of each sample.
+            format_string (str): The VCF format string (e.g., 'GT:AD:DP:GQ:PL') for this site.
+            genotype_field_strings_list (List[str]): The genotype fields string of each sample, in the same order as
+                sample_names_list.
+            sparse_samples (Optional[bool]): True to make dicts only for the samples whose genotype includes a
+                non-reference allele, leaving out those that are homozygous reference, not called, or without a
+                parseable genotype.  Defaults to False.
 
-        result[cls.SAMPLES_KEY] = sample_specific_dicts_list
+        Returns:
+            List[dict]: One annotation dict for each sample with real genotype fields content, in sample order.  A
+                sample name listed more than once gets one dict, at its first position but from its last genotype
+                fields string.
+        """
+        if len(set(sample_names_list)) < len(sample_names_list):
+            # as when the genotype fields strings were held in a dict keyed by sample name, the last one wins
+            genotype_field_strings_by_sample_name = dict(zip(sample_names_list, genotype_field_strings_list))
+            sample_names_list = list(genotype_field_strings_by_sample_name.keys())
+            genotype_field_strings_list = list(genotype_field_strings_by_sample_name.values())
+
+        if sparse_samples and format_string.split(VCFGenotypeParser.DELIMITER, 1)[0] == VCFGenotypeParser.GENOTYPE_TAG:
+            # the genotype comes first, so the samples to be left out can be dropped before parsing any of their fields
+            kept_names_and_strings = [x for x in zip(sample_names_list, genotype_field_strings_list) if
+                                      cls._is_non_reference_genotype(x[1].split(VCFGenotypeParser.DELIMITER, 1)[0])]
+            sample_names_list = [x[0] for x in kept_names_and_strings]
+            genotype_field_strings_list = [x[1] for x in kept_names_and_strings]
+
+        genotype_infos_list = VCFGenotypeParser.parse_row_to_dicts(format_string, genotype_field_strings_list,
+                                                                   include_unprocessed=False)
+
+        result = []
+        for curr_sample_name, curr_genotype_info in zip(sample_names_list, genotype_infos_list):
+            # parse_row_to_dicts gives None both for a genotype fields string without real content and on error
+            if curr_genotype_info is None:
+                continue
+            if sparse_samples and not cls._is_non_reference_genotype(curr_genotype_info[cls.GENOTYPE_KEY]):
+                continue
+            result.append(cls._make_annotation_dict_from_genotype_info(curr_sample_name, curr_genotype_info))
         return result
 
-    @classmethod
-    def _make_per_sample_annotation_dict(cls, sample_name, format_string, genotype_fields_string):
+    @staticmethod
+    def _is_non_reference_genotype(genotype):
+        """Return true if the genotype includes an allele other than the reference, false otherwise.
 
-        if not VCFGenotypeParser.is_valid_genotype_fields_string(genotype_fields_string):
-            return None
+        Args:
+            genotype (str or None): A VCF-style genotype, such as 0/1 or 1|1, or None if there is none.
 
-        genotype_info = VCFGenotypeParser.parse(format_string, genotype_fields_string)
-        if genotype_info is None:
-            return None
+        Returns:
+            bool: True if any allele of the genotype is neither reference ('0') nor missing ('.'), false otherwise.
+        """
+        if genotype is None:
+            return False
+        return any(x not in ("0", ".") for x in genotype.replace("|", "/").split("/"))
 
+    @classmethod
+    def _make_per_sample_annotation_dict(cls, sample_name, format_string, genotype_fields_string):
+        result = cls.make_per_sample_annotation_dicts([sample_name], format_string, [genotype_fields_string])
+        return result[0] if len(result) > 0 else None
+
+    @classmethod
+    def _make_annotation_dict_from_genotype_info(cls, sample_name, genotype_info):
         # Always include a genotype key, EVEN IF the value for that key is None
-        result = {cls.SAMPLE_ID_KEY: sample_name, cls.GENOTYPE_KEY: genotype_info.genotype}
+        genotype = genotype_info[VCFGenotypeParser.GENOTYPE_KEY]
+        result = {cls.SAMPLE_ID_KEY: sample_name, cls.GENOTYPE_KEY: genotype}
 
         # for all other keys, include them only if they have meaningful values
-        if genotype_info.genotype is not None:
-            result[cls.GENOTYPE_SUBCLASS_BY_CLASS_KEY] = genotype_info.genotype_subclass_by_class
-        if genotype_info.filter_passing_reads_count is not None:
-            result[cls.FILTER_PASSING_READS_COUNT_KEY] = genotype_info.filter_passing_reads_count
+        if genotype is not None:
+            result[cls.GENOTYPE_SUBCLASS_BY_CLASS_KEY] = genotype_info[VCFGenotypeParser.GENOTYPE_SUBCLASS_BY_CLASS_KEY]
+        filter_passing_reads_count = genotype_info[VCFGenotypeParser.FILTER_PASSING_READS_COUNT_KEY]
+        if filter_passing_reads_count is not None:
+            result[cls.FILTER_PASSING_READS_COUNT_KEY] = filter_passing_reads_count
 
-        genotype_likelihoods_list = [i.likelihood_neg_exponent for i in genotype_info.genotype_likelihoods]
+        genotype_likelihoods_list = genotype_info[VCFGenotypeParser.GENOTYPE_LIKELIHOODS_KEY]
         if cls._list_has_valid_content(genotype_likelihoods_list):
             result[cls.GENOTYPE_LIKELIHOODS_KEY] = genotype_likelihoods_list
 
-        unfiltered_read_depths_list = [i.unfiltered_read_counts for i in genotype_info.alleles]
+        unfiltered_read_depths_list = genotype_info[VCFGenotypeParser.UNFILTERED_READ_COUNTS_KEY]
         if cls._list_has_valid_content(unfiltered_read_depths_list):
             result[cls.ALLELE_DEPTH_KEY] = unfiltered_read_depths_list
 
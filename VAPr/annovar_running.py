@@ -1,9 +1,18 @@
+import concurrent.futures
+import hashlib
+import json
 import logging
 import os
 import shlex
+import shutil
 import subprocess
+import time
 from collections import OrderedDict
 
+import VAPr.vcf_merging
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+
 
 class AnnovarWrapper(object):
     """ Wrapper around ANNOVAR download and annotation functions """
@@ -58,27 +67,244 @@ class AnnovarWrapper(object):
         self._genome_build_version = genome_build_version
         self._annovar_dbs_to_use = self._get_annovar_dbs_to_use(custom_annovar_dbs_to_use)
 
-    def download_databases(self):
-        list_commands = self._build_annovar_database_download_command_str()
-        for command in list_commands:
-            args = shlex.split(command)
-            subprocess.call(args)
+    DEFAULT_NUM_DOWNLOAD_WORKERS = 4
+    _DOWNLOAD_MARKER_SUFFIX = '.download.json'
+    _DOWNLOAD_STAGING_SUFFIX = '.staging'
+    _MARKER_FILES_KEY = 'files'
+    _MARKER_SIZE_KEY = 'size'
+    _MARKER_SHA256_KEY = 'sha256'
+    _MARKER_DOWNLOAD_SECONDS_KEY = 'download_seconds'
+
+    def download_databases(self, num_workers=DEFAULT_NUM_DOWNLOAD_WORKERS):
+        """Download the ANNOVAR databases in use to humandb, several at once, skipping any already downloaded.
+
+        Each database is downloaded by annotate_variation.pl into its own staging directory, and its files are only
+        moved into humandb once the download succeeds.  A completion marker is then written to humandb, recording the
+        size and sha256 checksum of each of those files; a database is skipped if it has a marker and all its files
+        are still present with the recorded checksums.
+
+        Args:
+            num_workers (Optional[int]): Maximum number of databases to download at once.  Defaults to
+                DEFAULT_NUM_DOWNLOAD_WORKERS.
+
+        Returns:
+            OrderedDict: The number of seconds taken to download each database, or None for those skipped, keyed by
+                database name.
+
+        Raises:
+            RuntimeError: If annotate_variation.pl fails for any database; the others are still downloaded.
+        """
+        humandb_dir = self._annovar_install_path + self._HUMANDB_FOLDER_NAME
+        os.makedirs(humandb_dir, exist_ok=True)
+
+        download_seconds_by_db = OrderedDict()
+        dbs_to_download = []
+        for annovar_db_name in self._annovar_dbs_to_use:
+            download_seconds_by_db[annovar_db_name] = None
+            if self._is_database_downloaded(annovar_db_name):
+                logging.info('Annovar database {0} is already downloaded; skipping it'.format(annovar_db_name))
+            else:
+                dbs_to_download.append(annovar_db_name)
+
+        # each thread just waits on its own annotate_variation.pl process, so threads suffice to run them concurrently
+        error_msgs = []
+        with concurrent.futures.ThreadPoolExecutor(max(num_workers, 1)) as executor:
+            futures_by_db = OrderedDict((x, executor.submit(self._download_database, x)) for x in dbs_to_download)
+            for annovar_db_name, curr_future in futures_by_db.items():
+                try:
+                    download_seconds_by_db[annovar_db_name] = curr_future.result()
+                except RuntimeError as error:
+                    error_msgs.append(str(error))
+
+        logging.info('Annovar database downloads to {0}: {1}'.format(humandb_dir, ", ".join(
+            "{0} {1}".format(db_name, "skipped" if seconds is None else "{0:.1f}s".format(seconds))
+            for db_name, seconds in download_seconds_by_db.items())))
+        if len(error_msgs) > 0:
+            raise RuntimeError("; ".join(error_msgs))
+
+        logging.info('Finished downloading databases to {0}'.format(humandb_dir))
+        return download_seconds_by_db
+
+    def _download_database(self, annovar_db_name):
+        humandb_dir = self._annovar_install_path + self._HUMANDB_FOLDER_NAME
+        database_key = self._get_database_key(annovar_db_name)
+        staging_dir = os.path.join(humandb_dir, database_key + self._DOWNLOAD_STAGING_SUFFIX)
+        marker_fp = os.path.join(humandb_dir, database_key + self._DOWNLOAD_MARKER_SUFFIX)
+
+        # a database being (re)downloaded isn't complete until its new marker is written
+        if os.path.exists(marker_fp):
+            os.remove(marker_fp)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(staging_dir)
+        try:
+            start_time = time.time()
+            command = self._build_annovar_database_download_command_str_for_db(annovar_db_name, staging_dir + '/')
+            return_code = subprocess.call(shlex.split(command))
+            download_seconds = time.time() - start_time
+            if return_code != 0:
+                raise RuntimeError("Downloading Annovar database {0} failed with exit code {1}".format(
+                    annovar_db_name, return_code))
+
+            file_info_by_name = {}
+            for curr_file_name in sorted(os.listdir(staging_dir)):
+                curr_fp = os.path.join(humandb_dir, curr_file_name)
+                os.replace(os.path.join(staging_dir, curr_file_name), curr_fp)
+                file_info_by_name[curr_file_name] = {self._MARKER_SIZE_KEY: os.path.getsize(curr_fp),
+                                                     self._MARKER_SHA256_KEY: _get_file_sha256(curr_fp)}
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+        with open(marker_fp, 'w') as marker_file_obj:
+            json.dump({self._MARKER_FILES_KEY: file_info_by_name,
+                       self._MARKER_DOWNLOAD_SECONDS_KEY: download_seconds}, marker_file_obj, indent=2)
+        logging.info('Downloaded Annovar database {0} in {1:.1f}s'.format(annovar_db_name, download_seconds))
+        return download_seconds
+
+    def _is_database_downloaded(self, annovar_db_name):
+        humandb_dir = self._annovar_install_path + self._HUMANDB_FOLDER_NAME
+        marker_fp = os.path.join(humandb_dir, self._get_database_key(annovar_db_name) + self._DOWNLOAD_MARKER_SUFFIX)
+        try:
+            with open(marker_fp, 'r') as marker_file_obj:
+                file_info_by_name = json.load(marker_file_obj)[self._MARKER_FILES_KEY]
+            for curr_file_name, curr_file_info in file_info_by_name.items():
+                curr_fp = os.path.join(humandb_dir, curr_file_name)
+                # check the size first, as it is much cheaper than the checksum
+                if os.path.getsize(curr_fp) != curr_file_info[self._MARKER_SIZE_KEY] or \
+                        _get_file_sha256(curr_fp) != curr_file_info[self._MARKER_SHA256_KEY]:
+                    return False
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return False
 
-        logging.info('Finished downloading databases to {0}'.format(
-            os.path.join(self._annovar_install_path, self._HUMANDB_FOLDER_NAME)))
+        return len(file_info_by_name) > 0
 
-    def run_annotation(self, single_vcf_path, output_basename, output_dir):
-        annovar_output_basename = output_basename + '_annotated'
-        annovar_output_base = os.path.join(output_dir, annovar_output_basename)
-        annovar_txt_output_fp = annovar_output_base + '.' + self._genome_build_version + '_multianno.txt'
+    def _get_database_key(self, annovar_db_name):
+        return self._genome_build_version + '_' + annovar_db_name
 
-        cmd_string = self._build_table_annovar_command_str(single_vcf_path, annovar_output_base)
-        args = shlex.split(cmd_string)
+    _MANIFEST_SUFFIX = '.manifest.json'
+    _MANIFEST_FINGERPRINT_KEY = 'inputs_fingerprint'
+    _MANIFEST_OUTPUT_SIZE_KEY = 'output_size'
+
+    def run_annotation(self, single_vcf_path, output_basename, output_dir, num_processes=1, force=False):
+        """Run table_annovar.pl on a vcf, optionally as several concurrent processes each annotating one shard of it.
+
+        Each successful run records a fingerprint of its inputs (the vcf's variant lines and sample names, the genome
+        build version, the ANNOVAR databases used, and the names, sizes and modification times of the files in
+        humandb) in a manifest file next to the output.  If the inputs of a later run have the same fingerprint, the
+        existing output is reused instead of running table_annovar.pl again.
+
+        Args:
+            single_vcf_path (str): Path to the vcf to annotate.
+            output_basename (str): Base name of the ANNOVAR output files.
+            output_dir (str): Directory in which to write the ANNOVAR output files.
+            num_processes (Optional[int]): Number of table_annovar.pl processes to run at once.  If more than one, the
+                vcf is split into that many shards of consecutive records, each is annotated separately, and their
+                outputs are concatenated in order.  Defaults to 1.
+            force (Optional[bool]): Run table_annovar.pl even if the output of an earlier run can be reused.  Defaults
+                to False.
+
+        Returns:
+            str: Path to the ANNOVAR txt output file.
+        """
+        if num_processes > 1:
+            with self.start_sharded_annotation(single_vcf_path, output_basename, output_dir, num_processes,
+                                               force) as sharded_run:
+                for _ in sharded_run.iter_finished_shard_output_fps():
+                    pass
+            return sharded_run.output_fp
+
+        annovar_output_base = self._get_annovar_output_base(output_basename, output_dir)
+        annovar_txt_output_fp = self._get_annovar_txt_output_fp(annovar_output_base)
+        inputs_fingerprint = self._get_inputs_fingerprint(single_vcf_path)
+        if not force and self._is_output_reusable(annovar_txt_output_fp, inputs_fingerprint):
+            logging.info('Reusing Annovar output {0}, made from the same inputs'.format(annovar_txt_output_fp))
+            return annovar_txt_output_fp
+
+        # the output is about to be overwritten, so it no longer matches any recorded fingerprint
+        self._remove_manifest(annovar_txt_output_fp)
         logging.info('Running Annovar')
-        subprocess.call(args)
+        if self._run_table_annovar(single_vcf_path, annovar_output_base) == 0:
+            self._write_manifest(annovar_txt_output_fp, inputs_fingerprint)
         logging.info('Finished running Annovar')
         return annovar_txt_output_fp
 
+    def start_sharded_annotation(self, single_vcf_path, output_basename, output_dir, num_processes, force=False):
+        """Start running table_annovar.pl concurrently on shards of a vcf, without waiting for them to finish.
+
+        As with run_annotation, the output of an earlier run from the same inputs is reused unless force is True.
+
+        Args:
+            single_vcf_path (str): Path to the vcf to annotate.
+            output_basename (str): Base name of the ANNOVAR output files.
+            output_dir (str): Directory in which to write the ANNOVAR output files.
+            num_processes (int): Number of shards, and of table_annovar.pl processes to run at once.
+            force (Optional[bool]): Run table_annovar.pl even if the output of an earlier run can be reused.  Defaults
+                to False.
+
+        Returns:
+            ShardedAnnovarRun: The running annotation; use it as a context manager.
+        """
+        return ShardedAnnovarRun(self, single_vcf_path, self._get_annovar_output_base(output_basename, output_dir),
+                                 num_processes, force)
+
+    @staticmethod
+    def _get_annovar_output_base(output_basename, output_dir):
+        return os.path.join(output_dir, output_basename + '_annotated')
+
+    def _get_annovar_txt_output_fp(self, annovar_output_base):
+        return annovar_output_base + '.' + self._genome_build_version + '_multianno.txt'
+
+    def _run_table_annovar(self, vcf_path, annovar_output_base):
+        cmd_string = self._build_table_annovar_command_str(vcf_path, annovar_output_base)
+        return subprocess.call(shlex.split(cmd_string))
+
+    def _get_inputs_fingerprint(self, single_vcf_path):
+        """Hash everything that determines the ANNOVAR output for a vcf into a hex string."""
+
+        hasher = hashlib.sha256()
+        # the '##' meta-information lines (dates, merge commands and the like) don't affect the output, but the
+        # '#CHROM' line does, since its sample names end up in the output's otherinfo columns
+        with open(single_vcf_path, 'rb') as vcf_file_obj:
+            for curr_line in vcf_file_obj:
+                if not curr_line.startswith(b'##'):
+                    hasher.update(curr_line)
+
+        humandb_dir = self._annovar_install_path + self._HUMANDB_FOLDER_NAME
+        humandb_files_info = []
+        if os.path.isdir(humandb_dir):
+            for curr_file_name in sorted(os.listdir(humandb_dir)):
+                curr_stat = os.stat(os.path.join(humandb_dir, curr_file_name))
+                humandb_files_info.append([curr_file_name, curr_stat.st_size, curr_stat.st_mtime_ns])
+
+        settings = {'genome_build_version': self._genome_build_version,
+                    'annovar_dbs': list(self._annovar_dbs_to_use.items()),
+                    'humandb_files': humandb_files_info}
+        hasher.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+        return hasher.hexdigest()
+
+    def _is_output_reusable(self, annovar_txt_output_fp, inputs_fingerprint):
+        try:
+            with open(annovar_txt_output_fp + self._MANIFEST_SUFFIX, 'r') as manifest_file_obj:
+                manifest = json.load(manifest_file_obj)
+            output_size = os.path.getsize(annovar_txt_output_fp)
+        except (OSError, ValueError):
+            return False
+
+        # the size check catches an output that was changed after the manifest was written
+        return manifest.get(self._MANIFEST_FINGERPRINT_KEY) == inputs_fingerprint and \
+            manifest.get(self._MANIFEST_OUTPUT_SIZE_KEY) == output_size
+
+    def _write_manifest(self, annovar_txt_output_fp, inputs_fingerprint):
+        manifest = {self._MANIFEST_FINGERPRINT_KEY: inputs_fingerprint,
+                    self._MANIFEST_OUTPUT_SIZE_KEY: os.path.getsize(annovar_txt_output_fp)}
+        with open(annovar_txt_output_fp + self._MANIFEST_SUFFIX, 'w') as manifest_file_obj:
+            json.dump(manifest, manifest_file_obj)
+
+    def _remove_manifest(self, annovar_txt_output_fp):
+        try:
+            os.remove(annovar_txt_output_fp + self._MANIFEST_SUFFIX)
+        except FileNotFoundError:
+            pass
+
     def _get_annovar_dbs_to_use(self, custom_annovar_dbs_to_use=None):
         annovar_dbs_for_build_version_dict = self._get_annovar_dbs_to_use_for_build_version(
             self._genome_build_version)
@@ -114,20 +340,157 @@ class AnnovarWrapper(object):
     def _build_annovar_database_download_command_str(self):
         """Concatenate command string arguments for Annovar download database jobs"""
 
-        command_list = []
+        return [self._build_annovar_database_download_command_str_for_db(
+            x, self._annovar_install_path + self._HUMANDB_FOLDER_NAME) for x in self._annovar_dbs_to_use]
+
+    def _build_annovar_database_download_command_str_for_db(self, annovar_db_name, target_dir):
+        """Concatenate command string arguments for an Annovar job downloading one database to a directory"""
+
         # TODO: someday: refactor to remove duplicated command components
-        for annovar_db_name in self._annovar_dbs_to_use:
-            if self._ANNOVAR_DB_IS_HOSTED_BY_ANNOVAR[annovar_db_name]:
-                command_list.append(" ".join(
-                    ['perl', self._annovar_install_path + '/annotate_variation.pl',
-                     '-build', self._genome_build_version,
-                     '-downdb', self._DOWN_DD, annovar_db_name,
-                     self._annovar_install_path + self._HUMANDB_FOLDER_NAME]))
-            else:
-                command_list.append(" ".join(
-                    ['perl', self._annovar_install_path + '/annotate_variation.pl',
-                     '-build', self._genome_build_version,
-                     '-downdb', annovar_db_name,
-                     self._annovar_install_path + self._HUMANDB_FOLDER_NAME]))
+        if self._ANNOVAR_DB_IS_HOSTED_BY_ANNOVAR[annovar_db_name]:
+            command = " ".join(
+                ['perl', self._annovar_install_path + '/annotate_variation.pl',
+                 '-build', self._genome_build_version,
+                 '-downdb', self._DOWN_DD, annovar_db_name,
+                 target_dir])
+        else:
+            command = " ".join(
+                ['perl', self._annovar_install_path + '/annotate_variation.pl',
+                 '-build', self._genome_build_version,
+                 '-downdb', annovar_db_name,
+                 target_dir])
+
+        return command
+
+
+def _get_file_sha256(file_path):
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as file_obj:
+        for block in iter(lambda: file_obj.read(_HASH_BLOCK_SIZE), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+class ShardedAnnovarRun(object):
+    """table_annovar.pl processes running concurrently, each annotating one shard of consecutive records of a vcf.
+
+    The shards' txt outputs can be consumed one by one as their processes finish.  On close, once every process has
+    finished successfully, the shards' outputs are concatenated (in shard order, and so in the order of the vcf) into
+    the same txt output file a single table_annovar.pl run would have written, and the shard files are removed.  Use
+    as a context manager; if the block raises, the processes are waited for and the shard files removed without making
+    the combined output.
+
+    If the combined output of an earlier run from the same inputs can be reused (see AnnovarWrapper.run_annotation),
+    and force is False, no processes are run and the combined output is yielded as the only shard output.
+
+    Args:
+        annovar_wrapper (AnnovarWrapper): Wrapper whose settings are used to run table_annovar.pl.
+        single_vcf_path (str): Path to the vcf to annotate.
+        annovar_output_base (str): Path, without extension, of the combined ANNOVAR output.
+        num_processes (int): Number of shards, and of table_annovar.pl processes to run at once.
+        force (Optional[bool]): Run table_annovar.pl even if the output of an earlier run can be reused.  Defaults to
+            False.
+    """
+
+    def __init__(self, annovar_wrapper, single_vcf_path, annovar_output_base, num_processes, force=False):
+        self._annovar_wrapper = annovar_wrapper
+        self._shards_dir = annovar_output_base + '_shards'
+        self._shard_indices_by_future = {}
+        self._executor = None
+        self.output_fp = annovar_wrapper._get_annovar_txt_output_fp(annovar_output_base)
+
+        self._inputs_fingerprint = annovar_wrapper._get_inputs_fingerprint(single_vcf_path)
+        self.is_reused = not force and annovar_wrapper._is_output_reusable(self.output_fp, self._inputs_fingerprint)
+        if self.is_reused:
+            logging.info('Reusing Annovar output {0}, made from the same inputs'.format(self.output_fp))
+            return
+
+        # the output is about to be overwritten, so it no longer matches any recorded fingerprint
+        annovar_wrapper._remove_manifest(self.output_fp)
+        os.makedirs(self._shards_dir, exist_ok=True)
+        try:
+            self._shard_vcf_fps = VAPr.vcf_merging.split_vcf(single_vcf_path, self._shards_dir, num_processes)
+            if len(self._shard_vcf_fps) == 0:
+                # no variants to split up, but still make the (header-only) output the unsharded run would
+                self._shard_vcf_fps = [single_vcf_path]
+        except Exception:
+            shutil.rmtree(self._shards_dir, ignore_errors=True)
+            raise
+
+        shard_output_bases = [os.path.join(self._shards_dir, "{0}_annotated".format(i))
+                              for i in range(len(self._shard_vcf_fps))]
+        self._shard_output_fps = [annovar_wrapper._get_annovar_txt_output_fp(x) for x in shard_output_bases]
+        logging.info('Running Annovar on {0} shards of {1}, {2} at a time'.format(
+            len(self._shard_vcf_fps), single_vcf_path, num_processes))
+
+        # each thread just waits on its own table_annovar.pl process, so threads suffice to run them concurrently
+        self._executor = concurrent.futures.ThreadPoolExecutor(num_processes)
+        self._shard_indices_by_future = {
+            self._executor.submit(annovar_wrapper._run_table_annovar, curr_vcf_fp, curr_output_base): index
+            for index, (curr_vcf_fp, curr_output_base) in enumerate(zip(self._shard_vcf_fps, shard_output_bases))}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif not self.is_reused:
+            # don't mask the original error with any raised while finishing up
+            self._executor.shutdown(wait=True)
+            shutil.rmtree(self._shards_dir, ignore_errors=True)
+
+    def iter_finished_shard_output_fps(self):
+        """Yield the path of each shard's txt output as soon as its table_annovar.pl process finishes.
+
+        Yields:
+            str: Path to a shard's ANNOVAR txt output, in the order the shards finish.
+
+        Raises:
+            RuntimeError: If table_annovar.pl fails on a shard.
+        """
+        if self.is_reused:
+            yield self.output_fp
+            return
+
+        for curr_future in concurrent.futures.as_completed(self._shard_indices_by_future):
+            yield self._get_shard_output_fp(curr_future)
+
+    def close(self):
+        """Wait for every shard to finish, write the combined output and its manifest, and remove the shard files.
+
+        Raises:
+            RuntimeError: If table_annovar.pl failed on any shard.
+        """
+        if self.is_reused:
+            return
+
+        try:
+            concurrent.futures.wait(self._shard_indices_by_future)
+            for curr_future in self._shard_indices_by_future:
+                self._get_shard_output_fp(curr_future)
+            self._concatenate_annovar_txt_outputs(self._shard_output_fps, self.output_fp)
+            self._annovar_wrapper._write_manifest(self.output_fp, self._inputs_fingerprint)
+        finally:
+            self._executor.shutdown(wait=True)
+            shutil.rmtree(self._shards_dir, ignore_errors=True)
+
+    def _get_shard_output_fp(self, future):
+        shard_index = self._shard_indices_by_future[future]
+        return_code = future.result()
+        if return_code != 0:
+            raise RuntimeError("Annovar failed with exit code {0} when annotating '{1}'".format(
+                return_code, self._shard_vcf_fps[shard_index]))
+        return self._shard_output_fps[shard_index]
+
+    @staticmethod
+    def _concatenate_annovar_txt_outputs(input_fps, output_fp):
+        """Write the header line of the first input, then the data lines of every input in order."""
 
-        return command_list
+        with open(output_fp, 'w') as output_file_obj:
+            for index, curr_input_fp in enumerate(input_fps):
+                with open(curr_input_fp, 'r') as input_file_obj:
+                    header_line = input_file_obj.readline()
+                    if index == 0:
+                        output_file_obj.write(header_line)
+                    shutil.copyfileobj(input_file_obj, output_file_obj)
@@ -0,0 +1,113 @@
+"""This module exposes a pure-python writer for BGZF, the blocked gzip format produced by bgzip and read by tabix.
+
+A BGZF file is a series of gzip members, each holding at most 64 KB of uncompressed data and recording its own
+compressed size in a gzip extra field, followed by an empty end-of-file member.  It is therefore also a valid
+multi-member gzip file that any gzip reader can decompress.
+"""
+
+# built-in libraries
+import struct
+import zlib
+
+# largest amount of uncompressed data per block for which the compressed block is guaranteed to fit in 64 KB
+_MAX_BLOCK_DATA_SIZE = 65280
+_BLOCK_HEADER_FORMAT = "<4sIBBHBBHH"  # magic+method+flags, mtime, xfl, os, xlen, 'B', 'C', subfield len, block size-1
+_BLOCK_HEADER_SIZE = struct.calcsize(_BLOCK_HEADER_FORMAT)
+_BLOCK_TRAILER_FORMAT = "<II"  # crc32, uncompressed size
+_BLOCK_TRAILER_SIZE = struct.calcsize(_BLOCK_TRAILER_FORMAT)
+_EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+class BgzfWriter(object):
+    """Binary file-like object that writes BGZF-compressed data to a file.
+
+    Use as a context manager, or call close() when done writing; the end-of-file block is written on close.
+
+    Args:
+      output_fp(str): path of the file to write
+      compression_level(int, optional): zlib compression level.  Defaults to DEFAULT_COMPRESSION_LEVEL
+
+    """
+
+    DEFAULT_COMPRESSION_LEVEL = 6
+
+    def __init__(self, output_fp, compression_level=DEFAULT_COMPRESSION_LEVEL):
+        self._compression_level = compression_level
+        self._buffer = bytearray()
+        self._file_obj = open(output_fp, 'wb')
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def writable(self):
+        return True
+
+    def readable(self):
+        return False
+
+    def seekable(self):
+        return False
+
+    def write(self, data):
+        """Buffer data, writing out a block whenever a full block's worth has accumulated
+
+        Args:
+          data(bytes): data to write
+
+        Returns:
+          int: number of bytes written
+
+        """
+
+        self._buffer.extend(data)
+        while len(self._buffer) >= _MAX_BLOCK_DATA_SIZE:
+            self._write_block(bytes(self._buffer[:_MAX_BLOCK_DATA_SIZE]))
+            del self._buffer[:_MAX_BLOCK_DATA_SIZE]
+        return len(data)
+
+    def flush(self):
+        """Write out any buffered data as a (possibly short) block
+
+        Args:
+
+        Returns:
+          None
+
+        """
+
+        if len(self._buffer) > 0:
+            self._write_block(bytes(self._buffer))
+            self._buffer = bytearray()
+        self._file_obj.flush()
+
+    def close(self):
+        """Write out any buffered data and the end-of-file block, and close the file
+
+        Args:
+
+        Returns:
+          None
+
+        """
+
+        if self.closed:
+            return
+        try:
+            self.flush()
+            self._file_obj.write(_EOF_BLOCK)
+        finally:
+            self._file_obj.close()
+            self.closed = True
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(self._compression_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        compressed_data = compressor.compress(data) + compressor.flush()
+        block_size = _BLOCK_HEADER_SIZE + len(compressed_data) + _BLOCK_TRAILER_SIZE
+        self._file_obj.write(struct.pack(_BLOCK_HEADER_FORMAT, b"\x1f\x8b\x08\x04", 0, 0, 255, 6, ord("B"), ord("C"),
+                                         2, block_size - 1))
+        self._file_obj.write(compressed_data)
+        self._file_obj.write(struct.pack(_BLOCK_TRAILER_FORMAT, zlib.crc32(data) & 0xffffffff, len(data)))
@@ -3,15 +3,44 @@ from __future__ import division, print_function
 # built-in libraries
 import itertools
 import logging
+import datetime
+import multiprocessing.util
+import os
+import threading
 import time
 
 # third-party libraries
 import myvariant
 import pymongo
+import pymongo.errors
 import vcf
 
 # project libraries
 from VAPr.annovar_output_parsing import AnnovarTxtParser, AnnovarAnnotatedVariant
+from VAPr.mongo_bulk_writing import StreamingBulkWriter
+from VAPr.myvariant_caching import MyVariantInfoCache
+from VAPr.myvariant_mirror import MyVariantInfoMirror
+
+# TODO: someday: refactor myvariant fields into external file so easy to modify which are pulled
+MYVARIANT_FIELDS = [
+    'cadd.1000g',
+    'cadd.esp',
+    'cadd.phred',
+    'cadd.gerp',
+    'cadd.polyphen',
+    'cadd.sift',
+    'dbsnp.rsid',
+    'cosmic.cosmic_id',
+    'cosmic.tumor_site',
+    'clinvar.rcv.accession',
+    'clinvar.rcv.clinical_significance',
+    'clinvar.rcv.conditions',
+    'civic.description',
+    'civic.evidence_items',
+    'cgi',
+    'gwassnps',
+    'wellderly.alleles'
+]
 
 
 class AnnotationJobParamsIndices:
@@ -23,58 +52,521 @@ class AnnotationJobParamsIndices:
     GENOME_BUILD_VERSION_INDEX = 5
     VERBOSE_LEVEL_INDEX = 6
     SAMPLE_LIST_INDEX = 7
+    CHUNK_START_OFFSET_INDEX = 8
+    MYVARIANT_CACHE_FP_INDEX = 9
+    MYVARIANT_MIRROR_FP_INDEX = 10
+    STORAGE_MODE_INDEX = 11
+    SPARSE_SAMPLES_INDEX = 12
+    INPUT_FINGERPRINT_INDEX = 13
 
     # TODO: someday: refactor so one doesn't have to remember to add new indices to the below function
     @classmethod
     def get_num_possible_indices(cls):
         max_index = max(cls.CHUNK_INDEX_INDEX, cls.FILE_PATH_INDEX, cls.CHUNK_SIZE_INDEX, cls.DB_NAME_INDEX,
                         cls.COLLECTION_NAME_INDEX, cls.GENOME_BUILD_VERSION_INDEX, cls.VERBOSE_LEVEL_INDEX,
-                        cls.SAMPLE_LIST_INDEX)
+                        cls.SAMPLE_LIST_INDEX, cls.CHUNK_START_OFFSET_INDEX, cls.MYVARIANT_CACHE_FP_INDEX,
+                        cls.MYVARIANT_MIRROR_FP_INDEX, cls.STORAGE_MODE_INDEX, cls.SPARSE_SAMPLES_INDEX,
+                        cls.INPUT_FINGERPRINT_INDEX)
         return max_index+1
 
 
+class StorageModes:
+    INSERT = "insert"  # insert every variant as a new document
+    REPLACE = "replace"  # upsert every variant, replacing any existing document with the same hgvs_id
+    # add the samples of every variant to any existing document with the same hgvs_id, inserting only new variants;
+    # MyVariant.info annotations are fetched only for the new variants
+    MERGE_SAMPLES = "merge_samples"
+
+
+# Every chunk stored successfully is recorded in a ledger collection named for the annotated collection plus this
+# suffix.  Chunks are identified by a fingerprint of the contents of the file they were read from, not by its path,
+# since the same path (e.g. of an ANNOVAR shard) may hold different variants from one run to the next.
+CHUNK_LEDGER_COLLECTION_SUFFIX = "_chunk_ledger"
+_LEDGER_INPUT_FINGERPRINT_KEY = "input_fingerprint"
+_LEDGER_FILE_PATH_KEY = "file_path"
+_LEDGER_CHUNK_SIZE_KEY = "chunk_size"
+_LEDGER_CHUNK_INDEX_KEY = "chunk_index"
+_LEDGER_COMPLETED_AT_KEY = "completed_at"
+
+# Information about an annotated collection as a whole is kept in a metadata collection named for the annotated
+# collection plus this suffix.  Its sample roster document lists every sample whose genotypes have been stored to the
+# annotated collection, and which of those were stored sparsely (i.e., only in the variants for which they have a
+# non-reference genotype), so that a sample's absence from a variant can be interpreted.
+METADATA_COLLECTION_SUFFIX = "_metadata"
+SAMPLE_ROSTER_ID = "sample_roster"
+SAMPLE_IDS_KEY = "sample_ids"
+SPARSE_SAMPLE_IDS_KEY = "sparse_sample_ids"
+
+
+# Mongo client shared by every chunk stored by this (worker) process; set up by initialize_worker_process
+_worker_mongo_client = None
+
+# MyVariant.info caches shared by every chunk fetched by this process (and all its threads), keyed by cache file path;
+# made by _get_process_myvariant_cache and closed by close_myvariant_caches
+_process_myvariant_caches = {}
+_process_myvariant_caches_pid = None
+_process_myvariant_caches_lock = threading.Lock()
+
+
+def initialize_worker_process(num_mongo_clients=None):
+    """Set up a worker process of the annotation pool: make the one mongo client it will use for all its chunks.
+
+    The client is closed when the worker process exits normally (i.e., when the pool is closed and joined).
+
+    Args:
+      num_mongo_clients(multiprocessing.Value, optional): shared counter of mongo clients opened, incremented here
+
+    Returns:
+      None
+
+    """
+
+    global _worker_mongo_client
+    _worker_mongo_client = pymongo.MongoClient(maxPoolSize=None, waitQueueTimeoutMS=200)
+    multiprocessing.util.Finalize(None, _close_worker_mongo_client, exitpriority=10)
+
+    if num_mongo_clients is not None:
+        with num_mongo_clients.get_lock():
+            num_mongo_clients.value += 1
+    logging.info("Opened mongo client for annotation worker process {0}".format(os.getpid()))
+
+
+def _close_worker_mongo_client():
+    global _worker_mongo_client
+    if _worker_mongo_client is not None:
+        _worker_mongo_client.close()
+        _worker_mongo_client = None
+        logging.info("Closed mongo client for annotation worker process {0}".format(os.getpid()))
+
+
+def close_myvariant_caches():
+    """Close the MyVariant.info caches opened by this process to fetch chunks' annotations.
+
+    This is also done automatically when the process exits; a cache closed here is reopened if it is needed again.
+
+    Args:
+
+    Returns:
+      None
+
+    """
+
+    with _process_myvariant_caches_lock:
+        if _process_myvariant_caches_pid == os.getpid():
+            for curr_cache in _process_myvariant_caches.values():
+                curr_cache.close()
+        _process_myvariant_caches.clear()
+
+
+def _get_process_myvariant_cache(myvariant_cache_fp):
+    global _process_myvariant_caches_pid
+
+    with _process_myvariant_caches_lock:
+        if _process_myvariant_caches_pid != os.getpid():
+            # caches inherited from the parent of a forked process hold connections this process mustn't use
+            _process_myvariant_caches.clear()
+            _process_myvariant_caches_pid = os.getpid()
+            multiprocessing.util.Finalize(None, close_myvariant_caches, exitpriority=10)
+
+        result = _process_myvariant_caches.get(myvariant_cache_fp)
+        if result is None:
+            result = _process_myvariant_caches[myvariant_cache_fp] = MyVariantInfoCache(myvariant_cache_fp)
+    return result
+
+
+def _get_job_param(job_params_tuple, param_index):
+    # Optional params may be missing from the end of job tuples built before they existed; treat those as None
+    if len(job_params_tuple) > param_index:
+        return job_params_tuple[param_index]
+    return None
+
+
 def collect_chunk_annotations_and_store(job_params_tuple):
-    db_name = job_params_tuple[AnnotationJobParamsIndices.DB_NAME_INDEX]
-    collection_name = job_params_tuple[AnnotationJobParamsIndices.COLLECTION_NAME_INDEX]
-    variant_dicts_to_store = _collect_chunk_annotations(job_params_tuple)
-    _store_annotations_to_db(variant_dicts_to_store, db_name, collection_name)
+    # All the stages of a chunk run one after the other in the calling process.  VaprAnnotator instead runs each stage
+    # on its own pool of workers (see VaprAnnotator._run_annotation_pipeline), so that chunks are read, fetched and
+    # stored at once.
+    _, hgvs_ids_list, annovar_variants = read_chunk_variants(job_params_tuple)
+    _, myvariants_variants, annovar_variants = fetch_chunk_myvariant_annotations(
+        job_params_tuple, hgvs_ids_list, annovar_variants, client=_worker_mongo_client)
+    merge_and_store_chunk_annotations(job_params_tuple, myvariants_variants, annovar_variants)
 
 
-def _collect_chunk_annotations(job_params_tuple):
+# The three functions below are the stages of collect_chunk_annotations_and_store, and of VaprAnnotator's annotation
+# pipeline; the latter two may be called from several threads at once.
+def read_chunk_variants(job_params_tuple):
+    """Read the chunk of variants described by a job params tuple.
+
+    Args:
+      job_params_tuple(tuple): job parameters, indexed by AnnotationJobParamsIndices
+
+    Returns:
+      tuple: the job params tuple, the list of HGVS ids in the chunk, and the list of ANNOVAR annotation dicts for the
+        chunk (or None if the job has no sample names, i.e. the input is a vcf rather than ANNOVAR output)
+
+    """
+
     chunk_index = job_params_tuple[AnnotationJobParamsIndices.CHUNK_INDEX_INDEX]
     chunk_size = job_params_tuple[AnnotationJobParamsIndices.CHUNK_SIZE_INDEX]
     file_path = job_params_tuple[AnnotationJobParamsIndices.FILE_PATH_INDEX]
-    genome_build_version = job_params_tuple[AnnotationJobParamsIndices.GENOME_BUILD_VERSION_INDEX]
-    verbose_level = job_params_tuple[AnnotationJobParamsIndices.VERBOSE_LEVEL_INDEX]
+    sample_names_list = _get_job_param(job_params_tuple, AnnotationJobParamsIndices.SAMPLE_LIST_INDEX)
+    chunk_start_offset = _get_job_param(job_params_tuple, AnnotationJobParamsIndices.CHUNK_START_OFFSET_INDEX)
+    sparse_samples = bool(_get_job_param(job_params_tuple, AnnotationJobParamsIndices.SPARSE_SAMPLES_INDEX))
 
     with open(file_path, 'r') as input_file_obj:
-        if len(job_params_tuple) > AnnotationJobParamsIndices.SAMPLE_LIST_INDEX:
-            merge_variants = True
-            sample_names_list = job_params_tuple[AnnotationJobParamsIndices.SAMPLE_LIST_INDEX]
+        if sample_names_list is not None:
             hgvs_ids_list, annovar_variants = AnnovarTxtParser.read_chunk_of_annotations_to_dicts_list(
-                input_file_obj, sample_names_list, chunk_index, chunk_size)
+                input_file_obj, sample_names_list, chunk_index, chunk_size, chunk_start_offset, sparse_samples)
         else:
-            merge_variants = False
             annovar_variants = None
-            hgvs_ids_list = _get_hgvs_ids_from_vcf(input_file_obj, chunk_index, chunk_size)
+            hgvs_ids_list = _get_hgvs_ids_from_vcf(input_file_obj, chunk_index, chunk_size, chunk_start_offset)
+
+    return job_params_tuple, hgvs_ids_list, annovar_variants
+
+
+def fetch_chunk_myvariant_annotations(job_params_tuple, hgvs_ids_list, annovar_variants, client=None):
+    """Fetch the MyVariant.info annotations for a chunk of variants read by read_chunk_variants.
+
+    In MERGE_SAMPLES storage mode, variants already stored in the collection are not fetched; each gets a dict holding
+    only its HGVS id instead, since storing it will only add samples to the existing document.
+
+    Args:
+      job_params_tuple(tuple): job parameters, indexed by AnnotationJobParamsIndices
+      hgvs_ids_list(list): HGVS ids of the variants in the chunk
+      annovar_variants(list or None): ANNOVAR annotation dicts for the chunk, passed through unchanged
+      client(pymongo.MongoClient, optional): mongo client with which to look up stored variants in MERGE_SAMPLES
+        storage mode; if None, one is made (and closed) here
+
+    Returns:
+      tuple: the job params tuple, the list of MyVariant.info annotation dicts (one per HGVS id), and annovar_variants
+
+    """
+
+    genome_build_version = job_params_tuple[AnnotationJobParamsIndices.GENOME_BUILD_VERSION_INDEX]
+    verbose_level = job_params_tuple[AnnotationJobParamsIndices.VERBOSE_LEVEL_INDEX]
+    myvariant_cache_fp = _get_job_param(job_params_tuple, AnnotationJobParamsIndices.MYVARIANT_CACHE_FP_INDEX)
+    myvariant_mirror_fp = _get_job_param(job_params_tuple, AnnotationJobParamsIndices.MYVARIANT_MIRROR_FP_INDEX)
+    storage_mode = _get_job_param(job_params_tuple, AnnotationJobParamsIndices.STORAGE_MODE_INDEX)
+
+    stored_hgvs_ids = set()
+    if storage_mode == StorageModes.MERGE_SAMPLES:
+        db_name = job_params_tuple[AnnotationJobParamsIndices.DB_NAME_INDEX]
+        collection_name = job_params_tuple[AnnotationJobParamsIndices.COLLECTION_NAME_INDEX]
+        stored_hgvs_ids = _get_stored_hgvs_ids(hgvs_ids_list, db_name, collection_name, client)
+    hgvs_ids_to_fetch = [x for x in hgvs_ids_list if x not in stored_hgvs_ids]
+
+    fetched_variants = []
+    if len(hgvs_ids_to_fetch) > 0:
+        # a local mirror, if given, stands in for the MyVariant.info web service
+        myvariant_mirror = None if myvariant_mirror_fp is None else MyVariantInfoMirror(myvariant_mirror_fp)
+        try:
+            fetched_variants = _get_myvariantinfo_annotations_dict(
+                hgvs_ids_to_fetch, genome_build_version, verbose_level, myvariant_cache_fp=myvariant_cache_fp,
+                myvariant_client=myvariant_mirror)
+        finally:
+            if myvariant_mirror is not None:
+                myvariant_mirror.close()
+
+    if len(stored_hgvs_ids) == 0:
+        myvariants_variants = fetched_variants
+    else:
+        fetched_variants_iter = iter(fetched_variants)
+        myvariants_variants = [{AnnovarAnnotatedVariant.HGVS_ID_KEY: x} if x in stored_hgvs_ids
+                               else next(fetched_variants_iter) for x in hgvs_ids_list]
+
+    return job_params_tuple, myvariants_variants, annovar_variants
+
+
+def merge_and_store_chunk_annotations(job_params_tuple, myvariants_variants, annovar_variants, client=None):
+    """Merge the MyVariant.info and ANNOVAR annotations for a chunk of variants, store them to mongo db, and record the
+    chunk as complete in the chunk ledger.
+
+    Each variant is merged only when the mongo writer takes it, and is written in the writer's next batch, so the merged
+    chunk is never held as a whole.
+
+    Args:
+      job_params_tuple(tuple): job parameters, indexed by AnnotationJobParamsIndices
+      myvariants_variants(list): MyVariant.info annotation dicts for the chunk; emptied as they are stored
+      annovar_variants(list or None): ANNOVAR annotation dicts for the chunk, in the same order, or None if there are
+        none to merge; emptied as they are stored
+      client(pymongo.MongoClient, optional): mongo client with which to store the chunk; if None, the worker
+        process's client (see initialize_worker_process) is used, or if there is none, one is made (and closed) here
+
+    Returns:
+      None
+
+    """
+
+    db_name = job_params_tuple[AnnotationJobParamsIndices.DB_NAME_INDEX]
+    collection_name = job_params_tuple[AnnotationJobParamsIndices.COLLECTION_NAME_INDEX]
+    storage_mode = _get_job_param(job_params_tuple, AnnotationJobParamsIndices.STORAGE_MODE_INDEX)
+    variant_dicts_to_store = _iter_merged_chunk_annotations(myvariants_variants, annovar_variants)
+
+    if client is None:
+        client = _worker_mongo_client
+    owns_client = client is None
+    if owns_client:
+        client = pymongo.MongoClient(maxPoolSize=None, waitQueueTimeoutMS=200)
+
+    try:
+        _store_annotations_to_db(variant_dicts_to_store, db_name, collection_name, client=client,
+                                 storage_mode=storage_mode)
+        _record_chunk_completion(job_params_tuple, client)
+    finally:
+        if owns_client:
+            client.close()
+
+
+def get_chunk_ledger_collection(client, db_name, collection_name):
+    """Get the ledger collection recording which chunks have been stored to an annotated collection.
+
+    Args:
+      client(pymongo.MongoClient): mongo client
+      db_name(str): name of the database holding the annotated collection
+      collection_name(str): name of the annotated collection
+
+    Returns:
+      pymongo.collection.Collection: the ledger collection
+
+    """
+
+    db = getattr(client, db_name)
+    return getattr(db, collection_name + CHUNK_LEDGER_COLLECTION_SUFFIX)
+
+
+def get_completed_chunk_indices(ledger_collection, file_path, chunk_size, input_fingerprint):
+    """Get the indices of the chunks of a file already stored successfully, according to a chunk ledger.
+
+    Args:
+      ledger_collection(pymongo.collection.Collection): the ledger collection
+      file_path(str): path to the file being annotated
+      chunk_size(int): number of variants per chunk
+      input_fingerprint(str): fingerprint of the file's contents
+
+    Returns:
+      set: indices of the completed chunks
+
+    Raises:
+      ValueError: if the ledger records chunks of a file at the same path but with different contents (or recorded
+        before the ledger held fingerprints), since which of the current file's variants were stored can't be known
+
+    """
+
+    chunk_size_filter = {_LEDGER_CHUNK_SIZE_KEY: chunk_size}
+    for curr_doc in ledger_collection.find(dict(chunk_size_filter, **{_LEDGER_FILE_PATH_KEY: file_path}),
+                                           {_LEDGER_INPUT_FINGERPRINT_KEY: 1, "_id": 0}):
+        if curr_doc.get(_LEDGER_INPUT_FINGERPRINT_KEY) != input_fingerprint:
+            raise ValueError("Can't resume annotation of '{0}': its contents differ from those of the file at that path "
+                             "whose chunks were stored before (e.g., because it was annotated with a different "
+                             "num_annovar_processes); annotate without resume instead".format(file_path))
+
+    ledger_docs = ledger_collection.find(dict(chunk_size_filter, **{_LEDGER_INPUT_FINGERPRINT_KEY: input_fingerprint}),
+                                         {_LEDGER_CHUNK_INDEX_KEY: 1, "_id": 0})
+    return set(curr_doc[_LEDGER_CHUNK_INDEX_KEY] for curr_doc in ledger_docs)
 
-    myvariants_variants = _get_myvariantinfo_annotations_dict(hgvs_ids_list, genome_build_version,
-                                                              verbose_level)
 
+def reset_chunk_ledger(ledger_collection, file_path, chunk_size, input_fingerprint):
+    """Forget any chunks of a file recorded as complete by an earlier run, whether recorded for the same path or the
+    same contents, and index the ledger for lookups.
+
+    Args:
+      ledger_collection(pymongo.collection.Collection): the ledger collection
+      file_path(str): path to the file being annotated
+      chunk_size(int): number of variants per chunk
+      input_fingerprint(str): fingerprint of the file's contents
+
+    Returns:
+      None
+
+    """
+
+    ensure_chunk_ledger_index(ledger_collection)
+    ledger_collection.delete_many({_LEDGER_FILE_PATH_KEY: file_path, _LEDGER_CHUNK_SIZE_KEY: chunk_size})
+    ledger_collection.delete_many({_LEDGER_INPUT_FINGERPRINT_KEY: input_fingerprint,
+                                   _LEDGER_CHUNK_SIZE_KEY: chunk_size})
+
+
+def ensure_chunk_ledger_index(ledger_collection):
+    """Create (if they don't exist) the unique index on the ledger's chunk keys and the index on file paths
+
+    Args:
+      ledger_collection(pymongo.collection.Collection): the ledger collection
+
+    Returns:
+      None
+
+    """
+
+    ledger_collection.create_index([(_LEDGER_INPUT_FINGERPRINT_KEY, pymongo.ASCENDING),
+                                    (_LEDGER_CHUNK_SIZE_KEY, pymongo.ASCENDING),
+                                    (_LEDGER_CHUNK_INDEX_KEY, pymongo.ASCENDING)], unique=True)
+    ledger_collection.create_index([(_LEDGER_FILE_PATH_KEY, pymongo.ASCENDING),
+                                    (_LEDGER_CHUNK_SIZE_KEY, pymongo.ASCENDING)])
+
+
+def ensure_hgvs_id_index(collection, unique=False):
+    """Create (if it doesn't exist) the index on hgvs_id by which upserts look variants up.
+
+    A unique index stops concurrent upserts of the same new variant (such as from different chunks, in MERGE_SAMPLES
+    storage mode) from each inserting a document for it; it replaces any existing non-unique hgvs_id index.
+
+    Args:
+      collection(pymongo.collection.Collection): the annotated collection
+      unique(bool, optional): whether the index must be unique (Default value = False)
+
+    Returns:
+      None
+
+    Raises:
+      ValueError: if a unique index is requested but the collection already holds more than one document for some
+        hgvs_id
+
+    """
+
+    hgvs_id_keys_list = [(AnnovarAnnotatedVariant.HGVS_ID_KEY, pymongo.ASCENDING)]
+    for curr_index_name, curr_index_info in collection.index_information().items():
+        if [tuple(x) for x in curr_index_info["key"]] == hgvs_id_keys_list:
+            if curr_index_info.get("unique", False) or not unique:
+                return
+            # mongo db won't hold two indexes differing only in uniqueness
+            collection.drop_index(curr_index_name)
+
+    try:
+        collection.create_index(hgvs_id_keys_list, unique=unique)
+    except pymongo.errors.DuplicateKeyError:
+        # put back the index for lookups
+        collection.create_index(hgvs_id_keys_list)
+        raise ValueError("Can't merge samples into collection '{0}': it holds more than one document for some "
+                         "hgvs_id".format(collection.full_name))
+
+
+def get_metadata_collection(client, db_name, collection_name):
+    """Get the collection holding metadata (such as the sample roster) about an annotated collection.
+
+    Args:
+      client(pymongo.MongoClient): mongo client
+      db_name(str): name of the database holding the annotated collection
+      collection_name(str): name of the annotated collection
+
+    Returns:
+      pymongo.collection.Collection: the metadata collection
+
+    """
+
+    db = getattr(client, db_name)
+    return getattr(db, collection_name + METADATA_COLLECTION_SUFFIX)
+
+
+def record_sample_roster(metadata_collection, sample_names_list, sparse_samples=False):
+    """Add samples to the sample roster of an annotated collection, keeping any samples already on it.
+
+    Args:
+      metadata_collection(pymongo.collection.Collection): the metadata collection
+      sample_names_list(list): names of the samples whose genotypes are being stored
+      sparse_samples(bool, optional): True if the samples are being stored sparsely (Default value = False)
+
+    Returns:
+      None
+
+    """
+
+    added_ids_by_key = {SAMPLE_IDS_KEY: {"$each": list(sample_names_list)}}
+    if sparse_samples:
+        added_ids_by_key[SPARSE_SAMPLE_IDS_KEY] = {"$each": list(sample_names_list)}
+    metadata_collection.update_one({"_id": SAMPLE_ROSTER_ID}, {"$addToSet": added_ids_by_key}, upsert=True)
+
+
+def get_sample_roster(metadata_collection):
+    """Get the sample roster of an annotated collection.
+
+    Args:
+      metadata_collection(pymongo.collection.Collection): the metadata collection
+
+    Returns:
+      dict: the sorted ids of all the samples stored (under SAMPLE_IDS_KEY) and of those stored sparsely (under
+        SPARSE_SAMPLE_IDS_KEY); both are empty if no roster has been recorded
+
+    """
+
+    roster_doc = metadata_collection.find_one({"_id": SAMPLE_ROSTER_ID}) or {}
+    return {SAMPLE_IDS_KEY: sorted(roster_doc.get(SAMPLE_IDS_KEY, [])),
+            SPARSE_SAMPLE_IDS_KEY: sorted(roster_doc.get(SPARSE_SAMPLE_IDS_KEY, []))}
+
+
+def _record_chunk_completion(job_params_tuple, client):
+    db_name = job_params_tuple[AnnotationJobParamsIndices.DB_NAME_INDEX]
+    collection_name = job_params_tuple[AnnotationJobParamsIndices.COLLECTION_NAME_INDEX]
+    chunk_key = {_LEDGER_INPUT_FINGERPRINT_KEY: _get_job_param(job_params_tuple,
+                                                                AnnotationJobParamsIndices.INPUT_FINGERPRINT_INDEX),
+                 _LEDGER_CHUNK_SIZE_KEY: job_params_tuple[AnnotationJobParamsIndices.CHUNK_SIZE_INDEX],
+                 _LEDGER_CHUNK_INDEX_KEY: job_params_tuple[AnnotationJobParamsIndices.CHUNK_INDEX_INDEX]}
+
+    ledger_collection = get_chunk_ledger_collection(client, db_name, collection_name)
+    ledger_collection.update_one(chunk_key, {"$set": {
+        _LEDGER_FILE_PATH_KEY: job_params_tuple[AnnotationJobParamsIndices.FILE_PATH_INDEX],
+        _LEDGER_COMPLETED_AT_KEY: datetime.datetime.utcnow()}}, upsert=True)
+
+
+def _get_stored_hgvs_ids(hgvs_ids_list, db_name, collection_name, client=None):
+    owns_client = client is None
+    if owns_client:
+        client = pymongo.MongoClient(maxPoolSize=None, waitQueueTimeoutMS=200)
+
+    try:
+        collection = getattr(getattr(client, db_name), collection_name)
+        hgvs_id_key = AnnovarAnnotatedVariant.HGVS_ID_KEY
+        stored_docs = collection.find({hgvs_id_key: {"$in": list(set(hgvs_ids_list))}}, {hgvs_id_key: 1, "_id": 0})
+        result = set(curr_doc[hgvs_id_key] for curr_doc in stored_docs)
+    finally:
+        if owns_client:
+            client.close()
+
+    return result
+
+
+def _collect_chunk_annotations(job_params_tuple):
+    _, hgvs_ids_list, annovar_variants = read_chunk_variants(job_params_tuple)
+    _, myvariants_variants, annovar_variants = fetch_chunk_myvariant_annotations(job_params_tuple, hgvs_ids_list,
+                                                                                 annovar_variants)
+    return _merge_chunk_annotations(myvariants_variants, annovar_variants)
+
+
+def _merge_chunk_annotations(myvariants_variants, annovar_variants):
     result = myvariants_variants
-    if merge_variants:
+    if annovar_variants is not None:
         result = []
-        for i in range(0, len(hgvs_ids_list)):
+        for i in range(0, len(myvariants_variants)):
             result.append(_merge_annovar_and_myvariant_dicts(myvariants_variants[i], annovar_variants[i]))
 
     return result
 
 
-def _get_hgvs_ids_from_vcf(vcf_file_obj, chunk_index, chunk_size):
+def _iter_merged_chunk_annotations(myvariants_variants, annovar_variants):
+    # Like _merge_chunk_annotations, but yields the merged dicts one at a time, removing each from the input lists
+    # first so that a stored document can be freed without waiting for the rest of the chunk to be stored.
+    myvariants_variants.reverse()
+    if annovar_variants is not None:
+        annovar_variants.reverse()
+
+    while len(myvariants_variants) > 0:
+        curr_variant_dict = myvariants_variants.pop()
+        if annovar_variants is not None:
+            curr_variant_dict = _merge_annovar_and_myvariant_dicts(curr_variant_dict, annovar_variants.pop())
+        yield curr_variant_dict
+
+
+def _get_hgvs_ids_from_vcf(vcf_file_obj, chunk_index, chunk_size, chunk_start_offset=None):
     reader = vcf.Reader(vcf_file_obj)
     hgvs_ids = []
 
-    for record in itertools.islice(reader, chunk_index * chunk_size, (chunk_index + 1) * chunk_size):
+    # The reader has consumed the header at this point; if the byte offset of the chunk's first record is known,
+    # jump straight there rather than reading (and discarding) every record before the chunk.
+    if chunk_start_offset is not None:
+        vcf_file_obj.seek(chunk_start_offset)
+        chunk_records = itertools.islice(reader, chunk_size)
+    else:
+        chunk_records = itertools.islice(reader, chunk_index * chunk_size, (chunk_index + 1) * chunk_size)
+
+    for record in chunk_records:
         hgvs_id = myvariant.format_hgvs(record.CHROM, record.POS, record.REF, str(record.ALT[0]))
 
         # ensure syntax consistency for chromosome M variants
@@ -90,36 +582,35 @@ def _get_hgvs_ids_from_vcf(vcf_file_obj, chunk_index, chunk_size):
     return hgvs_ids
 
 
-# TODO: someday: refactor myvariant fields into external file so easy to modify which are pulled
-def _get_myvariantinfo_annotations_dict(hgvs_ids_list, genome_build_version, verbose_level, num_failed_attempts=0):
-    """ Retrieve variants from MyVariant.info"""
+def _get_myvariantinfo_annotations_dict(hgvs_ids_list, genome_build_version, verbose_level, num_failed_attempts=0,
+                                        myvariant_cache_fp=None, myvariant_client=None):
+    """ Retrieve variants from MyVariant.info (or the myvariant_client standing in for it, such as a local mirror),
+    or from the local annotation cache if one is given"""
+
+    def fetch_func(missing_hgvs_ids_list):
+        return _fetch_myvariantinfo_annotations_dicts(missing_hgvs_ids_list, genome_build_version, verbose_level,
+                                                      num_failed_attempts, myvariant_client)
+
+    if myvariant_cache_fp is None:
+        return fetch_func(hgvs_ids_list)
+
+    myvariant_cache = _get_process_myvariant_cache(myvariant_cache_fp)
+    myvariantinfo_dicts_list = myvariant_cache.get_annotations(hgvs_ids_list, genome_build_version, MYVARIANT_FIELDS,
+                                                               fetch_func)
+    logging.debug("MyVariant.info cache hits: {0}, misses: {1} so far in process {2}".format(
+        myvariant_cache.num_hits, myvariant_cache.num_misses, os.getpid()))
+    return myvariantinfo_dicts_list
+
 
+def _fetch_myvariantinfo_annotations_dicts(hgvs_ids_list, genome_build_version, verbose_level,
+                                           num_failed_attempts=0, myvariant_client=None):
     max_failed_attempts = 5
-    myvariant_fields = [
-        'cadd.1000g',
-        'cadd.esp',
-        'cadd.phred',
-        'cadd.gerp',
-        'cadd.polyphen',
-        'cadd.sift',
-        'dbsnp.rsid',
-        'cosmic.cosmic_id',
-        'cosmic.tumor_site',
-        'clinvar.rcv.accession',
-        'clinvar.rcv.clinical_significance',
-        'clinvar.rcv.conditions',
-        'civic.description',
-        'civic.evidence_items',
-        'cgi',
-        'gwassnps',
-        'wellderly.alleles'
-    ]
 
     be_verbose = verbose_level >= 2
-    mv = myvariant.MyVariantInfo()
+    mv = myvariant.MyVariantInfo() if myvariant_client is None else myvariant_client
     try:
         myvariantinfo_dicts_list = mv.getvariants(hgvs_ids_list, verbose=int(be_verbose), as_dataframe=False,
-                                                  fields=myvariant_fields, assembly=genome_build_version)
+                                                  fields=MYVARIANT_FIELDS, assembly=genome_build_version)
     except ValueError as unrecoverable_error:
         # If myvariant.info returned a value error, recalling with the same values won't help so error out now
         raise unrecoverable_error
@@ -131,8 +622,10 @@ def _get_myvariantinfo_annotations_dict(hgvs_ids_list, genome_build_version, ver
         if num_failed_attempts < max_failed_attempts:
             time.sleep(5)
             logging.info("Retrying MyVariant.info fetch")
-            myvariantinfo_dicts_list = _get_myvariantinfo_annotations_dict(hgvs_ids_list, genome_build_version,
-                                                                           verbose_level, num_failed_attempts)
+            myvariantinfo_dicts_list = _fetch_myvariantinfo_annotations_dicts(
+                hgvs_ids_list, genome_build_version, verbose_level, num_failed_attempts, myvariant_client)
+            # the retry has already removed the unwanted keys
+            return myvariantinfo_dicts_list
         else:
             # give up and raise error
             raise error
@@ -163,38 +656,55 @@ def _merge_annovar_and_myvariant_dicts(myvariantinfo_annotations_dict, annovar_a
     return annovar_annotations_dict
 
 
-def _store_annotations_to_db(annotation_dicts_list, db_name, collection_name, client=None, num_failed_attempts=0):
-    max_failed_attempts = 5
+def _store_annotations_to_db(annotation_dicts, db_name, collection_name, client=None, storage_mode=None):
+    # annotation_dicts may be any iterable (such as a generator), which is consumed as the documents are written; only
+    # a few batches of them are held by the writer at once, on top of whatever the iterable itself holds.
+    # In REPLACE and MERGE_SAMPLES storage modes, storing is idempotent: rewriting the same variants doesn't create
+    # duplicates.
+    logging.info('Parsing Buffer...')
 
-    if client is None:
+    # only close the client at the end if it was made here; a client passed in may be shared with other callers
+    owns_client = client is None
+    if owns_client:
         client = pymongo.MongoClient(maxPoolSize=None, waitQueueTimeoutMS=200)
 
     db = getattr(client, db_name)
     collection = getattr(db, collection_name)
 
-    logging.info('Parsing Buffer...')
-    if len(annotation_dicts_list) == 0:
-        logging.info('List of annotations to store is empty; continuing.')
-        return
-
     try:
-        collection.insert_many(annotation_dicts_list, ordered=False)
-    except Exception as error:
-        if "Connection refused" in str(error) and num_failed_attempts < max_failed_attempts:
-            num_failed_attempts += 1
-            logging.error('Error connecting to mongodb: ' + str(error))
-            logging.info('Retrying connection to mongodb')
-            time.sleep(4)
-
-            _store_annotations_to_db(annotation_dicts_list, db_name, collection_name, client=client,
-                                     num_failed_attempts=num_failed_attempts)  # Recurse!
-        else:
-            error_msg = "Encountered error '{0}' when attempting to store the following annotations " \
-                        "to mongo db collection '{1}': '{2}'".format(str(error), collection.full_name,
-                                                                     annotation_dicts_list)
-            raise RuntimeError(error_msg)
+        with StreamingBulkWriter(collection) as writer:
+            for curr_annotation_dict in annotation_dicts:
+                if storage_mode is None or storage_mode == StorageModes.INSERT:
+                    writer.add(curr_annotation_dict)
+                else:
+                    writer.add_request(_make_upsert_request(curr_annotation_dict, storage_mode),
+                                       curr_annotation_dict)
+
+        if writer.num_docs_written == 0:
+            logging.info('List of annotations to store is empty; continuing.')
+    finally:
+        if owns_client:
+            try:
+                client.close()
+            except:
+                pass  # if the client is already closed, just move along
+
+
+def _make_upsert_request(annotation_dict, storage_mode):
+    hgvs_id_filter = {AnnovarAnnotatedVariant.HGVS_ID_KEY: annotation_dict[AnnovarAnnotatedVariant.HGVS_ID_KEY]}
+
+    if storage_mode == StorageModes.REPLACE:
+        result = pymongo.ReplaceOne(hgvs_id_filter, annotation_dict, upsert=True)
+    elif storage_mode == StorageModes.MERGE_SAMPLES:
+        # Everything but the samples is only written if the variant is new; the samples are added to any already
+        # there, skipping exact duplicates (such as those from a rerun of the same input).
+        variant_fields_dict = dict(annotation_dict)
+        samples_list = variant_fields_dict.pop(AnnovarAnnotatedVariant.SAMPLES_KEY, None)
+        update_dict = {"$setOnInsert": variant_fields_dict}
+        if samples_list is not None:
+            update_dict["$addToSet"] = {AnnovarAnnotatedVariant.SAMPLES_KEY: {"$each": samples_list}}
+        result = pymongo.UpdateOne(hgvs_id_filter, update_dict, upsert=True)
+    else:
+        raise ValueError("Unrecognized storage mode '{0}'".format(storage_mode))
 
-    try:
-        client.close()
-    except:
-        pass  # if the client is already closed, just move along
+    return result
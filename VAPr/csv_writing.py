@@ -0,0 +1,455 @@
+"""This module exposes functions for streaming variant documents to a csv file in fixed-size batches.
+
+The csv columns are fixed before any rows are written: they are the top-level fields of the variants (other than
+mongo's internal '_id') in order of first appearance, found either in cheap first passes over a collection (which
+transfer only field names and types, not the variants), from a list of variants already in memory, or while copying
+variants that can be read only once (such as a generator) to a temporary spool file to be read back.  Each batch is
+then flattened to exactly those columns and appended to the file, so memory use is bounded by the batch size rather
+than by the number of variants.  The output is the same as pandas' to_csv of a dataframe of all the variants at once:
+the columns pandas would infer as floats (numbers with any float or missing value) are found in the first passes too,
+and written as floats in every batch.
+"""
+
+# built-in libraries
+import collections
+import gzip
+import io
+import itertools
+import pickle
+
+# third-party libraries
+import pandas
+
+# project libraries
+from VAPr.bgzf_writing import BgzfWriter
+
+_ID_KEY = "_id"
+
+
+class CsvCompressions:
+    NONE = None
+    GZIP = "gzip"
+    BGZIP = "bgzip"  # blocked gzip, as written by bgzip; readable by any gzip reader
+
+
+DEFAULT_BATCH_SIZE = 1000
+
+# mongo db $type names of the values pandas reads into a float column (if any is a float or any value is missing)
+_MONGO_NUMERIC_TYPES = {"int", "long", "double"}
+_MONGO_NULL_TYPE = "null"
+
+
+def get_collection_csv_columns(collection, filter_dictionary=None):
+    """Find the csv columns for the variants in a collection without transferring the variants themselves.
+
+    Args:
+      collection(pymongo.collection.Collection): collection of variants
+      filter_dictionary(dict, optional): mongodb filter selecting the variants to consider (Default value = None)
+
+    Returns:
+      tuple(list, set): top-level field names of the selected variants, other than '_id', in order of first
+        appearance; and those of them that are written as floats
+
+    """
+
+    match_stages = [{"$match": filter_dictionary}] if filter_dictionary else []
+    pipeline = match_stages + [
+        {"$project": {_ID_KEY: 0, "field": {"$objectToArray": "$$ROOT"}}},
+        {"$unwind": "$field"},
+        {"$group": {_ID_KEY: "$field.k", "types": {"$addToSet": {"$type": "$field.v"}},
+                    "num_variants": {"$sum": 1}}}]
+    fields_list = list(collection.aggregate(pipeline, allowDiskUse=True))
+
+    num_variants = collection.count_documents(filter_dictionary or {})
+    float_columns = set(x[_ID_KEY] for x in fields_list if
+                        _is_float_column(x["types"], x["num_variants"] < num_variants))
+    cursor = _aggregate_field_names(collection, match_stages)
+    try:
+        columns_list = _get_fields_in_order_of_appearance((x["fields"] for x in cursor),
+                                                          set(x[_ID_KEY] for x in fields_list))
+    finally:
+        cursor.close()
+    return columns_list, float_columns - {_ID_KEY}
+
+
+def get_collection_csv_columns_by_sample(collection, sample_id_field):
+    """Find the csv columns for each sample's variants in a collection without transferring the variants themselves.
+
+    Args:
+      collection(pymongo.collection.Collection): collection of variants
+      sample_id_field(str): dotted path of the sample ids in each variant, such as 'samples.sample_id'
+
+    Returns:
+      tuple(dict, dict): top-level field names (other than '_id') of the variants of each sample, in order of first
+        appearance; and those of them that are written as floats; each keyed by sample id
+
+    """
+
+    sample_id_stages = [
+        {"$project": {_ID_KEY: 0, "sample_id": "$" + sample_id_field, "field": {"$objectToArray": "$$ROOT"}}},
+        {"$unwind": "$sample_id"}]
+    num_variants_by_sample = {x[_ID_KEY]: x["num_variants"] for x in collection.aggregate(
+        sample_id_stages + [{"$group": {_ID_KEY: "$sample_id", "num_variants": {"$sum": 1}}}], allowDiskUse=True)}
+    fields_list = list(collection.aggregate(sample_id_stages + [
+        {"$unwind": "$field"},
+        {"$group": {_ID_KEY: {"sample_id": "$sample_id", "field": "$field.k"},
+                    "types": {"$addToSet": {"$type": "$field.v"}}, "num_variants": {"$sum": 1}}}], allowDiskUse=True))
+
+    field_names_by_sample = collections.defaultdict(set)
+    float_columns_by_sample = {x: set() for x in num_variants_by_sample}
+    for curr_field_dict in fields_list:
+        curr_sample_id = curr_field_dict[_ID_KEY]["sample_id"]
+        curr_field_name = curr_field_dict[_ID_KEY]["field"]
+        field_names_by_sample[curr_sample_id].add(curr_field_name)
+        if curr_field_name != _ID_KEY and _is_float_column(
+                curr_field_dict["types"], curr_field_dict["num_variants"] < num_variants_by_sample[curr_sample_id]):
+            float_columns_by_sample[curr_sample_id].add(curr_field_name)
+
+    # find the order of each sample's fields in one pass over the variants' field names, stopping once all are found
+    columns_by_sample = {x: [] for x in num_variants_by_sample}
+    remaining_field_names_by_sample = {x: y - {_ID_KEY} for x, y in field_names_by_sample.items()}
+    cursor = _aggregate_field_names(collection, [], sample_id_field)
+    try:
+        for curr_fields_dict in cursor:
+            curr_sample_ids = curr_fields_dict.get("sample_ids", [])
+            if not isinstance(curr_sample_ids, list):
+                curr_sample_ids = [curr_sample_ids]
+            for curr_sample_id in curr_sample_ids:
+                curr_remaining_field_names = remaining_field_names_by_sample.get(curr_sample_id)
+                if curr_remaining_field_names:
+                    columns_by_sample[curr_sample_id].extend(_pop_new_field_names(curr_fields_dict["fields"],
+                                                                                  curr_remaining_field_names))
+                    if len(curr_remaining_field_names) == 0:
+                        del remaining_field_names_by_sample[curr_sample_id]
+            if len(remaining_field_names_by_sample) == 0:
+                break
+    finally:
+        cursor.close()
+
+    return columns_by_sample, float_columns_by_sample
+
+
+def get_variants_csv_columns(variant_dicts):
+    """Find the csv columns for variants that are already in memory.
+
+    Args:
+      variant_dicts(list): variant dictionaries
+
+    Returns:
+      tuple(list, set): top-level field names of the variants, other than '_id', in order of first appearance; and
+        those of them that are written as floats
+
+    """
+
+    columns_finder = _CsvColumnsFinder()
+    for curr_variant_dict in variant_dicts:
+        columns_finder.add(curr_variant_dict)
+    return columns_finder.get_columns()
+
+
+def spool_variants_csv_columns(variant_dicts_iter, spool_file_obj):
+    """Find the csv columns for variants that can be read only once, copying them to a spool file as they are read.
+
+    Writing a csv needs its columns before its first row, so variants from a generator or cursor (which would be used
+    up by finding the columns) are copied to the spool file, from which iter_spooled_variants reads them back.
+
+    Args:
+      variant_dicts_iter(Iterable[dict]): variants, such as one of the VaprDataset iter_* generators
+      spool_file_obj(file): binary file open for reading and writing, such as a tempfile.TemporaryFile
+
+    Returns:
+      tuple(list, set): top-level field names of the variants, other than '_id', in order of first appearance; and
+        those of them that are written as floats
+
+    """
+
+    columns_finder = _CsvColumnsFinder()
+    for curr_variant_dict in variant_dicts_iter:
+        columns_finder.add(curr_variant_dict)
+        pickle.dump(curr_variant_dict, spool_file_obj, protocol=pickle.HIGHEST_PROTOCOL)
+    return columns_finder.get_columns()
+
+
+def iter_spooled_variants(spool_file_obj):
+    """Read back, in order, the variants copied to a spool file by spool_variants_csv_columns.
+
+    Args:
+      spool_file_obj(file): the spool file passed to spool_variants_csv_columns
+
+    Yields:
+      dict: the next variant
+
+    """
+
+    spool_file_obj.seek(0)
+    while True:
+        try:
+            yield pickle.load(spool_file_obj)
+        except EOFError:
+            break
+
+
+def write_variants_csv(variant_dicts_iter, columns_list, output_fp, compression=CsvCompressions.NONE,
+                       batch_size=DEFAULT_BATCH_SIZE, float_columns=None):
+    """Write variants to a csv file one batch at a time.
+
+    The output has a leading unnamed index column numbering the variants from 0, and one column per entry in
+    columns_list; fields of a variant that are not in columns_list are not written, and columns the variant lacks are
+    left empty.  Values in float_columns are written as floats, and all others as they are, without type inference
+    within a batch, so the output is the same no matter how the variants are split into batches; with the columns found
+    by one of the get_*_csv_columns functions, it is the same as pandas' to_csv of a dataframe of all the variants.
+
+    Args:
+      variant_dicts_iter(Iterable[dict]): variants to write, such as one of the VaprDataset iter_* generators
+      columns_list(list): names of the fields to write, in order
+      output_fp(str): path of the csv file to write
+      compression(str, optional): one of the CsvCompressions values (Default value = CsvCompressions.NONE)
+      batch_size(int, optional): number of variants to hold in memory at once (Default value = DEFAULT_BATCH_SIZE)
+      float_columns(set, optional): names of the fields to write as floats (Default value = None)
+
+    Returns:
+      int: number of variants written
+
+    """
+
+    num_variants = 0
+    with _open_csv_for_writing(output_fp, compression) as file_obj:
+        variant_dicts_iter = iter(variant_dicts_iter)
+        while True:
+            batch_list = list(itertools.islice(variant_dicts_iter, batch_size))
+            if len(batch_list) == 0:
+                break
+
+            _write_csv_batch(file_obj, batch_list, columns_list, num_variants, float_columns)
+            num_variants += len(batch_list)
+
+        if num_variants == 0:
+            # still write the header, as to_csv would for an empty dataframe
+            pandas.DataFrame(columns=columns_list).to_csv(file_obj)
+
+    return num_variants
+
+
+class CsvFanOutWriter(object):
+    """Write variants to many csv files at once, such as one per sample, in a single pass over the variants.
+
+    Each file is written exactly as write_variants_csv would write the variants added for it.  Variants are buffered
+    per file and written in batches; when the total number buffered reaches max_num_buffered_variants, the file with
+    the most is written out.  At most max_num_open_files files are held open at once, the least recently written being
+    closed (and later reopened for appending) as needed.  Use as a context manager, or call close() when done adding.
+
+    Args:
+      output_fps_by_key(dict): path of the csv file to write for each key
+      columns_by_key(dict): names of the fields to write for each key, in order
+      compression(str, optional): one of the CsvCompressions values, except BGZIP (Default value = CsvCompressions.NONE)
+      max_num_open_files(int, optional): maximum number of files open at once (Default value = DEFAULT_MAX_NUM_OPEN_FILES)
+      max_num_buffered_variants(int, optional): maximum number of variants held in memory across all files (Default
+        value = DEFAULT_MAX_NUM_BUFFERED_VARIANTS)
+      float_columns_by_key(dict, optional): names of the fields to write as floats for each key (Default value = None)
+
+    """
+
+    DEFAULT_MAX_NUM_OPEN_FILES = 64
+    DEFAULT_MAX_NUM_BUFFERED_VARIANTS = 10000
+
+    def __init__(self, output_fps_by_key, columns_by_key, compression=CsvCompressions.NONE,
+                 max_num_open_files=DEFAULT_MAX_NUM_OPEN_FILES,
+                 max_num_buffered_variants=DEFAULT_MAX_NUM_BUFFERED_VARIANTS, float_columns_by_key=None):
+        if compression == CsvCompressions.BGZIP:
+            # a BGZF file can't be reopened for appending without leaving an end-of-file block in the middle
+            raise ValueError("Csv compression '{0}' is not supported when writing many files".format(compression))
+
+        self._output_fps_by_key = output_fps_by_key
+        self._columns_by_key = columns_by_key
+        self._float_columns_by_key = {} if float_columns_by_key is None else float_columns_by_key
+        self._compression = compression
+        self._max_num_open_files = max_num_open_files
+        self._max_num_buffered_variants = max_num_buffered_variants
+        self._buffered_variants_by_key = collections.defaultdict(list)
+        self._num_buffered_variants = 0
+        self._num_variants_written_by_key = collections.Counter()
+        self._open_files_by_key = collections.OrderedDict()  # least recently written first
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._close_files()
+
+    @property
+    def num_variants_written_by_key(self):
+        """Number of variants written to each file so far
+
+        Args:
+
+        Returns:
+          collections.Counter: number of variants written, keyed by file key
+
+        """
+
+        return self._num_variants_written_by_key
+
+    def add(self, key, variant_dict):
+        """Add a variant to be written to the file for a key
+
+        Args:
+          key: key of the file to write to; must be in output_fps_by_key
+          variant_dict(dict): variant to write
+
+        Returns:
+          None
+
+        """
+
+        self._buffered_variants_by_key[key].append(variant_dict)
+        self._num_buffered_variants += 1
+        if self._num_buffered_variants >= self._max_num_buffered_variants:
+            largest_key = max(self._buffered_variants_by_key, key=lambda x: len(self._buffered_variants_by_key[x]))
+            self._write_buffered_variants(largest_key)
+
+    def close(self):
+        """Write all buffered variants and close all files; every key gets a file, even if no variants were added
+
+        Args:
+
+        Returns:
+          None
+
+        """
+
+        try:
+            for curr_key in self._output_fps_by_key:
+                if len(self._buffered_variants_by_key.get(curr_key, [])) > 0 or \
+                        self._num_variants_written_by_key[curr_key] == 0:
+                    self._write_buffered_variants(curr_key)
+        finally:
+            self._close_files()
+
+    def _write_buffered_variants(self, key):
+        batch_list = self._buffered_variants_by_key.pop(key, [])
+        self._num_buffered_variants -= len(batch_list)
+
+        file_obj = self._open_files_by_key.pop(key, None)
+        if file_obj is None:
+            if len(self._open_files_by_key) >= self._max_num_open_files:
+                _, least_recent_file_obj = self._open_files_by_key.popitem(last=False)
+                least_recent_file_obj.close()
+            file_obj = _open_csv_for_writing(self._output_fps_by_key[key], self._compression,
+                                             append=self._num_variants_written_by_key[key] > 0)
+        self._open_files_by_key[key] = file_obj
+
+        columns_list = self._columns_by_key[key]
+        if len(batch_list) > 0:
+            _write_csv_batch(file_obj, batch_list, columns_list, self._num_variants_written_by_key[key],
+                             self._float_columns_by_key.get(key))
+            self._num_variants_written_by_key[key] += len(batch_list)
+        elif self._num_variants_written_by_key[key] == 0:
+            pandas.DataFrame(columns=columns_list).to_csv(file_obj)
+
+    def _close_files(self):
+        while len(self._open_files_by_key) > 0:
+            _, file_obj = self._open_files_by_key.popitem()
+            file_obj.close()
+
+
+class _CsvColumnsFinder(object):
+    # Finds csv columns (see get_variants_csv_columns) in a single pass over the variants, one variant at a time
+    def __init__(self):
+        self._columns_list = []
+        self._type_names_by_column = {_ID_KEY: set()}
+        self._num_variants_by_column = collections.Counter()
+        self._num_variants = 0
+
+    def add(self, variant_dict):
+        for curr_column, curr_value in variant_dict.items():
+            curr_type_names = self._type_names_by_column.get(curr_column)
+            if curr_type_names is None:
+                curr_type_names = self._type_names_by_column[curr_column] = set()
+                self._columns_list.append(curr_column)
+            curr_type_names.add(_get_mongo_type_name(curr_value))
+            self._num_variants_by_column[curr_column] += 1
+        self._num_variants += 1
+
+    def get_columns(self):
+        float_columns = set(x for x in self._columns_list if _is_float_column(
+            self._type_names_by_column[x], self._num_variants_by_column[x] < self._num_variants))
+        return list(self._columns_list), float_columns
+
+
+def _write_csv_batch(file_obj, batch_list, columns_list, start_index, float_columns=None):
+    batch_dataframe = pandas.DataFrame(batch_list, columns=columns_list, dtype=object)
+    for curr_column in (float_columns or ()):
+        if curr_column in batch_dataframe:
+            batch_dataframe[curr_column] = batch_dataframe[curr_column].astype(float)
+    batch_dataframe.index = pandas.RangeIndex(start_index, start_index + len(batch_list))
+    batch_dataframe.to_csv(file_obj, header=(start_index == 0))
+
+
+def _is_float_column(mongo_type_names, is_missing_any):
+    # as pandas infers: numbers are read into a float column if any is a float or any is missing (null or absent)
+    non_null_type_names = set(mongo_type_names) - {_MONGO_NULL_TYPE}
+    if len(non_null_type_names) == 0 or not non_null_type_names.issubset(_MONGO_NUMERIC_TYPES):
+        return False
+    return "double" in non_null_type_names or is_missing_any or _MONGO_NULL_TYPE in mongo_type_names
+
+
+def _get_mongo_type_name(value):
+    # the mongo db $type name of a python value, as far as _is_float_column needs to know it
+    if isinstance(value, bool):
+        result = "bool"
+    elif isinstance(value, int):
+        result = "long"
+    elif isinstance(value, float):
+        result = _MONGO_NULL_TYPE if value != value else "double"  # NaN, as pandas reads it, is missing
+    elif value is None:
+        result = _MONGO_NULL_TYPE
+    else:
+        result = "object"
+    return result
+
+
+def _aggregate_field_names(collection, match_stages, sample_id_field=None):
+    # yields the top-level field names of each variant (and its sample ids, if asked for), in natural order
+    project_dict = {_ID_KEY: 0, "fields": {"$map": {"input": {"$objectToArray": "$$ROOT"}, "in": "$$this.k"}}}
+    if sample_id_field is not None:
+        project_dict["sample_ids"] = "$" + sample_id_field
+    return collection.aggregate(match_stages + [{"$project": project_dict}])
+
+
+def _get_fields_in_order_of_appearance(fields_lists_iter, field_names):
+    # Fields in the order in which pandas makes columns of them: the order in which they first appear.  Iteration stops
+    # as soon as all the field names have appeared.
+    result = []
+    remaining_field_names = set(field_names) - {_ID_KEY}
+    if len(remaining_field_names) > 0:
+        for curr_fields_list in fields_lists_iter:
+            result.extend(_pop_new_field_names(curr_fields_list, remaining_field_names))
+            if len(remaining_field_names) == 0:
+                break
+
+    return result
+
+
+def _pop_new_field_names(fields_list, remaining_field_names):
+    result = []
+    for curr_field_name in fields_list:
+        if curr_field_name in remaining_field_names:
+            remaining_field_names.discard(curr_field_name)
+            result.append(curr_field_name)
+    return result
+
+
+def _open_csv_for_writing(output_fp, compression, append=False):
+    mode = 'a' if append else 'w'
+    if compression == CsvCompressions.NONE:
+        return open(output_fp, mode, newline='')
+    elif compression == CsvCompressions.GZIP:
+        # appending adds another gzip member, which gzip readers read as a continuation of the file
+        return gzip.open(output_fp, mode + 't', newline='')
+    elif compression == CsvCompressions.BGZIP:
+        return io.TextIOWrapper(BgzfWriter(output_fp), newline='')
+    else:
+        raise ValueError("Unrecognized csv compression '{0}'".format(compression))
@@ -2,6 +2,18 @@
 
 SAMPLE_ID_SELECTOR = 'samples.sample_id'
 
+# Indexes that let mongo db answer the filters below without scanning the whole collection, as lists of
+# (field, direction) pairs.  Equality-tested fields come before range-tested ones in compound indexes; indexes on fields
+# inside arrays (such as the samples) are multikey.
+FILTER_INDEX_KEYS_LISTS = [
+    [('hgvs_id', 1)],
+    [(SAMPLE_ID_SELECTOR, 1), ('cadd.phred', 1)],  # also serves queries on the sample ids alone
+    [('func_knowngene', 1), ('cadd.phred', 1), ('1000g2015aug_all', 1)],
+    [('genotype_subclass_by_class.heterozygous', 1), ('cadd.phred', 1)],
+    [('clinvar.rcv.accession', 1)],
+    [('cosmic.cosmic_id', 1)]
+]
+
 
 def get_sample_id_filter(sample_name):
     return {SAMPLE_ID_SELECTOR: sample_name}
@@ -95,7 +107,63 @@ def make_rare_deleterious_variants_filter(sample_ids_list=None):
     return result
 
 
+def make_variant_sample_rows_pipeline(sample_ids_list=None, filter_dictionary=None, projection=None):
+    """Aggregation pipeline that produces one row per (variant, sample), each row being its variant with the samples
+    list replaced by just that one sample, as formatting.extract_samples does in python.
+
+    Variants are filtered before the samples are unwound, so that the filter (and the sample ids, if given) can use the
+    indexes in FILTER_INDEX_KEYS_LISTS; the rows are then filtered again to just the requested samples.
+    """
+
+    pre_unwind_and_list = []
+    if filter_dictionary:
+        pre_unwind_and_list.append(filter_dictionary)
+    if sample_ids_list is not None:
+        pre_unwind_and_list.append(get_any_of_sample_ids_filter(sample_ids_list))
+
+    result = []
+    if len(pre_unwind_and_list) == 1:
+        result.append({"$match": pre_unwind_and_list[0]})
+    elif len(pre_unwind_and_list) > 1:
+        result.append({"$match": {"$and": pre_unwind_and_list}})
+
+    result.append({"$unwind": "$samples"})
+    if sample_ids_list is not None:
+        result.append({"$match": get_any_of_sample_ids_filter(sample_ids_list)})
+    if projection:
+        result.append({"$project": projection})
+    return result
+
+
 def _append_sample_id_constraint_if_needed(and_list, sample_ids_list):
     if sample_ids_list is not None:
         and_list.append(get_any_of_sample_ids_filter(sample_ids_list))
     return {"$and": and_list}
+
+
+def get_plan_stages(explain_dict):
+    """Get the names of all the stages (e.g., 'IXSCAN', 'FETCH', 'COLLSCAN') in the winning plan of a query's explain()
+    output, outermost first.
+    """
+
+    query_planner_dict = explain_dict.get("queryPlanner", explain_dict)
+    result = []
+    _append_plan_stages(query_planner_dict.get("winningPlan", {}), result)
+    return result
+
+
+def is_index_backed(explain_dict):
+    """Whether the winning plan in a query's explain() output uses indexes rather than scanning the whole collection"""
+
+    return "COLLSCAN" not in get_plan_stages(explain_dict)
+
+
+def _append_plan_stages(plan_node, stages_list):
+    if isinstance(plan_node, dict):
+        if "stage" in plan_node:
+            stages_list.append(plan_node["stage"])
+        for curr_value in plan_node.values():
+            _append_plan_stages(curr_value, stages_list)
+    elif isinstance(plan_node, list):
+        for curr_item in plan_node:
+            _append_plan_stages(curr_item, stages_list)
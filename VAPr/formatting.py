@@ -1,3 +1,9 @@
+import collections
+import itertools
+import os
+import tempfile
+
+import numpy as np
 import pandas as pd
 """ 
 formatting.py: formats the output from VAPr such that the output matches MAF format, allowing for downstream processing 
@@ -289,10 +295,35 @@ def unnest_semicolon_values(data_list_in):
 
 ### 7. RE-ARRANGE AND RENAME COLUMNS
 
+VARIANT_CLASSIFICATIONS_BY_FUNC = {
+    'intronic': 'Intron',
+    'intergenic': 'IGR',
+    'UTR3': "3'UTR",
+    "UTR5": "5'UTR",
+    'downstream': "3'Flank",
+    'upstream': "5'Flank",
+    'splicing': 'Splice_Site', 'ncRNA_exonic': 'RNA',
+    'ncRNA_intronic': 'RNA', 'ncRNA_UTR3': 'RNA',
+    'ncRNA_UTR5': 'RNA', 'ncRNA': 'RNA', }
+
+VARIANT_CLASSIFICATIONS_BY_EXONIC_FUNC = {
+    'nonsynonymous SNV': "Missense_Mutation",
+    'synonymous SNV': "Silent",
+    'stopgain': "Nonsense_Mutation",
+    'stoploss': "Nonstop_Mutation",
+    'frameshift insertion': "Frame_Shift_Ins",
+    'frameshift deletion': "Frame_Shift_Del",
+    'nonframeshift insertion': "In_Frame_Ins",
+    'nonframeshift deletion': "In_Frame_Del"}
+
+
+MAF_REQUIRED_COLUMNS = ['gene_knowngene', 'chr', 'start', 'end', 'ref', 'alt', 'Variant_Type', 'func_knowngene',
+                        'samples.sample_id', 'dbsnp.rsid', 't_ref_count', 't_alt_count', 'aachange_knowngene']
+
+
 # Re-arrange and rename columns to match the MAF format
 def change_cols(df):
-    required_cols = ['gene_knowngene', 'chr', 'start', 'end', 'ref', 'alt', 'Variant_Type', 'func_knowngene',
-                     'samples.sample_id', 'dbsnp.rsid', 't_ref_count', 't_alt_count', 'aachange_knowngene']
+    required_cols = MAF_REQUIRED_COLUMNS
     for col in required_cols:
         if col not in df.columns.values:
             df[col] = ""
@@ -317,33 +348,14 @@ def change_cols(df):
                             'aachange_knowngene': 'Protein_Change'
                             })
 
-    df['Variant_Classification'] = df['Variant_Classification'].replace({
-        'intronic': 'Intron',
-        'intergenic': 'IGR',
-        'UTR3': "3'UTR",
-        "UTR5": "5'UTR",
-        'downstream': "3'Flank",
-        'upstream': "5'Flank",
-        'splicing': 'Splice_Site', 'ncRNA_exonic': 'RNA',
-        'ncRNA_intronic': 'RNA', 'ncRNA_UTR3': 'RNA',
-        'ncRNA_UTR5': 'RNA', 'ncRNA': 'RNA', })
-
-    mask = df.exonicfunc_knowngene == 'nonsynonymous SNV'
-    df.loc[mask, 'Variant_Classification'] = "Missense_Mutation"
-    mask = df.exonicfunc_knowngene == 'synonymous SNV'
-    df.loc[mask, 'Variant_Classification'] = "Silent"
-    mask = df.exonicfunc_knowngene == 'stopgain'
-    df.loc[mask, 'Variant_Classification'] = "Nonsense_Mutation"
-    mask = df.exonicfunc_knowngene == 'stoploss'
-    df.loc[mask, 'Variant_Classification'] = "Nonstop_Mutation"
-    mask = df.exonicfunc_knowngene == 'frameshift insertion'
-    df.loc[mask, 'Variant_Classification'] = "Frame_Shift_Ins"
-    mask = df.exonicfunc_knowngene == 'frameshift deletion'
-    df.loc[mask, 'Variant_Classification'] = "Frame_Shift_Del"
-    mask = df.exonicfunc_knowngene == 'nonframeshift insertion'
-    df.loc[mask, 'Variant_Classification'] = "In_Frame_Ins"
-    mask = df.exonicfunc_knowngene == 'nonframeshift deletion'
-    df.loc[mask, 'Variant_Classification'] = "In_Frame_Del"
+    # map (rather than replace) the annovar function and exonic function values, leaving unmapped values unchanged;
+    # a recognized exonic function takes precedence over the function
+    classification = df['Variant_Classification']
+    classification = classification.map(VARIANT_CLASSIFICATIONS_BY_FUNC).fillna(classification)
+    if 'exonicfunc_knowngene' in df.columns:
+        exonic_classification = df['exonicfunc_knowngene'].map(VARIANT_CLASSIFICATIONS_BY_EXONIC_FUNC)
+        classification = exonic_classification.where(exonic_classification.notna(), classification)
+    df['Variant_Classification'] = classification
 
     return df
 
@@ -351,27 +363,192 @@ def change_cols(df):
 ### 8. WRAPPER
 
 # Formats the output from VAPr such that the output matches MAF format, allowing for downstream processing and
-# analysis in Maftools A wrapper for the functions above
+# analysis in Maftools.  Gives the same result as applying the functions above in turn (extract_samples, unnest_dict,
+# unnest_list, unnest_dict, samples_AD, varType, unnest_semicolon_values and change_cols), but without a full copy of
+# the dataset per step; see format_maf_batch.
 # Input: a VAPr output list
 # Output: a formatted dataframe ready to be saved as a MAF file
 def maf_formatter(dataset_list_in):
-    import pandas as pd
-    k0 = dataset_list_in.copy()
-    k1 = extract_samples(k0)
-    k2 = unnest_dict(k1)
-    k3 = unnest_list(k2)
-    k4 = unnest_dict(k3)
-    k5 = samples_AD(k4)
-    k6 = varType(k5)
-    k7 = unnest_semicolon_values(k6)
+    return format_maf_batch(dataset_list_in)
 
-    df = pd.DataFrame(data=k7)
-    maf = change_cols(df)
 
-    return maf
+### 9. COLUMNAR FORMATTING
+
+DEFAULT_MAF_BATCH_SIZE = 1000
+
+
+# Formats a batch of VAPr variants exactly as maf_formatter does, but without the chain of full copies: each variant's
+# annotations are unnested once (rather than once per sample per pass) and the rows are then transformed as columns.
+# Input: a list of VAPr variants
+# Output: a formatted dataframe ready to be saved as a MAF file
+def format_maf_batch(variant_dicts_list):
+    return _format_maf_batch(variant_dicts_list)[0]
+
+
+# Output: the formatted dataframe, and the set of (MAF) names of the required columns that change_cols had to add
+def _format_maf_batch(variant_dicts_list):
+    rows_list = _make_unnested_sample_rows(variant_dicts_list)
+    if len(rows_list) == 0:
+        return change_cols(pd.DataFrame()), set()
+
+    df = pd.DataFrame(data=rows_list)
+
+    # varType adds Variant_Type as the last field of every row, so its column comes right after the first row's fields
+    df.insert(len(rows_list[0]), 'Variant_Type', _get_variant_types(df['ref'], df['alt']))
+
+    # samples_AD replaces samples.AD, in place, with t_ref_count and t_alt_count
+    if 'samples.AD' in df.columns:
+        ad_index = df.columns.get_loc('samples.AD')
+        ad_values = df.pop('samples.AD')
+        df.insert(ad_index, 't_ref_count', pd.Series([x[0] if isinstance(x, list) else np.nan for x in ad_values],
+                                                     index=df.index))
+        df.insert(ad_index + 1, 't_alt_count', pd.Series([x[1] if isinstance(x, list) else np.nan for x in ad_values],
+                                                         index=df.index))
+
+    df = _explode_semicolon_values(df)
+    added_columns_list = [x for x in MAF_REQUIRED_COLUMNS if x not in df.columns]
+    maf_df = change_cols(df)
+    # change_cols renames columns in place, so the added ones are at the same positions in the result
+    added_maf_columns_set = set(maf_df.columns[MAF_REQUIRED_COLUMNS.index(x)] for x in added_columns_list)
+    return maf_df, added_maf_columns_set
+
+
+# Streams VAPr variants (e.g., a list or a mongo db cursor) to a tab-separated MAF file, formatting them a batch at a
+# time.  Formatted batches are spooled to a temporary directory until the full set of columns is known, so the file is
+# the same as that of maf_formatter on all of the variants at once, written with to_csv(sep='\t', index=False).
+# Output: the number of MAF rows written
+def write_maf(variant_dicts, output_fp, batch_size=DEFAULT_MAF_BATCH_SIZE):
+    columns_list = []
+    dtype_kinds_by_column = {}
+    num_batches_by_column = collections.Counter()
+    num_rows = 0
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        batch_fps_list = []
+        variant_dicts_iter = iter(variant_dicts)
+        batch_list = list(itertools.islice(variant_dicts_iter, batch_size))
+        while len(batch_list) > 0:
+            batch_df, added_columns_set = _format_maf_batch(batch_list)
+            if len(batch_df) > 0:
+                num_rows += len(batch_df)
+                for curr_column, curr_dtype in batch_df.dtypes.items():
+                    if curr_column not in dtype_kinds_by_column:
+                        columns_list.append(curr_column)
+                        dtype_kinds_by_column[curr_column] = set()
+                    # a required column change_cols filled with "" would have been empty values in a larger batch
+                    if curr_column not in added_columns_set:
+                        dtype_kinds_by_column[curr_column].add(curr_dtype.kind)
+                        num_batches_by_column[curr_column] += 1
+
+                batch_fps_list.append(os.path.join(temp_dir, "batch_{0}.pkl".format(len(batch_fps_list))))
+                batch_df.to_pickle(batch_fps_list[-1])
+            batch_list = list(itertools.islice(variant_dicts_iter, batch_size))
+
+        # Across the whole dataset, a column of integers that is missing from some rows is one of floats, so integer
+        # columns of batches must be written as floats if the column is missing from (or holds floats in) any other.
+        float_columns_set = set()
+        for curr_column, curr_kinds in dtype_kinds_by_column.items():
+            if 'i' in curr_kinds and curr_kinds.issubset({'i', 'f'}) and \
+                    ('f' in curr_kinds or num_batches_by_column[curr_column] < len(batch_fps_list)):
+                float_columns_set.add(curr_column)
+
+        with open(output_fp, 'w', newline='') as file_obj:
+            if len(batch_fps_list) == 0:
+                format_maf_batch([]).to_csv(file_obj, sep='\t', index=False)
+
+            for curr_batch_index, curr_batch_fp in enumerate(batch_fps_list):
+                batch_df = pd.read_pickle(curr_batch_fp).reindex(columns=columns_list)
+                for curr_column in float_columns_set:
+                    if batch_df[curr_column].dtype.kind == 'i':
+                        batch_df[curr_column] = batch_df[curr_column].astype(float)
+                batch_df.to_csv(file_obj, sep='\t', index=False, header=(curr_batch_index == 0))
+
+    return num_rows
+
+
+# Does the work of extract_samples, unnest_dict, unnest_list and unnest_dict again, in that order, for every variant;
+# the fields outside the samples are unnested just once per variant.
+def _make_unnested_sample_rows(variant_dicts_list):
+    rows_list = []
+    for curr_variant_dict in variant_dicts_list:
+        fields_before_samples = {}
+        fields_after_samples = {}
+        curr_fields = fields_before_samples
+        for key, value in curr_variant_dict.items():
+            if key == 'samples':
+                curr_fields = fields_after_samples
+            else:
+                _unnest_into(curr_fields, {key: value}, "", True, False)
+
+        for curr_sample in curr_variant_dict['samples']:
+            curr_row = fields_before_samples.copy()
+            _unnest_into(curr_row, {'samples': curr_sample}, "", True, False)
+            curr_row.update(fields_after_samples)
+            rows_list.append(curr_row)
+
+    return rows_list
+
+
+# Like unnest_dict_core, but also renames and unnests lists of dictionaries as unnest_list would (once, so lists of
+# dictionaries within those lists are left as they are)
+def _unnest_into(unnested_dict_out, nested_dict_in, prev_key, first_level, lists_unnested):
+    for key, value in nested_dict_in.items():
+        key_name = str(key) if first_level else prev_key + "." + str(key)
+        if type(value) == dict:
+            _unnest_into(unnested_dict_out, value, key_name, False, lists_unnested)
+        elif not lists_unnested and type(value) == list and all(type(x) == dict for x in value):
+            _unnest_into(unnested_dict_out, rename_list_content(value), key_name, False, True)
+        else:
+            unnested_dict_out[key_name] = value
+
+
+# Vectorized varType
+def _get_variant_types(ref_series, alt_series):
+    ref_lengths = ref_series.str.len()
+    alt_lengths = alt_series.str.len()
+    same_lengths = ref_lengths == alt_lengths
+
+    result = pd.Series(np.nan, index=ref_series.index, dtype=object)
+    result[same_lengths & (ref_lengths == 1)] = 'SNP'
+    result[same_lengths & (ref_lengths == 2)] = 'DNP'
+    result[same_lengths & (ref_lengths == 3)] = 'TNP'
+    result[same_lengths & (ref_lengths > 3)] = 'ONP'
+    result[ref_lengths < alt_lengths] = 'INS'
+    result[ref_lengths > alt_lengths] = 'DEL'
+    # re-infer the type as the DataFrame constructor would have for a column of these values
+    return pd.Series(result.tolist(), index=ref_series.index)
+
+
+# Columnar unnest_semicolon_values: one row per gene in gene_knowngene, with func_knowngene and genedetail_knowngene
+# split alongside it only if they hold the same number of values
+def _explode_semicolon_values(df):
+    genes = df['gene_knowngene']
+    multiple_mask = genes.str.contains(';', regex=False).fillna(False).astype(bool)
+    if not multiple_mask.any():
+        return df
+
+    explode_columns_list = ['gene_knowngene', 'func_knowngene']
+    if 'genedetail_knowngene' in df.columns:
+        explode_columns_list.append('genedetail_knowngene')
+
+    df = df.astype({x: object for x in explode_columns_list})
+    gene_lists = genes[multiple_mask].str.split(';')
+    df.loc[multiple_mask, 'gene_knowngene'] = pd.Series(gene_lists.tolist(), index=gene_lists.index, dtype=object)
+    for curr_column in explode_columns_list[1:]:
+        curr_values_lists = []
+        for curr_genes_list, curr_value in zip(gene_lists, df.loc[multiple_mask, curr_column]):
+            curr_split_values = curr_value.split(';') if isinstance(curr_value, str) else [curr_value]
+            if len(curr_split_values) != len(curr_genes_list):
+                curr_split_values = [curr_value] * len(curr_genes_list)
+            curr_values_lists.append(curr_split_values)
+        df.loc[multiple_mask, curr_column] = pd.Series(curr_values_lists, index=gene_lists.index, dtype=object)
+
+    return df.explode(explode_columns_list, ignore_index=True)
+
 
 #########################################################################################
 ### CREATE A LIST OF THE WHOLE DATASET
+# NB: this holds the whole collection in memory; VAPr.vapr_core.VaprDataset.write_maf streams it to a MAF file instead
 def create_whole_dataset_list(MONGODB, COLLECTION):
      #access the mongodb database
     from pymongo import MongoClient
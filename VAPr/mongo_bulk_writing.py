@@ -0,0 +1,218 @@
+"""This module exposes a writer that streams documents into a mongo db collection in bounded-size bulk_write batches."""
+
+# built-in libraries
+import concurrent.futures
+import logging
+import threading
+import time
+
+# third-party libraries
+import bson
+import pymongo
+import pymongo.errors
+
+_DUPLICATE_KEY_ERROR_CODE = 11000
+
+
+class StreamingBulkWriter(object):
+    """Buffer documents and write them to a collection with bulk_write, in batches limited both by number of documents
+    and by estimated encoded (BSON) size, with at most a fixed number of batches being written at any one time.
+
+    Rather than encoding every document (which pymongo does again when writing it), only one document in every
+    SIZE_SAMPLING_INTERVAL is encoded; each of the others is counted as the average size of those sampled so far.  A
+    batch of documents of very uneven sizes may therefore be somewhat larger than max_batch_num_bytes.  (pymongo itself
+    splits each batch into messages small enough for the server, so the limit is on the memory held, not for the
+    server's sake.)
+
+    Adding a document when the maximum number of batches is already in flight blocks until one of them finishes, so the
+    writer never holds more than max_num_in_flight_batches + 1 batches of documents.  It doesn't bound the memory of
+    documents the caller already holds: only a caller adding documents as they are made (e.g., from a generator) writes
+    them in bounded memory.  Use as a context manager, or call close() when done adding documents.
+
+    Args:
+      collection(pymongo.collection.Collection): collection to write to
+      max_batch_num_docs(int, optional): maximum number of documents per batch.  Defaults to DEFAULT_MAX_BATCH_NUM_DOCS
+      max_batch_num_bytes(int, optional): maximum estimated encoded size of the documents in a batch (a single document
+        larger than this is written in a batch of its own).  Defaults to DEFAULT_MAX_BATCH_NUM_BYTES
+      max_num_in_flight_batches(int, optional): maximum number of batches being written at once.  Defaults to
+        DEFAULT_MAX_NUM_IN_FLIGHT_BATCHES
+
+    """
+
+    DEFAULT_MAX_BATCH_NUM_DOCS = 1000
+    DEFAULT_MAX_BATCH_NUM_BYTES = 16 * 1024 * 1024
+    DEFAULT_MAX_NUM_IN_FLIGHT_BATCHES = 2
+    SIZE_SAMPLING_INTERVAL = 16
+    _MAX_FAILED_ATTEMPTS = 5
+
+    def __init__(self, collection, max_batch_num_docs=DEFAULT_MAX_BATCH_NUM_DOCS,
+                 max_batch_num_bytes=DEFAULT_MAX_BATCH_NUM_BYTES,
+                 max_num_in_flight_batches=DEFAULT_MAX_NUM_IN_FLIGHT_BATCHES):
+        self._collection = collection
+        self._max_batch_num_docs = max_batch_num_docs
+        self._max_batch_num_bytes = max_batch_num_bytes
+        self._batch_requests = []
+        self._batch_num_bytes = 0
+        self._num_sampled_docs = 0
+        self._num_sampled_bytes = 0
+        self._num_docs_until_sample = 0  # the first document is always sampled
+        self._in_flight_futures = []
+        self._in_flight_slots = threading.BoundedSemaphore(max_num_in_flight_batches)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_num_in_flight_batches)
+        self._counts_lock = threading.Lock()
+        self.num_docs_written = 0
+        self.num_batches_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # don't mask the original error with any raised while finishing up
+            self._executor.shutdown(wait=True)
+
+    def add(self, document):
+        """Add a document to be inserted, writing out the current batch first if the document wouldn't fit in it.
+
+        Args:
+          document(dict): document to insert
+
+        Returns:
+          None
+
+        """
+
+        self.add_request(pymongo.InsertOne(document), document)
+
+    def add_request(self, write_request, document=None):
+        """Add a bulk_write request (such as a pymongo.ReplaceOne) for a document, batching it as add does.
+
+        Args:
+          write_request(pymongo.operations._WriteOp): the request to write
+          document(dict, optional): the document carried by the request, encoded to estimate batch sizes if it is
+            sampled; if None, the request is counted as the average size of the documents sampled so far (Default
+            value = None)
+
+        Returns:
+          None
+
+        """
+
+        num_bytes = self._estimate_num_bytes(document)
+        if len(self._batch_requests) > 0 and (len(self._batch_requests) >= self._max_batch_num_docs or
+                                              self._batch_num_bytes + num_bytes > self._max_batch_num_bytes):
+            self.flush()
+
+        self._batch_requests.append(write_request)
+        self._batch_num_bytes += num_bytes
+
+    def flush(self):
+        """Start writing the current batch, after waiting for an in-flight slot if all are taken
+
+        Args:
+
+        Returns:
+          None
+
+        """
+
+        if len(self._batch_requests) == 0:
+            return
+
+        self._in_flight_slots.acquire()
+        try:
+            self._check_finished_batches()
+        except Exception:
+            self._in_flight_slots.release()
+            raise
+
+        future = self._executor.submit(self._write_batch, self._batch_requests)
+        future.add_done_callback(lambda _: self._in_flight_slots.release())
+        self._in_flight_futures.append(future)
+        self._batch_requests = []
+        self._batch_num_bytes = 0
+
+    def close(self):
+        """Write any remaining documents and wait for all batches to finish, raising the first error from any of them
+
+        Args:
+
+        Returns:
+          None
+
+        """
+
+        try:
+            self.flush()
+            concurrent.futures.wait(self._in_flight_futures)
+            self._check_finished_batches()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def _estimate_num_bytes(self, document):
+        if document is not None and self._num_docs_until_sample <= 0:
+            result = len(bson.encode(document))
+            self._num_sampled_docs += 1
+            self._num_sampled_bytes += result
+            self._num_docs_until_sample = self.SIZE_SAMPLING_INTERVAL
+        elif self._num_sampled_docs > 0:
+            result = self._num_sampled_bytes / self._num_sampled_docs
+        else:
+            result = 0
+        self._num_docs_until_sample -= 1
+        return result
+
+    def _check_finished_batches(self):
+        still_in_flight_futures = []
+        for curr_future in self._in_flight_futures:
+            if curr_future.done():
+                curr_future.result()  # re-raises any error from writing the batch
+            else:
+                still_in_flight_futures.append(curr_future)
+        self._in_flight_futures = still_in_flight_futures
+
+    def _write_batch(self, write_requests):
+        self._bulk_write(write_requests)
+        with self._counts_lock:
+            self.num_docs_written += len(write_requests)
+            self.num_batches_written += 1
+
+    def _bulk_write(self, write_requests, num_failed_attempts=0):
+        try:
+            self._collection.bulk_write(write_requests, ordered=False)
+        except pymongo.errors.BulkWriteError as error:
+            racing_upserts = self._get_racing_upserts(write_requests, error)
+            if len(racing_upserts) > 0 and num_failed_attempts < self._MAX_FAILED_ATTEMPTS:
+                # Another writer inserted the same new document (as identified by a unique index) between these
+                # upserts' lookups and inserts; the rest of the batch was written, and redoing these updates the
+                # inserted document instead.
+                logging.info("Retrying {0} upserts that raced with other writers".format(len(racing_upserts)))
+                return self._bulk_write(racing_upserts, num_failed_attempts + 1)
+            raise self._make_write_error(error, write_requests)
+        except Exception as error:
+            if "Connection refused" in str(error) and num_failed_attempts < self._MAX_FAILED_ATTEMPTS:
+                logging.error('Error connecting to mongodb: ' + str(error))
+                logging.info('Retrying connection to mongodb')
+                time.sleep(4)
+                return self._bulk_write(write_requests, num_failed_attempts + 1)  # Recurse!
+
+            raise self._make_write_error(error, write_requests)
+
+    @staticmethod
+    def _get_racing_upserts(write_requests, bulk_write_error):
+        # the upserts that failed only on a duplicate key, if those are the batch's only errors
+        details = bulk_write_error.details
+        write_errors = details.get("writeErrors", [])
+        if len(details.get("writeConcernErrors", [])) > 0 or \
+                any(x.get("code") != _DUPLICATE_KEY_ERROR_CODE for x in write_errors):
+            return []
+        result = [write_requests[x["index"]] for x in write_errors]
+        return result if all(getattr(x, "_upsert", False) for x in result) else []
+
+    def _make_write_error(self, error, write_requests):
+        error_msg = "Encountered error '{0}' when attempting to store the following annotations " \
+                    "to mongo db collection '{1}': '{2}'".format(str(error), self._collection.full_name,
+                                                                 write_requests)
+        return RuntimeError(error_msg)
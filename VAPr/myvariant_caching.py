@@ -0,0 +1,241 @@
+"""This module exposes a persistent on-disk cache for MyVariant.info annotations.
+
+Annotations are stored in a SQLite file after they have been cleaned up for storage (see
+chunk_processing._remove_unwanted_keys), keyed by HGVS id, genome assembly and a hash of the list of MyVariant.info fields
+requested, so that variants that recur across runs only have to be fetched over the network once.
+"""
+
+# built-in libraries
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+
+class MyVariantInfoCache(object):
+    """SQLite-backed cache of MyVariant.info annotation dicts, with TTL- and size-based eviction and hit/miss counters.
+
+    Variants MyVariant.info doesn't know (returned with 'notfound' set) are cached too, but go stale after the shorter
+    notfound_ttl_secs, so that records newly added to MyVariant.info are picked up reasonably soon.
+
+    Eviction doesn't run on every put: it runs when the puts made through this object since the last eviction could
+    have taken the cache past max_num_entries, and otherwise at most every EVICTION_INTERVAL_SECS.  Other processes'
+    puts aren't counted, so a cache shared by several processes can briefly hold more than max_num_entries.
+
+    One object may be used from several threads at once.
+
+    Args:
+      cache_fp(str): path to the SQLite cache file; it is created if it doesn't exist
+      ttl_secs(int, optional): number of seconds after which a cached annotation is considered stale.  Defaults to
+        DEFAULT_TTL_SECS
+      max_num_entries(int, optional): maximum number of cached annotations; the oldest are evicted beyond this.
+        Defaults to DEFAULT_MAX_NUM_ENTRIES
+      notfound_ttl_secs(int, optional): number of seconds after which a cached 'notfound' response is considered
+        stale.  Defaults to DEFAULT_NOTFOUND_TTL_SECS
+
+    """
+
+    DEFAULT_TTL_SECS = 30 * 24 * 60 * 60  # 30 days
+    DEFAULT_NOTFOUND_TTL_SECS = 24 * 60 * 60  # 1 day
+    DEFAULT_MAX_NUM_ENTRIES = 10000000
+    EVICTION_INTERVAL_SECS = 10 * 60
+    HITS_KEY = "hits"
+    MISSES_KEY = "misses"
+    NUM_ENTRIES_KEY = "num_entries"
+
+    _HGVS_ID_KEY = "hgvs_id"  # same as AnnovarAnnotatedVariant.HGVS_ID_KEY, the key under which ids are stored
+    _CONNECTION_TIMEOUT_SECS = 60  # many worker processes may share one cache file
+    _MAX_QUERY_PARAMS = 500  # stay well under SQLite's limit on the number of parameters in one statement
+    _NOTFOUND_KEY = "notfound"
+
+    @staticmethod
+    def make_fields_hash(fields_list):
+        """Make a stable hash of a list of MyVariant.info fields, independent of their order.
+
+        Args:
+          fields_list(list): MyVariant.info field names (e.g., 'cadd.phred')
+
+        Returns:
+          str: hex digest identifying the set of fields
+
+        """
+
+        fields_str = json.dumps(sorted(fields_list))
+        return hashlib.sha1(fields_str.encode('utf-8')).hexdigest()
+
+    def __init__(self, cache_fp, ttl_secs=DEFAULT_TTL_SECS, max_num_entries=DEFAULT_MAX_NUM_ENTRIES,
+                 notfound_ttl_secs=DEFAULT_NOTFOUND_TTL_SECS):
+        self._cache_fp = cache_fp
+        self._ttl_secs = ttl_secs
+        self._notfound_ttl_secs = min(notfound_ttl_secs, ttl_secs)
+        self._max_num_entries = max_num_entries
+        self.num_hits = 0
+        self.num_misses = 0
+        # upper bound on the number of entries, as of the last eviction plus everything put through this object since
+        self._max_possible_num_entries = None
+        self._next_eviction_time = 0
+        self._lock = threading.Lock()
+
+        # the lock, not sqlite3, guards the connection against use from several threads at once
+        self._connection = sqlite3.connect(cache_fp, timeout=self._CONNECTION_TIMEOUT_SECS, check_same_thread=False)
+        # write-ahead logging lets worker processes read while another one writes
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS annotations (hgvs_id TEXT NOT NULL, assembly TEXT NOT NULL, "
+                "fields_hash TEXT NOT NULL, stored_at REAL NOT NULL, annotation TEXT NOT NULL, "
+                "is_notfound INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (hgvs_id, assembly, fields_hash))")
+            column_names = [x[1] for x in self._connection.execute("PRAGMA table_info(annotations)").fetchall()]
+            if "is_notfound" not in column_names:
+                # cache files made before notfound responses had their own TTL
+                self._connection.execute(
+                    "ALTER TABLE annotations ADD COLUMN is_notfound INTEGER NOT NULL DEFAULT 0")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS annotations_stored_at ON annotations (stored_at)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            for curr_counter_name in [self.HITS_KEY, self.MISSES_KEY]:
+                self._connection.execute("INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)",
+                                         (curr_counter_name,))
+
+    @property
+    def stats(self):
+        """Hit and miss counts accumulated in the cache file across all processes and runs, plus its size
+
+        Args:
+
+        Returns:
+          dict: number of hits, misses and cached entries
+
+        """
+
+        with self._lock:
+            result = dict(self._connection.execute("SELECT name, value FROM counters").fetchall())
+            result[self.NUM_ENTRIES_KEY] = self._connection.execute(
+                "SELECT COUNT(*) FROM annotations").fetchone()[0]
+        return result
+
+    def close(self):
+        """Close the connection to the cache file
+
+        Args:
+
+        Returns:
+          None
+
+        """
+
+        with self._lock:
+            self._connection.close()
+
+    def get_annotations(self, hgvs_ids_list, assembly, fields_list, fetch_func):
+        """Get annotations for the input ids, calling fetch_func only for those that are not (freshly) cached.
+
+        Args:
+          hgvs_ids_list(list): HGVS ids of the variants to annotate
+          assembly(str): genome build version, such as 'hg19'
+          fields_list(list): MyVariant.info fields requested
+          fetch_func(Callable[[list], list]): function that takes a list of HGVS ids and returns a list of cleaned
+            annotation dicts, each containing its id under the 'hgvs_id' key
+
+        Returns:
+          list: one annotation dict per input id, in the same order as the input ids
+
+        """
+
+        fields_hash = self.make_fields_hash(fields_list)
+        cached_annotations_by_id = self._get_many(hgvs_ids_list, assembly, fields_hash)
+
+        # fetch each missing id only once, even if it occurs more than once in the input
+        missing_ids_list = []
+        missing_ids_set = set()
+        for curr_hgvs_id in hgvs_ids_list:
+            if curr_hgvs_id not in cached_annotations_by_id and curr_hgvs_id not in missing_ids_set:
+                missing_ids_list.append(curr_hgvs_id)
+                missing_ids_set.add(curr_hgvs_id)
+
+        num_hits = len(hgvs_ids_list) - len(missing_ids_list)
+        self._increment_counters(num_hits, len(missing_ids_list))
+
+        if len(missing_ids_list) > 0:
+            fetched_annotations_list = fetch_func(missing_ids_list)
+            self._put_many(fetched_annotations_list, assembly, fields_hash)
+            for curr_annotation_dict in fetched_annotations_list:
+                cached_annotations_by_id[curr_annotation_dict[self._HGVS_ID_KEY]] = json.dumps(curr_annotation_dict)
+
+        # deserialize separately for every occurrence so that no two output dicts share nested objects
+        return [json.loads(cached_annotations_by_id[curr_hgvs_id]) for curr_hgvs_id in hgvs_ids_list]
+
+    def evict(self):
+        """Remove stale annotations, and then the oldest ones if the cache holds more than its maximum size
+
+        Args:
+
+        Returns:
+          int: number of annotations removed
+
+        """
+
+        with self._lock, self._connection:
+            curr_time = time.time()
+            num_removed = self._connection.execute(
+                "DELETE FROM annotations WHERE stored_at < ? OR (is_notfound = 1 AND stored_at < ?)",
+                (curr_time - self._ttl_secs, curr_time - self._notfound_ttl_secs)).rowcount
+            num_entries = self._connection.execute("SELECT COUNT(*) FROM annotations").fetchone()[0]
+            num_excess = num_entries - self._max_num_entries
+            if num_excess > 0:
+                num_removed += self._connection.execute(
+                    "DELETE FROM annotations WHERE rowid IN "
+                    "(SELECT rowid FROM annotations ORDER BY stored_at LIMIT ?)", (num_excess,)).rowcount
+                num_entries -= num_excess
+            self._max_possible_num_entries = num_entries
+            self._next_eviction_time = curr_time + self.EVICTION_INTERVAL_SECS
+
+        if num_removed > 0:
+            logging.info("Evicted {0} annotations from MyVariant.info cache '{1}'".format(num_removed,
+                                                                                          self._cache_fp))
+        return num_removed
+
+    def _get_many(self, hgvs_ids_list, assembly, fields_hash):
+        result = {}
+        curr_time = time.time()
+        unique_ids_list = list(set(hgvs_ids_list))
+
+        with self._lock:
+            for start_index in range(0, len(unique_ids_list), self._MAX_QUERY_PARAMS):
+                curr_ids_list = unique_ids_list[start_index:start_index + self._MAX_QUERY_PARAMS]
+                placeholders = ",".join("?" * len(curr_ids_list))
+                rows = self._connection.execute(
+                    "SELECT hgvs_id, annotation FROM annotations WHERE assembly = ? AND fields_hash = ? AND "
+                    "stored_at >= (CASE is_notfound WHEN 1 THEN ? ELSE ? END) AND hgvs_id IN ({0})".format(
+                        placeholders),
+                    [assembly, fields_hash, curr_time - self._notfound_ttl_secs, curr_time - self._ttl_secs] +
+                    curr_ids_list).fetchall()
+                result.update(rows)
+
+        return result
+
+    def _put_many(self, annotation_dicts_list, assembly, fields_hash):
+        stored_at = time.time()
+        rows = [(curr_dict[self._HGVS_ID_KEY], assembly, fields_hash, stored_at, json.dumps(curr_dict),
+                 int(bool(curr_dict.get(self._NOTFOUND_KEY)))) for curr_dict in annotation_dicts_list]
+        with self._lock:
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO annotations (hgvs_id, assembly, fields_hash, stored_at, annotation, "
+                    "is_notfound) VALUES (?, ?, ?, ?, ?, ?)", rows)
+            if self._max_possible_num_entries is not None:
+                self._max_possible_num_entries += len(rows)
+            needs_eviction = self._max_possible_num_entries is None or \
+                self._max_possible_num_entries > self._max_num_entries or stored_at >= self._next_eviction_time
+        if needs_eviction:
+            self.evict()
+
+    def _increment_counters(self, num_hits, num_misses):
+        with self._lock, self._connection:
+            self.num_hits += num_hits
+            self.num_misses += num_misses
+            self._connection.executemany("UPDATE counters SET value = value + ? WHERE name = ?",
+                                         [(num_hits, self.HITS_KEY), (num_misses, self.MISSES_KEY)])
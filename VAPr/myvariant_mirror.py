@@ -0,0 +1,275 @@
+"""This module exposes a local, read-only mirror of MyVariant.info built from a bulk JSON-lines dump.
+
+The mirror is a single file: a fixed-size header, then one record per variant (its HGVS id, a tab, its JSON document and
+a newline) in sorted HGVS id order, then a table of the byte offsets of those records.  Lookups memory-map the file and
+binary search the offsets table, so they need neither network access nor loading the dump into memory.  A
+MyVariantInfoMirror can be used in place of a myvariant.MyVariantInfo client when annotating.
+
+Build a mirror from the command line with:
+
+    python -m VAPr.myvariant_mirror <dump.json[.gz]> <mirror.idx> --assembly hg19
+"""
+
+# built-in libraries
+import argparse
+import gzip
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+
+_MAGIC = b"VAPRMVM1"
+_HEADER_FORMAT = "<8s16sQQ"  # magic, assembly, number of records, byte offset of the offsets table
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+_OFFSET_FORMAT = "<Q"
+_OFFSET_SIZE = struct.calcsize(_OFFSET_FORMAT)
+_KEY_SEPARATOR = b"\t"
+_RECORD_SEPARATOR = b"\n"
+_ID_KEY = "_id"
+_LICENSE_KEY = "_license"
+_GZIP_EXTENSION = ".gz"
+
+
+class MyVariantInfoMirror(object):
+    """Memory-mapped lookup of MyVariant.info documents in a mirror file built by build_mirror.
+
+    Args:
+      mirror_fp(str): path to the mirror file
+
+    """
+
+    def __init__(self, mirror_fp):
+        self._mirror_fp = mirror_fp
+        self._file_obj = open(mirror_fp, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, assembly, self._num_records, self._table_offset = struct.unpack_from(_HEADER_FORMAT, self._mmap)
+        except (ValueError, struct.error):
+            self._file_obj.close()
+            raise ValueError("'{0}' is not a MyVariant.info mirror file".format(mirror_fp))
+
+        if magic != _MAGIC:
+            self.close()
+            raise ValueError("'{0}' is not a MyVariant.info mirror file".format(mirror_fp))
+
+        self.assembly = assembly.rstrip(b"\0").decode('utf-8')
+
+    def __len__(self):
+        return self._num_records
+
+    def close(self):
+        """Release the memory map and the underlying file
+
+        Args:
+
+        Returns:
+          None
+
+        """
+
+        self._mmap.close()
+        self._file_obj.close()
+
+    def get_document(self, hgvs_id):
+        """Look up the full MyVariant.info document for an HGVS id.
+
+        Args:
+          hgvs_id(str): HGVS id of the variant, such as 'chr1:g.69511A>G'
+
+        Returns:
+          dict or None: the document, or None if the mirror doesn't contain the variant
+
+        """
+
+        key = hgvs_id.encode('utf-8')
+        low = 0
+        high = self._num_records
+        while low < high:
+            middle = (low + high) // 2
+            record_start = self._get_record_start(middle)
+            key_end = self._mmap.find(_KEY_SEPARATOR, record_start)
+            curr_key = self._mmap[record_start:key_end]
+            if curr_key == key:
+                record_end = self._mmap.find(_RECORD_SEPARATOR, key_end)
+                return json.loads(self._mmap[key_end + 1:record_end].decode('utf-8'))
+            elif curr_key < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return None
+
+    def getvariants(self, hgvs_ids_list, fields=None, assembly=None, **kwargs):
+        """Get MyVariant.info documents in the same form as myvariant.MyVariantInfo.getvariants returns them.
+
+        Args:
+          hgvs_ids_list(list): HGVS ids of the variants to look up
+          fields(list, optional): MyVariant.info fields to return, such as 'cadd.phred'; if None, all are returned
+          assembly(str, optional): genome build version; if given, must match the one the mirror was built for
+          **kwargs: other getvariants arguments (e.g., verbose, as_dataframe), which are accepted and ignored
+
+        Returns:
+          list: one dict per input id, including its id under the 'query' key and 'notfound' set to True if the mirror
+            doesn't contain the variant
+
+        """
+
+        if hgvs_ids_list is None:
+            raise ValueError("No HGVS ids given")
+        if assembly is not None and assembly != self.assembly:
+            raise ValueError("MyVariant.info mirror '{0}' is for assembly '{1}', not '{2}'".format(
+                self._mirror_fp, self.assembly, assembly))
+
+        result = []
+        for curr_hgvs_id in hgvs_ids_list:
+            curr_document = self.get_document(curr_hgvs_id)
+            if curr_document is None:
+                curr_result = {"query": curr_hgvs_id, "notfound": True}
+            else:
+                curr_result = curr_document if fields is None else _filter_document(curr_document, fields)
+                curr_result["query"] = curr_hgvs_id
+            result.append(curr_result)
+
+        return result
+
+    def _get_record_start(self, record_index):
+        return struct.unpack_from(_OFFSET_FORMAT, self._mmap, self._table_offset + record_index * _OFFSET_SIZE)[0]
+
+
+def build_mirror(dump_fp, mirror_fp, assembly):
+    """Build a mirror file from a JSON-lines dump of MyVariant.info documents, one document per line.
+
+    Each document must contain its HGVS id under the '_id' key; if an id occurs more than once, its last document is
+    kept.  Only the ids (and their positions in the dump) are held in memory while the mirror is built.
+
+    Args:
+      dump_fp(str): path to the dump; it may be gzipped, in which case its name must end with '.gz'
+      mirror_fp(str): path to which to write the mirror file
+      assembly(str): genome build version of the dump, such as 'hg19'
+
+    Returns:
+      int: number of variants in the mirror
+
+    """
+
+    if dump_fp.endswith(_GZIP_EXTENSION):
+        # the documents are read back in sorted order below, which means seeking, so decompress once up front
+        with tempfile.TemporaryDirectory() as temp_dir:
+            uncompressed_dump_fp = os.path.join(temp_dir, os.path.basename(dump_fp)[:-len(_GZIP_EXTENSION)])
+            with gzip.open(dump_fp, 'rb') as compressed_file_obj:
+                with open(uncompressed_dump_fp, 'wb') as uncompressed_file_obj:
+                    shutil.copyfileobj(compressed_file_obj, uncompressed_file_obj)
+            return build_mirror(uncompressed_dump_fp, mirror_fp, assembly)
+
+    encoded_assembly = assembly.encode('utf-8')
+    if len(encoded_assembly) > 16:
+        raise ValueError("Assembly name '{0}' is too long".format(assembly))
+
+    document_locations_by_key = {}
+    with open(dump_fp, 'rb') as dump_file_obj:
+        line_start = 0
+        for line in dump_file_obj:
+            if line.strip():
+                document = json.loads(line.decode('utf-8'))
+                key = document[_ID_KEY].encode('utf-8')
+                document_locations_by_key[key] = (line_start, len(line))
+            line_start += len(line)
+
+        sorted_keys = sorted(document_locations_by_key)
+        record_starts = []
+        with open(mirror_fp, 'wb') as mirror_file_obj:
+            mirror_file_obj.write(b"\0" * _HEADER_SIZE)
+            for curr_key in sorted_keys:
+                document_start, document_length = document_locations_by_key[curr_key]
+                dump_file_obj.seek(document_start)
+                # re-serialize compactly, which also guarantees the document contains no raw newline
+                document_str = json.dumps(json.loads(dump_file_obj.read(document_length).decode('utf-8')),
+                                          separators=(',', ':'))
+                record_starts.append(mirror_file_obj.tell())
+                mirror_file_obj.write(curr_key + _KEY_SEPARATOR + document_str.encode('utf-8') + _RECORD_SEPARATOR)
+
+            table_offset = mirror_file_obj.tell()
+            for curr_record_start in record_starts:
+                mirror_file_obj.write(struct.pack(_OFFSET_FORMAT, curr_record_start))
+
+            mirror_file_obj.seek(0)
+            mirror_file_obj.write(struct.pack(_HEADER_FORMAT, _MAGIC, encoded_assembly, len(sorted_keys),
+                                              table_offset))
+
+    logging.info("Built MyVariant.info mirror '{0}' with {1} variants".format(mirror_fp, len(sorted_keys)))
+    return len(sorted_keys)
+
+
+def _filter_document(document, fields_list):
+    # Mimic MyVariant.info field selection: keep only the dotted paths requested (applied element-wise within lists),
+    # along with the '_license' of every object kept along the way.  As in MyVariant.info's results, an object or list
+    # item in which none of the requested paths are found is left out rather than kept empty.
+    result = {}
+    placeholder_lists = []
+    for curr_field in fields_list:
+        _copy_field_path(document, result, curr_field.split("."), placeholder_lists)
+
+    # the items of a list are matched up across the requested paths by position, so drop the empty ones only now
+    for curr_list in placeholder_lists:
+        curr_list[:] = [x for x in curr_list if len(x) > 0]
+    if _ID_KEY in document:
+        result[_ID_KEY] = document[_ID_KEY]
+    return result
+
+
+def _copy_field_path(source, destination, path_parts, placeholder_lists):
+    # Copies the path from source to destination, creating objects (and lists of objects) in destination only if some
+    # of the path is found in them; returns True if it is.  Lists created are added to placeholder_lists, as their
+    # items are created for every item in source, whether or not the path is found in it.
+    key = path_parts[0]
+    if key not in source:
+        return False
+
+    value = source[key]
+    remaining_parts = path_parts[1:]
+    is_found = False
+    if len(remaining_parts) == 0:
+        destination[key] = value
+        is_found = True
+    elif isinstance(value, dict):
+        value_destination = destination.get(key, {})
+        is_found = _copy_field_path(value, value_destination, remaining_parts, placeholder_lists)
+        if is_found:
+            destination[key] = value_destination
+    elif isinstance(value, list):
+        existing_list = destination.get(key)
+        value_destination = [{} for _ in value] if existing_list is None else existing_list
+        for curr_item, curr_destination in zip(value, value_destination):
+            if isinstance(curr_item, dict) and _copy_field_path(curr_item, curr_destination, remaining_parts,
+                                                                placeholder_lists):
+                is_found = True
+        if is_found and existing_list is None:
+            destination[key] = value_destination
+            placeholder_lists.append(value_destination)
+
+    if is_found and _LICENSE_KEY in source:
+        destination[_LICENSE_KEY] = source[_LICENSE_KEY]
+    return is_found
+
+
+def main(argv=None):
+    """Command-line entry point for building a mirror file from a MyVariant.info JSON-lines dump"""
+
+    parser = argparse.ArgumentParser(
+        description="Build a local MyVariant.info mirror from a JSON-lines dump of MyVariant.info documents.")
+    parser.add_argument("dump_fp", help="path to the JSON-lines dump (optionally gzipped)")
+    parser.add_argument("mirror_fp", help="path to which to write the mirror file")
+    parser.add_argument("--assembly", default="hg19", help="genome build version of the dump (default: hg19)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    build_mirror(args.dump_fp, args.mirror_fp, args.assembly)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
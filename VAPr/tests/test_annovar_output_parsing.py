@@ -1,5 +1,6 @@
 import unittest
 import io
+import warnings
 
 import VAPr.annovar_output_parsing as ns_test
 
@@ -133,6 +134,17 @@ chr4	698	698	G	A	ncRNA_exonic	OK/SW-cl.16	.	.	.	Score=908;Name=V$FOXD3_01	.	.	.
         self.assertListEqual(expected_hgvs_list, real_hgvs_list)
         self.assertListEqual(expected_dicts_list, real_dict_list)
 
+    def test_read_chunk_of_annotations_to_dicts_list_w_offset(self):
+        # When the chunk's start offset is given, the chunk index is ignored and reading starts right at the offset
+        input_txt_stream = io.StringIO(self.ANNOVAR_ANNOTATION_CONTENT)
+        chunk_start_offset = self.ANNOVAR_ANNOTATION_CONTENT.index("chrM\t146\t")
+
+        expected_hgvs_list = ["chrMT:g.146T>C", "chrMT:g.150T>C"]
+        real_hgvs_list, real_dict_list = ns_test.AnnovarTxtParser.read_chunk_of_annotations_to_dicts_list(
+            input_txt_stream, ['test_sample1', 'test_sample2'], 0, 2, chunk_start_offset)
+        self.assertListEqual(expected_hgvs_list, real_hgvs_list)
+        self.assertEqual(2, len(real_dict_list))
+
     def test__parse_single_variant_record(self):
         input_headers_list = ['chr', 'start', 'end', 'ref', 'alt', 'func_knowngene', 'gene_knowngene',
                               'genedetail_knowngene', 'exonicfunc_knowngene', 'aachange_knowngene', 'tfbsconssites',
@@ -234,6 +246,60 @@ class TestAnnovarAnnotatedVariant(unittest.TestCase):
             input_annovar_fields, input_hgvs_id, input_format_string, input_fields_strings_by_sample_name)
         self.assertDictEqual(expected_output, real_output)
 
+    def test_make_per_sample_annotation_dicts(self):
+        input_sample_names = ["test_sample1", "test_sample2", "test_sample3", "test_sample4"]
+        input_fields_strings = ["0/0:30,0:30:90:0,90,1000", "./.", "./.:.:.:.:.", "0/1:10,12:22:99:200,0,180"]
+        expected_output = [{'sample_id': 'test_sample1',
+                            'genotype': '0/0',
+                            'genotype_subclass_by_class': {'homozygous': 'reference'},
+                            'filter_passing_reads_count': 30,
+                            'genotype_likelihoods': [0.0, 90.0, 1000.0],
+                            'AD': [30, 0]},
+                           {'sample_id': 'test_sample4',
+                            'genotype': '0/1',
+                            'genotype_subclass_by_class': {'heterozygous': 'reference'},
+                            'filter_passing_reads_count': 22,
+                            'genotype_likelihoods': [200.0, 0.0, 180.0],
+                            'AD': [10, 12]}]
+
+        real_output = ns_test.AnnovarAnnotatedVariant.make_per_sample_annotation_dicts(
+            input_sample_names, "GT:AD:DP:GQ:PL", input_fields_strings)
+        self.assertEqual(expected_output, real_output)
+
+    def test_make_per_sample_annotation_dicts_duplicate_sample_names(self):
+        # a duplicated sample name gets one dict, at its first position but from its last genotype fields string
+        real_output = ns_test.AnnovarAnnotatedVariant.make_per_sample_annotation_dicts(
+            ["test_sample1", "test_sample2", "test_sample1"], "GT:DP", ["0/1:30", "1/1:20", "0/0:10"])
+        self.assertEqual([("test_sample1", "0/0", 10), ("test_sample2", "1/1", 20)],
+                         [(x['sample_id'], x['genotype'], x['filter_passing_reads_count']) for x in real_output])
+
+    def test_make_per_sample_annotation_dicts_sparse_samples(self):
+        input_sample_names = ["test_sample1", "test_sample2", "test_sample3", "test_sample4", "test_sample5"]
+        input_fields_strings = ["0/0:30,0:30:90:0,90,1000", "./.:5,0:5:.:0,15,200", "0|1:10,12:22:99:200,0,180", "./.",
+                                "1/1:0,2:2:6:84,6,0"]
+        real_output = ns_test.AnnovarAnnotatedVariant.make_per_sample_annotation_dicts(
+            input_sample_names, "GT:AD:DP:GQ:PL", input_fields_strings, sparse_samples=True)
+        self.assertEqual(["test_sample3", "test_sample5"], [x['sample_id'] for x in real_output])
+        self.assertEqual(ns_test.AnnovarAnnotatedVariant.make_per_sample_annotation_dicts(
+            input_sample_names, "GT:AD:DP:GQ:PL", input_fields_strings)[2], real_output[0])
+
+    def test_make_per_sample_annotation_dicts_sparse_samples_genotype_not_first(self):
+        with warnings.catch_warnings(record=True):
+            # the unparseable genotype is warned of and then left out, like the reference one
+            real_output = ns_test.AnnovarAnnotatedVariant.make_per_sample_annotation_dicts(
+                ["test_sample1", "test_sample2", "test_sample3"], "DP:GT", ["30:0/0", "22:0/1", "5:1/2/3"],
+                sparse_samples=True)
+        self.assertEqual(["test_sample2"], [x['sample_id'] for x in real_output])
+
+    def test__is_non_reference_genotype(self):
+        self.assertTrue(ns_test.AnnovarAnnotatedVariant._is_non_reference_genotype("0/1"))
+        self.assertTrue(ns_test.AnnovarAnnotatedVariant._is_non_reference_genotype("2|2"))
+        self.assertTrue(ns_test.AnnovarAnnotatedVariant._is_non_reference_genotype("./1"))
+        self.assertFalse(ns_test.AnnovarAnnotatedVariant._is_non_reference_genotype("0/0"))
+        self.assertFalse(ns_test.AnnovarAnnotatedVariant._is_non_reference_genotype("0|."))
+        self.assertFalse(ns_test.AnnovarAnnotatedVariant._is_non_reference_genotype("./."))
+        self.assertFalse(ns_test.AnnovarAnnotatedVariant._is_non_reference_genotype(None))
+
     # region _make_per_sample_annotation_dict tests
     def test__make_per_sample_annotation_dict_none(self):
         """Ensure that if input genotype fields string doesn't contain any real info, None is returned."""
@@ -1,5 +1,6 @@
 # standard libraries
 import os
+import tempfile
 import unittest
 
 # project-specific libraries
@@ -13,6 +14,60 @@ class TestAnnovarWrapper(unittest.TestCase):
         cls._annovar_install_path = os.path.join(cls._base_dir, 'test_files/annovar_dir')
         cls._genome_build_version = "hg19"
 
+    # Stand-in for table_annovar.pl: writes the header line of a real txt output, then one line per vcf record
+    _FAKE_TABLE_ANNOVAR_SCRIPT = r"""
+my ($vcf_path, $out_base, $build_version) = ($ARGV[0], "", "");
+for (my $i = 0; $i < @ARGV; $i++) {
+    $out_base = $ARGV[$i + 1] if $ARGV[$i] eq "-out";
+    $build_version = $ARGV[$i + 1] if $ARGV[$i] eq "--buildver";
+}
+open(my $calls, ">>", "$0.calls") or die;
+print $calls "$vcf_path\n";
+close($calls);
+exit 3 if $vcf_path =~ /fail/;
+open(my $in, "<", $vcf_path) or die;
+open(my $out, ">", "$out_base.$build_version\_multianno.txt") or die;
+print $out "Chr\tStart\tEnd\tRef\tAlt\tOtherinfo\n";
+while (my $line = <$in>) {
+    next if $line =~ /^#/;
+    my @fields = split(/\t/, $line);
+    print $out join("\t", $fields[0], $fields[1], $fields[1], $fields[3], $fields[4], "."), "\n";
+}
+"""
+
+    # Stand-in for annotate_variation.pl -downdb: writes a file for the database to the target directory, or fails if
+    # a file named for the database and ending in '.fail' is next to the script
+    _FAKE_ANNOTATE_VARIATION_SCRIPT = r"""
+my ($db_name, $target_dir) = ($ARGV[-2], $ARGV[-1]);
+my $build_version = $ARGV[1];
+open(my $calls, ">>", "$0.calls") or die;
+print $calls "$db_name\n";
+close($calls);
+exit 4 if -e "$0.$db_name.fail";
+open(my $out, ">", "$target_dir/$build_version\_$db_name.txt") or die;
+print $out "contents of $db_name\n";
+"""
+
+    _VCF_CONTENTS = ("##fileformat=VCFv4.1\n"
+                     "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n" +
+                     "".join("{0}\t{1}\t.\tA\tG\t50\tPASS\t.\n".format(chrom, pos)
+                             for chrom, pos in [(1, 100), (1, 200), (2, 50), (2, 60), (3, 10)]))
+
+    def _help_make_fake_annovar_install(self, temp_dir):
+        annovar_install_path = os.path.join(temp_dir, "annovar")
+        os.mkdir(annovar_install_path)
+        with open(os.path.join(annovar_install_path, "table_annovar.pl"), "w") as script_file_obj:
+            script_file_obj.write(self._FAKE_TABLE_ANNOVAR_SCRIPT)
+        return annovar_install_path
+
+    @staticmethod
+    def _help_get_num_annovar_calls(annovar_install_path, script_name="table_annovar.pl"):
+        calls_fp = os.path.join(annovar_install_path, script_name + ".calls")
+        if not os.path.exists(calls_fp):
+            return 0
+        with open(calls_fp) as calls_file_obj:
+            return len(calls_file_obj.readlines())
+
     # region _get_annovar_dbs_to_use_for_build_version tests
     def test__get_annovar_dbs_to_use_for_build_version_hg19(self):
         dbs_ordered_dict = ns_test.AnnovarWrapper._get_annovar_dbs_to_use_for_build_version("hg19")
@@ -37,9 +92,220 @@ class TestAnnovarWrapper(unittest.TestCase):
         self.maxDiff = None
         self.assertEqual(expected_output, real_output)
 
+    # region download_databases tests
+    def _help_make_fake_annovar_download_install(self, temp_dir):
+        annovar_install_path = os.path.join(temp_dir, "annovar")
+        os.mkdir(annovar_install_path)
+        with open(os.path.join(annovar_install_path, "annotate_variation.pl"), "w") as script_file_obj:
+            script_file_obj.write(self._FAKE_ANNOTATE_VARIATION_SCRIPT)
+        return annovar_install_path
+
+    def test_download_databases(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            annovar_install_path = self._help_make_fake_annovar_download_install(temp_dir)
+            humandb_dir = os.path.join(annovar_install_path, "humandb")
+            wrapper = ns_test.AnnovarWrapper(annovar_install_path, self._genome_build_version)
+
+            real_output = wrapper.download_databases(num_workers=2)
+            self.assertListEqual(["knownGene", "1000g2015aug"], list(real_output.keys()))
+            self.assertTrue(all(x is not None for x in real_output.values()))
+            self.assertListEqual(["hg19_1000g2015aug.download.json", "hg19_1000g2015aug.txt",
+                                  "hg19_knownGene.download.json", "hg19_knownGene.txt"], sorted(os.listdir(humandb_dir)))
+            with open(os.path.join(humandb_dir, "hg19_knownGene.txt")) as db_file_obj:
+                self.assertEqual("contents of knownGene\n", db_file_obj.read())
+
+            # databases already downloaded are skipped
+            real_output = wrapper.download_databases()
+            self.assertDictEqual({"knownGene": None, "1000g2015aug": None}, dict(real_output))
+            self.assertEqual(2, self._help_get_num_annovar_calls(annovar_install_path, "annotate_variation.pl"))
+
+            # ... unless their files have changed
+            with open(os.path.join(humandb_dir, "hg19_knownGene.txt"), "w") as db_file_obj:
+                db_file_obj.write("contents of knownGenf\n")
+            real_output = wrapper.download_databases()
+            self.assertIsNotNone(real_output["knownGene"])
+            self.assertIsNone(real_output["1000g2015aug"])
+            self.assertEqual(3, self._help_get_num_annovar_calls(annovar_install_path, "annotate_variation.pl"))
+
+    def test_download_databases_error(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            annovar_install_path = self._help_make_fake_annovar_download_install(temp_dir)
+            humandb_dir = os.path.join(annovar_install_path, "humandb")
+            open(os.path.join(annovar_install_path, "annotate_variation.pl.knownGene.fail"), "w").close()
+            wrapper = ns_test.AnnovarWrapper(annovar_install_path, self._genome_build_version)
+
+            with self.assertRaises(RuntimeError):
+                wrapper.download_databases()
+
+            # the other database is still downloaded, and nothing is left of the failed one
+            self.assertListEqual(["hg19_1000g2015aug.download.json", "hg19_1000g2015aug.txt"],
+                                 sorted(os.listdir(humandb_dir)))
+
+            os.remove(os.path.join(annovar_install_path, "annotate_variation.pl.knownGene.fail"))
+            real_output = wrapper.download_databases()
+            self.assertIsNotNone(real_output["knownGene"])
+            self.assertIsNone(real_output["1000g2015aug"])
+
+    # endregion
+
     def test__build_annovar_database_download_command_str(self):
         expected_output = ["perl {0}/annotate_variation.pl -build hg19 -downdb -webfrom annovar knownGene "
                            "{0}/humandb/".format(self._annovar_install_path)]
         wrapper = ns_test.AnnovarWrapper(self._annovar_install_path, self._genome_build_version, ['knownGene'])
         real_output = wrapper._build_annovar_database_download_command_str()
         self.assertListEqual(expected_output, real_output)
+
+    # region run_annotation tests
+    def test_run_annotation_sharded(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            annovar_install_path = self._help_make_fake_annovar_install(temp_dir)
+            vcf_fp = os.path.join(temp_dir, "input.vcf")
+            with open(vcf_fp, "w") as vcf_file_obj:
+                vcf_file_obj.write(self._VCF_CONTENTS)
+            wrapper = ns_test.AnnovarWrapper(annovar_install_path, self._genome_build_version)
+
+            unsharded_output_fp = wrapper.run_annotation(vcf_fp, "unsharded", temp_dir)
+            sharded_output_fp = wrapper.run_annotation(vcf_fp, "sharded", temp_dir, num_processes=2)
+
+            self.assertEqual(os.path.join(temp_dir, "sharded_annotated.hg19_multianno.txt"), sharded_output_fp)
+            with open(unsharded_output_fp) as unsharded_file_obj, open(sharded_output_fp) as sharded_file_obj:
+                unsharded_lines = unsharded_file_obj.readlines()
+                self.assertListEqual(unsharded_lines, sharded_file_obj.readlines())
+            self.assertEqual(6, len(unsharded_lines))
+            self.assertFalse(os.path.exists(os.path.join(temp_dir, "sharded_annotated_shards")))
+
+    def test_run_annotation_sharded_no_variants(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            annovar_install_path = self._help_make_fake_annovar_install(temp_dir)
+            vcf_fp = os.path.join(temp_dir, "input.vcf")
+            with open(vcf_fp, "w") as vcf_file_obj:
+                vcf_file_obj.write(self._VCF_CONTENTS.split("#CHROM")[0])
+            wrapper = ns_test.AnnovarWrapper(annovar_install_path, self._genome_build_version)
+
+            real_output_fp = wrapper.run_annotation(vcf_fp, "sharded", temp_dir, num_processes=3)
+            with open(real_output_fp) as output_file_obj:
+                self.assertListEqual(["Chr\tStart\tEnd\tRef\tAlt\tOtherinfo\n"], output_file_obj.readlines())
+
+    def test_run_annotation_sharded_error(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            annovar_install_path = self._help_make_fake_annovar_install(temp_dir)
+            vcf_fp = os.path.join(temp_dir, "input_fail.vcf")
+            with open(vcf_fp, "w") as vcf_file_obj:
+                vcf_file_obj.write(self._VCF_CONTENTS)
+            wrapper = ns_test.AnnovarWrapper(annovar_install_path, self._genome_build_version)
+
+            with self.assertRaises(RuntimeError):
+                wrapper.run_annotation(vcf_fp, "sharded", temp_dir, num_processes=2)
+            self.assertFalse(os.path.exists(os.path.join(temp_dir, "sharded_annotated_shards")))
+
+    def test_start_sharded_annotation(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            annovar_install_path = self._help_make_fake_annovar_install(temp_dir)
+            vcf_fp = os.path.join(temp_dir, "input.vcf")
+            with open(vcf_fp, "w") as vcf_file_obj:
+                vcf_file_obj.write(self._VCF_CONTENTS)
+            wrapper = ns_test.AnnovarWrapper(annovar_install_path, self._genome_build_version)
+
+            shard_data_lines = []
+            with wrapper.start_sharded_annotation(vcf_fp, "streamed", temp_dir, 3) as sharded_run:
+                for curr_shard_output_fp in sharded_run.iter_finished_shard_output_fps():
+                    # each shard's output is complete as soon as it is yielded
+                    with open(curr_shard_output_fp) as shard_file_obj:
+                        shard_data_lines.extend(shard_file_obj.readlines()[1:])
+
+            self.assertEqual(os.path.join(temp_dir, "streamed_annotated.hg19_multianno.txt"), sharded_run.output_fp)
+            with open(sharded_run.output_fp) as output_file_obj:
+                output_data_lines = output_file_obj.readlines()[1:]
+            self.assertEqual(5, len(output_data_lines))
+            self.assertListEqual(sorted(output_data_lines), sorted(shard_data_lines))
+            self.assertFalse(os.path.exists(os.path.join(temp_dir, "streamed_annotated_shards")))
+
+    def test_start_sharded_annotation_error_in_block(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            annovar_install_path = self._help_make_fake_annovar_install(temp_dir)
+            vcf_fp = os.path.join(temp_dir, "input.vcf")
+            with open(vcf_fp, "w") as vcf_file_obj:
+                vcf_file_obj.write(self._VCF_CONTENTS)
+            wrapper = ns_test.AnnovarWrapper(annovar_install_path, self._genome_build_version)
+
+            with self.assertRaises(ValueError):
+                with wrapper.start_sharded_annotation(vcf_fp, "streamed", temp_dir, 2) as sharded_run:
+                    raise ValueError("downstream failure")
+
+            self.assertFalse(os.path.exists(sharded_run.output_fp))
+            self.assertFalse(os.path.exists(os.path.join(temp_dir, "streamed_annotated_shards")))
+
+    def test_run_annotation_reuses_output(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            annovar_install_path = self._help_make_fake_annovar_install(temp_dir)
+            os.mkdir(os.path.join(annovar_install_path, "humandb"))
+            vcf_fp = os.path.join(temp_dir, "input.vcf")
+            with open(vcf_fp, "w") as vcf_file_obj:
+                vcf_file_obj.write(self._VCF_CONTENTS)
+            wrapper = ns_test.AnnovarWrapper(annovar_install_path, self._genome_build_version)
+
+            first_output_fp = wrapper.run_annotation(vcf_fp, "reused", temp_dir)
+            second_output_fp = wrapper.run_annotation(vcf_fp, "reused", temp_dir)
+            self.assertEqual(first_output_fp, second_output_fp)
+            self.assertEqual(1, self._help_get_num_annovar_calls(annovar_install_path))
+
+            # the sharded and streaming runs write the same output, so they can reuse it too
+            wrapper.run_annotation(vcf_fp, "reused", temp_dir, num_processes=2)
+            with wrapper.start_sharded_annotation(vcf_fp, "reused", temp_dir, 2) as sharded_run:
+                self.assertListEqual([first_output_fp], list(sharded_run.iter_finished_shard_output_fps()))
+            self.assertTrue(sharded_run.is_reused)
+            self.assertEqual(1, self._help_get_num_annovar_calls(annovar_install_path))
+
+            # meta-information lines don't affect the output
+            with open(vcf_fp, "w") as vcf_file_obj:
+                vcf_file_obj.write("##fileDate=20180101\n" + self._VCF_CONTENTS)
+            wrapper.run_annotation(vcf_fp, "reused", temp_dir)
+            self.assertEqual(1, self._help_get_num_annovar_calls(annovar_install_path))
+
+            wrapper.run_annotation(vcf_fp, "reused", temp_dir, force=True)
+            self.assertEqual(2, self._help_get_num_annovar_calls(annovar_install_path))
+
+    def test_run_annotation_reruns_on_changed_inputs(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            annovar_install_path = self._help_make_fake_annovar_install(temp_dir)
+            humandb_dir = os.path.join(annovar_install_path, "humandb")
+            os.mkdir(humandb_dir)
+            vcf_fp = os.path.join(temp_dir, "input.vcf")
+            with open(vcf_fp, "w") as vcf_file_obj:
+                vcf_file_obj.write(self._VCF_CONTENTS)
+            wrapper = ns_test.AnnovarWrapper(annovar_install_path, self._genome_build_version)
+            output_fp = wrapper.run_annotation(vcf_fp, "rerun", temp_dir)
+
+            with open(vcf_fp, "a") as vcf_file_obj:
+                vcf_file_obj.write("4\t20\t.\tA\tG\t50\tPASS\t.\n")
+            wrapper.run_annotation(vcf_fp, "rerun", temp_dir, num_processes=2)
+            self.assertEqual(3, self._help_get_num_annovar_calls(annovar_install_path))  # one call per shard
+
+            with open(os.path.join(humandb_dir, "hg19_knownGene.txt"), "w") as db_file_obj:
+                db_file_obj.write("new database\n")
+            wrapper.run_annotation(vcf_fp, "rerun", temp_dir)
+            self.assertEqual(4, self._help_get_num_annovar_calls(annovar_install_path))
+
+            other_dbs_wrapper = ns_test.AnnovarWrapper(annovar_install_path, self._genome_build_version, ['knownGene'])
+            other_dbs_wrapper.run_annotation(vcf_fp, "rerun", temp_dir)
+            self.assertEqual(5, self._help_get_num_annovar_calls(annovar_install_path))
+
+            # an output changed since it was written isn't reused
+            with open(output_fp, "a") as output_file_obj:
+                output_file_obj.write("extra line\n")
+            other_dbs_wrapper.run_annotation(vcf_fp, "rerun", temp_dir)
+            self.assertEqual(6, self._help_get_num_annovar_calls(annovar_install_path))
+
+    def test_run_annotation_failed_run_not_reused(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            annovar_install_path = self._help_make_fake_annovar_install(temp_dir)
+            vcf_fp = os.path.join(temp_dir, "input_fail.vcf")
+            with open(vcf_fp, "w") as vcf_file_obj:
+                vcf_file_obj.write(self._VCF_CONTENTS)
+            wrapper = ns_test.AnnovarWrapper(annovar_install_path, self._genome_build_version)
+
+            wrapper.run_annotation(vcf_fp, "failed", temp_dir)
+            wrapper.run_annotation(vcf_fp, "failed", temp_dir)
+            self.assertEqual(2, self._help_get_num_annovar_calls(annovar_install_path))
+
+    # endregion
@@ -0,0 +1,53 @@
+# standard libraries
+import gzip
+import os
+import struct
+import tempfile
+import unittest
+
+# project-specific libraries
+import VAPr.bgzf_writing as ns_test
+
+
+class TestBgzfWriter(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._output_fp = os.path.join(self._temp_dir.name, "out.gz")
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def _read_block_sizes(self):
+        block_sizes = []
+        with open(self._output_fp, 'rb') as file_obj:
+            contents = file_obj.read()
+        offset = 0
+        while offset < len(contents):
+            self.assertEqual(b"\x1f\x8b\x08\x04", contents[offset:offset + 4])
+            self.assertEqual(b"BC", contents[offset + 12:offset + 14])
+            block_size = struct.unpack_from("<H", contents, offset + 16)[0] + 1
+            block_sizes.append(block_size)
+            offset += block_size
+        self.assertEqual(len(contents), offset)
+        return block_sizes
+
+    def test_write_gzip_readable(self):
+        data = b"".join("line {0}\n".format(x).encode('utf-8') for x in range(20000))
+        with ns_test.BgzfWriter(self._output_fp) as writer:
+            writer.write(data[:1000])
+            writer.write(data[1000:])
+
+        with gzip.open(self._output_fp, 'rb') as file_obj:
+            self.assertEqual(data, file_obj.read())
+
+        block_sizes = self._read_block_sizes()
+        # 198890 bytes of data fit in 3 full blocks, then one short block, then the empty end-of-file block
+        self.assertEqual(5, len(block_sizes))
+        self.assertEqual(28, block_sizes[-1])
+
+    def test_write_empty(self):
+        ns_test.BgzfWriter(self._output_fp).close()
+
+        with gzip.open(self._output_fp, 'rb') as file_obj:
+            self.assertEqual(b"", file_obj.read())
+        self.assertEqual([28], self._read_block_sizes())
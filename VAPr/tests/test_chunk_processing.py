@@ -1,9 +1,16 @@
 import io
+import json
+import multiprocessing
+import os
 import tempfile
 import unittest
 
+import pymongo
+import pymongo.errors
+
 import VAPr.vapr_core as ns_ann_project
 import VAPr.chunk_processing as ns_test
+import VAPr.myvariant_mirror as ns_mirror
 import VAPr.tests.test_annovar_output_parsing as ns_test_help
 
 
@@ -12,7 +19,105 @@ import VAPr.tests.test_annovar_output_parsing as ns_test_help
 class TestAnnotationJobParamsIndices(unittest.TestCase):
     def test_get_num_possible_indices(self):
         real_output = ns_test.AnnotationJobParamsIndices.get_num_possible_indices()
-        self.assertEqual(8, real_output)
+        self.assertEqual(14, real_output)
+
+
+class HelpStubLedgerCollection(object):
+    """Just enough of a pymongo collection to stand in for a chunk ledger or a metadata collection"""
+
+    def __init__(self, docs_list=None):
+        self.docs_list = [] if docs_list is None else docs_list
+        self.indexes_list = []
+
+    @staticmethod
+    def _matches(doc, filter_dict):
+        return all(doc.get(k) == v for k, v in filter_dict.items())
+
+    def create_index(self, keys, **kwargs):
+        self.indexes_list.append((keys, kwargs))
+
+    def find(self, filter_dict, projection=None):
+        return [dict(x) for x in self.docs_list if self._matches(x, filter_dict)]
+
+    def find_one(self, filter_dict, projection=None):
+        matches = self.find(filter_dict, projection)
+        return matches[0] if len(matches) > 0 else None
+
+    def delete_many(self, filter_dict):
+        self.docs_list = [x for x in self.docs_list if not self._matches(x, filter_dict)]
+
+    def update_one(self, filter_dict, update_dict, upsert=False):
+        matches = [x for x in self.docs_list if self._matches(x, filter_dict)]
+        if len(matches) == 0 and upsert:
+            matches = [dict(filter_dict)]
+            self.docs_list.append(matches[0])
+        for curr_doc in matches[:1]:
+            curr_doc.update(update_dict.get("$set", {}))
+            for curr_key, curr_each_dict in update_dict.get("$addToSet", {}).items():
+                curr_list = curr_doc.setdefault(curr_key, [])
+                curr_list.extend(x for x in curr_each_dict["$each"] if x not in curr_list)
+
+
+class HelpStubIndexedCollection(object):
+    """Just enough of a pymongo collection to hold indexes"""
+    full_name = "mydb.mycol"
+
+    def __init__(self, index_info_dict=None, has_duplicates=False):
+        self.index_info_dict = {} if index_info_dict is None else index_info_dict
+        self._has_duplicates = has_duplicates
+
+    def index_information(self):
+        return dict(self.index_info_dict)
+
+    def drop_index(self, index_name):
+        del self.index_info_dict[index_name]
+
+    def create_index(self, keys, unique=False):
+        if unique and self._has_duplicates:
+            raise pymongo.errors.DuplicateKeyError("duplicate key")
+        self.index_info_dict["_".join("{0}_{1}".format(*x) for x in keys)] = {"key": keys, "unique": unique}
+
+
+class HelpStubCollection(object):
+    full_name = "mydb.mycol"
+
+    def __init__(self):
+        self.requests_list = []
+
+    def bulk_write(self, requests_list, ordered=True):
+        self.requests_list.extend(requests_list)
+
+
+class HelpStubClient(object):
+    """Just enough of a pymongo client to hold mydb.mycol and its chunk ledger"""
+
+    def __init__(self, ledger_collection):
+        self.mydb = type("StubDb", (object,), {"mycol": HelpStubCollection(),
+                                               "mycol" + ns_test.CHUNK_LEDGER_COLLECTION_SUFFIX: ledger_collection})()
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def help_get_worker_client_is_set(_):
+    return ns_test._worker_mongo_client is not None
+
+
+class TestWorkerProcess(unittest.TestCase):
+    def test_initialize_worker_process(self):
+        num_clients = multiprocessing.Value('i', 0)
+        pool = multiprocessing.Pool(2, initializer=ns_test.initialize_worker_process, initargs=(num_clients,))
+        try:
+            real_output = pool.map(help_get_worker_client_is_set, range(4))
+        finally:
+            pool.close()
+            pool.join()
+
+        self.assertListEqual([True] * 4, real_output)
+        self.assertEqual(2, num_clients.value)
+        # the parent process never gets a client of its own
+        self.assertIsNone(ns_test._worker_mongo_client)
 
 
 class TestFunctions(unittest.TestCase):
@@ -351,6 +456,14 @@ M	15211	rs78601809	T	G	100	PASS	AC=1;AF=0.609026;AN=2;NS=2504;DP=32245;EAS_AF=0.
         real_output = ns_test._get_hgvs_ids_from_vcf(input_vcf_stream, 1, 2)
         self.assertListEqual(expected_output, real_output)
 
+    def test__get_hgvs_ids_from_vcf_w_offset(self):
+        # When the chunk's start offset is given, the chunk index is ignored and reading starts right at the offset
+        input_vcf_stream = io.StringIO(self._VCF_FILE_CONTENTS)
+        chunk_start_offset = self._VCF_FILE_CONTENTS.index("\nM\t10616\t") + 1
+        expected_output = ["chrMT:g.10617_10637del", "chr1:g.14464A>T"]
+        real_output = ns_test._get_hgvs_ids_from_vcf(input_vcf_stream, 0, 2, chunk_start_offset)
+        self.assertListEqual(expected_output, real_output)
+
     # region _get_myvariantinfo_annotations_dict tests
     def test__get_myvariantinfo_annotations_dict(self):
         # TODO: someday: test for effect of verbose_level, genome build version?  What effects are expected?
@@ -374,6 +487,65 @@ M	15211	rs78601809	T	G	100	PASS	AC=1;AF=0.609026;AN=2;NS=2504;DP=32245;EAS_AF=0.
             ns_test._get_myvariantinfo_annotations_dict(
                 None, ns_ann_project.VaprAnnotator.DEFAULT_GENOME_VERSION, verbose_level=0, num_failed_attempts=4)
 
+    def test__get_myvariantinfo_annotations_dict_w_cache(self):
+        class StubMyVariantClient(object):
+            def __init__(self):
+                self.requested_ids_lists = []
+
+            def getvariants(self, hgvs_ids_list, **kwargs):
+                self.requested_ids_lists.append(list(hgvs_ids_list))
+                return [{'query': x, '_id': x, 'dbsnp': {'rsid': 'rs1'}} for x in hgvs_ids_list]
+
+        input_hgvs_ids = ["chrMT:g.146T>C", "chr1:g.195C>T"]
+        expected_output = [{'dbsnp': {'rsid': 'rs1'}, 'hgvs_id': 'chrMT:g.146T>C'},
+                           {'dbsnp': {'rsid': 'rs1'}, 'hgvs_id': 'chr1:g.195C>T'}]
+        stub_client = StubMyVariantClient()
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache_fp = os.path.join(temp_dir, "cache.sqlite")
+            first_output = ns_test._get_myvariantinfo_annotations_dict(
+                input_hgvs_ids, "hg19", verbose_level=0, myvariant_cache_fp=cache_fp, myvariant_client=stub_client)
+            second_output = ns_test._get_myvariantinfo_annotations_dict(
+                input_hgvs_ids, "hg19", verbose_level=0, myvariant_cache_fp=cache_fp, myvariant_client=stub_client)
+            # both calls share one connection to the cache
+            self.assertEqual(1, len(ns_test._process_myvariant_caches))
+            ns_test.close_myvariant_caches()
+
+        self.assertListEqual(expected_output, first_output)
+        self.assertListEqual(expected_output, second_output)
+        # the second call is answered entirely from the cache
+        self.assertListEqual([input_hgvs_ids], stub_client.requested_ids_lists)
+
+    def test__get_myvariantinfo_annotations_dict_w_mirror(self):
+        input_hgvs_ids = ["chrMT:g.146T>C", "chr1:g.195C>T"]
+        expected_output = [{'dbsnp': {'_license': 'https://goo.gl/Ztr5rl', 'rsid': 'rs370482130'},
+                            'wellderly': {'_license': 'https://goo.gl/e8OO17',
+                                          'alleles': [{'allele': 'C', 'freq': 0.0625},
+                                                      {'allele': 'T', 'freq': 0.9375}]},
+                            'hgvs_id': 'chrMT:g.146T>C'},
+                           {'notfound': True, 'hgvs_id': 'chr1:g.195C>T'}]
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dump_fp = os.path.join(temp_dir, "dump.json")
+            with open(dump_fp, 'w') as dump_file_obj:
+                dump_file_obj.write(json.dumps(
+                    {'_id': 'chrMT:g.146T>C', '_version': 2,
+                     'dbsnp': {'_license': 'https://goo.gl/Ztr5rl', 'rsid': 'rs370482130', 'vartype': 'snv'},
+                     'wellderly': {'_license': 'https://goo.gl/e8OO17', 'gene': 'MT-DLOOP2',
+                                   'alleles': [{'allele': 'C', 'freq': 0.0625},
+                                               {'allele': 'T', 'freq': 0.9375}]}}) + "\n")
+            mirror_fp = os.path.join(temp_dir, "mirror.idx")
+            ns_mirror.build_mirror(dump_fp, mirror_fp, "hg19")
+
+            mirror = ns_mirror.MyVariantInfoMirror(mirror_fp)
+            try:
+                real_output = ns_test._get_myvariantinfo_annotations_dict(
+                    input_hgvs_ids, "hg19", verbose_level=0, myvariant_client=mirror)
+            finally:
+                mirror.close()
+
+        self.assertListEqual(expected_output, real_output)
+
     # endregion
 
     def test__remove_unwanted_keys(self):
@@ -438,3 +610,221 @@ M	15211	rs78601809	T	G	100	PASS	AC=1;AF=0.609026;AN=2;NS=2504;DP=32245;EAS_AF=0.
             ns_test._merge_annovar_and_myvariant_dicts(myvariantinfo_input_dict, annovar_input_dict)
 
     # endregion
+
+    def test_read_chunk_variants_no_sample_info(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            vcf_fp = os.path.join(temp_dir, "test.vcf")
+            with open(vcf_fp, 'w') as vcf_file_obj:
+                vcf_file_obj.write(self._VCF_FILE_CONTENTS)
+
+            input_job_params = ns_ann_project.VaprAnnotator._make_jobs_params_tuples_list(
+                vcf_fp, 4, 2, "mydb", "mycol", "hg19")[1]
+            real_job_params, real_hgvs_ids, real_annovar_variants = ns_test.read_chunk_variants(input_job_params)
+
+        self.assertEqual(input_job_params, real_job_params)
+        self.assertListEqual(["chrMT:g.10617_10637del", "chr1:g.14464A>T"], real_hgvs_ids)
+        self.assertIsNone(real_annovar_variants)
+
+    def test__merge_chunk_annotations_no_annovar(self):
+        input_myvariant_dicts = [{'hgvs_id': 'chrMT:g.146T>C'}]
+        real_output = ns_test._merge_chunk_annotations(input_myvariant_dicts, None)
+        self.assertIs(input_myvariant_dicts, real_output)
+
+    def test__merge_chunk_annotations(self):
+        input_myvariant_dicts = [{'hgvs_id': 'chrMT:g.146T>C', 'dbsnp': {'rsid': 'rs370482130'}},
+                                 {'hgvs_id': 'chr1:g.195C>T', 'notfound': True}]
+        input_annovar_dicts = [{'hgvs_id': 'chrMT:g.146T>C', 'chr': 'chrMT'},
+                               {'hgvs_id': 'chr1:g.195C>T', 'chr': 'chr1'}]
+        expected_output = [{'hgvs_id': 'chrMT:g.146T>C', 'chr': 'chrMT', 'dbsnp': {'rsid': 'rs370482130'}},
+                           {'hgvs_id': 'chr1:g.195C>T', 'chr': 'chr1', 'notfound': True}]
+        real_output = ns_test._merge_chunk_annotations(input_myvariant_dicts, input_annovar_dicts)
+        self.assertListEqual(expected_output, real_output)
+
+    def test__iter_merged_chunk_annotations(self):
+        input_myvariant_dicts = [{'hgvs_id': 'chrMT:g.146T>C', 'dbsnp': {'rsid': 'rs370482130'}},
+                                 {'hgvs_id': 'chr1:g.195C>T', 'notfound': True}]
+        input_annovar_dicts = [{'hgvs_id': 'chrMT:g.146T>C', 'chr': 'chrMT'},
+                               {'hgvs_id': 'chr1:g.195C>T', 'chr': 'chr1'}]
+        expected_output = [{'hgvs_id': 'chrMT:g.146T>C', 'chr': 'chrMT', 'dbsnp': {'rsid': 'rs370482130'}},
+                           {'hgvs_id': 'chr1:g.195C>T', 'chr': 'chr1', 'notfound': True}]
+
+        real_output_iterator = ns_test._iter_merged_chunk_annotations(input_myvariant_dicts, input_annovar_dicts)
+        self.assertDictEqual(expected_output[0], next(real_output_iterator))
+        # each merged dict is removed from the inputs as soon as it is yielded
+        self.assertEqual(1, len(input_myvariant_dicts))
+        self.assertEqual(1, len(input_annovar_dicts))
+        self.assertListEqual(expected_output[1:], list(real_output_iterator))
+        self.assertListEqual([], input_myvariant_dicts)
+
+    def test_chunk_ledger(self):
+        ledger_collection = HelpStubLedgerCollection()
+        input_job_params = ns_ann_project.VaprAnnotator._make_jobs_params_tuples_list(
+            "my/file.txt", 30, 10, "mydb", "mycol", "hg19", input_fingerprint="abc")
+
+        ns_test._record_chunk_completion(input_job_params[0], HelpStubClient(ledger_collection))
+        ns_test._record_chunk_completion(input_job_params[2], HelpStubClient(ledger_collection))
+        ns_test._record_chunk_completion(input_job_params[2], HelpStubClient(ledger_collection))
+        self.assertSetEqual({0, 2}, ns_test.get_completed_chunk_indices(ledger_collection, "my/file.txt", 10, "abc"))
+        self.assertSetEqual(set(), ns_test.get_completed_chunk_indices(ledger_collection, "my/file.txt", 20, "abc"))
+        # the same contents at another path (such as a reused ANNOVAR output) have the same chunks stored
+        self.assertSetEqual({0, 2}, ns_test.get_completed_chunk_indices(ledger_collection, "other/file.txt", 10,
+                                                                        "abc"))
+        self.assertSetEqual(set(), ns_test.get_completed_chunk_indices(ledger_collection, "other/file.txt", 10,
+                                                                       "def"))
+        # different contents at the same path can't be resumed
+        with self.assertRaises(ValueError):
+            ns_test.get_completed_chunk_indices(ledger_collection, "my/file.txt", 10, "def")
+
+        ns_test.reset_chunk_ledger(ledger_collection, "my/file.txt", 10, "def")
+        self.assertSetEqual(set(), ns_test.get_completed_chunk_indices(ledger_collection, "my/file.txt", 10, "def"))
+        self.assertSetEqual(set(), ns_test.get_completed_chunk_indices(ledger_collection, "my/file.txt", 10, "abc"))
+        self.assertTrue(ledger_collection.indexes_list[0][1]["unique"])
+
+    def test_ensure_hgvs_id_index(self):
+        collection = HelpStubIndexedCollection({"hgvs_id_1": {"key": [("hgvs_id", 1)]}})
+        ns_test.ensure_hgvs_id_index(collection)
+        self.assertDictEqual({"hgvs_id_1": {"key": [("hgvs_id", 1)]}}, collection.index_info_dict)
+
+        # a non-unique index is replaced by a unique one, which then satisfies requests for either
+        ns_test.ensure_hgvs_id_index(collection, unique=True)
+        self.assertDictEqual({"hgvs_id_1": {"key": [("hgvs_id", 1)], "unique": True}}, collection.index_info_dict)
+        ns_test.ensure_hgvs_id_index(collection)
+        self.assertTrue(collection.index_info_dict["hgvs_id_1"]["unique"])
+
+    def test_ensure_hgvs_id_index_duplicates(self):
+        collection = HelpStubIndexedCollection({"hgvs_id_1": {"key": [("hgvs_id", 1)]}}, has_duplicates=True)
+        with self.assertRaises(ValueError):
+            ns_test.ensure_hgvs_id_index(collection, unique=True)
+        # the index for lookups is put back
+        self.assertDictEqual({"hgvs_id_1": {"key": [("hgvs_id", 1)], "unique": False}}, collection.index_info_dict)
+
+    def test_sample_roster(self):
+        metadata_collection = HelpStubLedgerCollection()
+        self.assertDictEqual({ns_test.SAMPLE_IDS_KEY: [], ns_test.SPARSE_SAMPLE_IDS_KEY: []},
+                             ns_test.get_sample_roster(metadata_collection))
+
+        ns_test.record_sample_roster(metadata_collection, ["sample2", "sample1"])
+        ns_test.record_sample_roster(metadata_collection, ["sample3", "sample1"], sparse_samples=True)
+        self.assertDictEqual({ns_test.SAMPLE_IDS_KEY: ["sample1", "sample2", "sample3"],
+                              ns_test.SPARSE_SAMPLE_IDS_KEY: ["sample1", "sample3"]},
+                             ns_test.get_sample_roster(metadata_collection))
+        self.assertEqual(1, len(metadata_collection.docs_list))
+        self.assertEqual(ns_test.SAMPLE_ROSTER_ID, metadata_collection.docs_list[0]["_id"])
+
+    def test__store_annotations_to_db_replace(self):
+        stub_client = HelpStubClient(None)
+        ns_test._store_annotations_to_db([{'hgvs_id': 'chrMT:g.146T>C'}], "mydb", "mycol", client=stub_client,
+                                         storage_mode=ns_test.StorageModes.REPLACE)
+
+        real_request = stub_client.mydb.mycol.requests_list[0]
+        self.assertIsInstance(real_request, pymongo.ReplaceOne)
+        self.assertDictEqual({'hgvs_id': 'chrMT:g.146T>C'}, real_request._filter)
+        self.assertTrue(real_request._upsert)
+
+    def test__make_upsert_request_merge_samples(self):
+        input_dict = {'hgvs_id': 'chrMT:g.146T>C', 'chr': 'chrMT',
+                      'samples': [{'sample_id': 'test_sample1', 'genotype': '1/1'}]}
+        real_output = ns_test._make_upsert_request(input_dict, ns_test.StorageModes.MERGE_SAMPLES)
+
+        self.assertIsInstance(real_output, pymongo.UpdateOne)
+        self.assertDictEqual({'hgvs_id': 'chrMT:g.146T>C'}, real_output._filter)
+        self.assertDictEqual({'$setOnInsert': {'hgvs_id': 'chrMT:g.146T>C', 'chr': 'chrMT'},
+                              '$addToSet': {'samples': {'$each': [{'sample_id': 'test_sample1', 'genotype': '1/1'}]}}},
+                             real_output._doc)
+        self.assertTrue(real_output._upsert)
+        # the input dict is left intact
+        self.assertIn('samples', input_dict)
+
+    def test__make_upsert_request_merge_samples_no_samples(self):
+        input_dict = {'hgvs_id': 'chrMT:g.146T>C', 'chr': 'chrMT'}
+        real_output = ns_test._make_upsert_request(input_dict, ns_test.StorageModes.MERGE_SAMPLES)
+        self.assertDictEqual({'$setOnInsert': {'hgvs_id': 'chrMT:g.146T>C', 'chr': 'chrMT'}}, real_output._doc)
+
+    def test__make_upsert_request_error(self):
+        with self.assertRaises(ValueError):
+            ns_test._make_upsert_request({'hgvs_id': 'chrMT:g.146T>C'}, "blue")
+
+    def test_fetch_chunk_myvariant_annotations_merge_samples(self):
+        class StubVariantsCollection(object):
+            def __init__(self):
+                self.filters_list = []
+
+            def find(self, filter_dict, projection=None):
+                self.filters_list.append(filter_dict)
+                return [{'hgvs_id': x} for x in filter_dict['hgvs_id']['$in'] if x == 'chr1:g.195C>T']
+
+        stub_client = HelpStubClient(None)
+        stub_client.mydb.mycol = StubVariantsCollection()
+        input_hgvs_ids = ["chrMT:g.146T>C", "chr1:g.195C>T", "chr1:g.14464A>T"]
+        expected_output = [{'dbsnp': {'rsid': 'rs370482130'}, 'hgvs_id': 'chrMT:g.146T>C'},
+                           {'hgvs_id': 'chr1:g.195C>T'},
+                           {'notfound': True, 'hgvs_id': 'chr1:g.14464A>T'}]
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dump_fp = os.path.join(temp_dir, "dump.json")
+            with open(dump_fp, 'w') as dump_file_obj:
+                dump_file_obj.write(json.dumps({'_id': 'chrMT:g.146T>C', 'dbsnp': {'rsid': 'rs370482130'}}) + "\n")
+                dump_file_obj.write(json.dumps({'_id': 'chr1:g.195C>T', 'dbsnp': {'rsid': 'rs0'}}) + "\n")
+            mirror_fp = os.path.join(temp_dir, "mirror.idx")
+            ns_mirror.build_mirror(dump_fp, mirror_fp, "hg19")
+
+            input_job_params = ns_ann_project.VaprAnnotator._make_jobs_params_tuples_list(
+                "my/file.txt", 3, 10, "mydb", "mycol", "hg19", myvariant_mirror_fp=mirror_fp,
+                storage_mode=ns_test.StorageModes.MERGE_SAMPLES)[0]
+            _, real_output, _ = ns_test.fetch_chunk_myvariant_annotations(input_job_params, input_hgvs_ids, None,
+                                                                          client=stub_client)
+
+        self.assertListEqual(expected_output, real_output)
+        self.assertEqual(1, len(stub_client.mydb.mycol.filters_list))
+
+    def test__store_annotations_to_db_shared_client(self):
+        stub_client = HelpStubClient(None)
+        ns_test._store_annotations_to_db([{'hgvs_id': 'chrMT:g.146T>C'}], "mydb", "mycol", client=stub_client)
+
+        self.assertListEqual([{'hgvs_id': 'chrMT:g.146T>C'}],
+                             [x._doc for x in stub_client.mydb.mycol.requests_list])
+        # a client passed in is left open for its other users
+        self.assertFalse(stub_client.closed)
+
+    def test_merge_and_store_chunk_annotations_shared_client(self):
+        ledger_collection = HelpStubLedgerCollection()
+        stub_client = HelpStubClient(ledger_collection)
+        input_job_params = ns_ann_project.VaprAnnotator._make_jobs_params_tuples_list(
+            "my/file.txt", 3, 10, "mydb", "mycol", "hg19", sample_names_list=["test_sample1"],
+            input_fingerprint="abc")[0]
+        input_myvariant_dicts = [{'dbsnp': {'rsid': 'rs370482130'}, 'hgvs_id': 'chrMT:g.146T>C'}]
+        input_annovar_dicts = [{'chr': 'chrMT', 'hgvs_id': 'chrMT:g.146T>C'}]
+
+        ns_test.merge_and_store_chunk_annotations(input_job_params, input_myvariant_dicts, input_annovar_dicts,
+                                                  client=stub_client)
+
+        self.assertListEqual([{'chr': 'chrMT', 'hgvs_id': 'chrMT:g.146T>C', 'dbsnp': {'rsid': 'rs370482130'}}],
+                             [x._doc for x in stub_client.mydb.mycol.requests_list])
+        self.assertSetEqual({0}, ns_test.get_completed_chunk_indices(ledger_collection, "my/file.txt", 10, "abc"))
+        self.assertFalse(stub_client.closed)
+
+    def test_merge_and_store_chunk_annotations_streams(self):
+        class StubStreamedCollection(HelpStubCollection):
+            def bulk_write(self, requests_list, ordered=True):
+                # record how many variants were still waiting to be merged when each batch was written
+                self.num_unmerged_list.append(len(input_myvariant_dicts))
+                super(StubStreamedCollection, self).bulk_write(requests_list, ordered)
+
+        stub_client = HelpStubClient(HelpStubLedgerCollection())
+        stub_client.mydb.mycol = StubStreamedCollection()
+        stub_client.mydb.mycol.num_unmerged_list = []
+        # more batches than the writer can hold at once, so it has to write some before taking the rest
+        num_variants = ns_test.StreamingBulkWriter.DEFAULT_MAX_BATCH_NUM_DOCS * (
+            ns_test.StreamingBulkWriter.DEFAULT_MAX_NUM_IN_FLIGHT_BATCHES + 3)
+        input_hgvs_ids = ["chr1:g.{0}A>T".format(i) for i in range(num_variants)]
+        input_myvariant_dicts = [{'hgvs_id': x, 'notfound': True} for x in input_hgvs_ids]
+        input_annovar_dicts = [{'hgvs_id': x, 'chr': 'chr1'} for x in input_hgvs_ids]
+        input_job_params = ns_ann_project.VaprAnnotator._make_jobs_params_tuples_list(
+            "my/file.txt", num_variants, num_variants, "mydb", "mycol", "hg19", sample_names_list=["test_sample1"])[0]
+
+        ns_test.merge_and_store_chunk_annotations(input_job_params, input_myvariant_dicts, input_annovar_dicts,
+                                                  client=stub_client)
+
+        self.assertEqual(num_variants, len(stub_client.mydb.mycol.requests_list))
+        # the first batch is written before the rest of the chunk has been merged
+        self.assertGreater(stub_client.mydb.mycol.num_unmerged_list[0], 0)
@@ -0,0 +1,249 @@
+# standard libraries
+import collections
+import gzip
+import os
+import tempfile
+import unittest
+
+# third-party libraries
+import pandas
+
+# project-specific libraries
+import VAPr.csv_writing as ns_test
+
+
+class HelpStubCollection(object):
+    """Runs the few aggregations the csv_writing module makes over variants held in memory."""
+
+    def __init__(self, variant_dicts):
+        self.variant_dicts = variant_dicts
+        self.pipelines = []
+
+    @staticmethod
+    def _get_type_name(value):
+        if isinstance(value, bool):
+            return "bool"
+        if isinstance(value, int):
+            return "int"
+        if isinstance(value, float):
+            return "double"
+        if value is None:
+            return "null"
+        return "string" if isinstance(value, str) else "object"
+
+    @staticmethod
+    def _get_sample_ids(variant_dict):
+        samples = variant_dict.get("samples", [])
+        return [x["sample_id"] for x in (samples if isinstance(samples, list) else [samples])]
+
+    def _match(self, filter_dictionary):
+        return [x for x in self.variant_dicts if all(x.get(k) == v for k, v in filter_dictionary.items())]
+
+    def count_documents(self, filter_dictionary):
+        return len(self._match(filter_dictionary))
+
+    def aggregate(self, pipeline, allowDiskUse=False):
+        self.pipelines.append(pipeline)
+        variant_dicts = self._match(pipeline[0]["$match"]) if "$match" in pipeline[0] else self.variant_dicts
+        last_stage = pipeline[-1]
+        if "$project" in last_stage:
+            results = [{"fields": list(x), "sample_ids": self._get_sample_ids(x)} for x in variant_dicts]
+            return HelpStubCursor(results)
+
+        # each group is of (field name), (sample id) or (sample id, field name), as the module's aggregations make them
+        group_id = last_stage["$group"]["_id"]
+        groups = collections.OrderedDict()
+        for curr_variant_dict in variant_dicts:
+            if group_id == "$field.k":
+                group_ids_and_values = [(x, y) for x, y in curr_variant_dict.items()]
+            elif group_id == "$sample_id":
+                group_ids_and_values = [(x, None) for x in self._get_sample_ids(curr_variant_dict)]
+            else:
+                group_ids_and_values = [({"sample_id": x, "field": y}, z) for x in
+                                        self._get_sample_ids(curr_variant_dict) for y, z in curr_variant_dict.items()]
+
+            for curr_group_id, curr_value in group_ids_and_values:
+                curr_group = groups.setdefault(repr(curr_group_id),
+                                               {"_id": curr_group_id, "types": set(), "num_variants": 0})
+                curr_group["types"].add(self._get_type_name(curr_value))
+                curr_group["num_variants"] += 1
+        return iter([dict(x, types=list(x["types"])) for x in groups.values()])
+
+
+class HelpStubCursor(object):
+    def __init__(self, results):
+        self._results_iter = iter(results)
+        self.closed = False
+
+    def __iter__(self):
+        return self._results_iter
+
+    def close(self):
+        self.closed = True
+
+
+class TestCsvWriting(unittest.TestCase):
+    _VARIANTS = [
+        {"_id": "abc", "hgvs_id": "chr1:g.1000A>C", "cadd": {"phred": 11}, "cadd_phred": 11,
+         "1000g2015aug_all": 0.05},
+        {"hgvs_id": "chr1:g.2000G>T", "func_knowngene": "intronic", "1000g2015aug_all": 0.06, "num_samples": 1},
+        {"hgvs_id": "chr1:g.3000T>A", "cadd": {"phred": 40}, "cadd_phred": 40, "num_samples": 2,
+         "samples": [{"sample_id": "sample3"}]}]
+
+    _EXPECTED_CSV = """,hgvs_id,cadd,cadd_phred,1000g2015aug_all,func_knowngene,num_samples,samples
+0,chr1:g.1000A>C,{'phred': 11},11.0,0.05,,,
+1,chr1:g.2000G>T,,,0.06,intronic,1.0,
+2,chr1:g.3000T>A,{'phred': 40},40.0,,,2.0,[{'sample_id': 'sample3'}]
+"""
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._output_fp = os.path.join(self._temp_dir.name, "out.csv")
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def test_get_variants_csv_columns(self):
+        columns_list, float_columns = ns_test.get_variants_csv_columns(self._VARIANTS)
+        self.assertListEqual(["hgvs_id", "cadd", "cadd_phred", "1000g2015aug_all", "func_knowngene", "num_samples",
+                              "samples"], columns_list)
+        self.assertSetEqual({"cadd_phred", "1000g2015aug_all", "num_samples"}, float_columns)
+
+    def test_get_variants_csv_columns_float_inference(self):
+        variants = [{"all_ints": 1, "int_none": 1, "int_nan": 1, "int_bool": 1, "none": None},
+                    {"all_ints": 2, "int_none": None, "int_nan": float("nan"), "int_bool": True, "none": None}]
+        self.assertSetEqual({"int_none", "int_nan"}, ns_test.get_variants_csv_columns(variants)[1])
+
+    def test_get_collection_csv_columns(self):
+        collection = HelpStubCollection(self._VARIANTS)
+        self.assertTupleEqual(ns_test.get_variants_csv_columns(self._VARIANTS),
+                              ns_test.get_collection_csv_columns(collection))
+
+        columns_list, float_columns = ns_test.get_collection_csv_columns(collection, {"hgvs_id": "chr1:g.1000A>C"})
+        self.assertListEqual(["hgvs_id", "cadd", "cadd_phred", "1000g2015aug_all"], columns_list)
+        self.assertSetEqual({"1000g2015aug_all"}, float_columns)
+        self.assertEqual({"$match": {"hgvs_id": "chr1:g.1000A>C"}}, collection.pipelines[-1][0])
+
+    def test_get_collection_csv_columns_by_sample(self):
+        variants = [{"hgvs_id": "chr1:g.1000A>C", "cadd_phred": 11, "samples": [{"sample_id": "s1"}]},
+                    {"hgvs_id": "chr1:g.2000G>T", "func_knowngene": "intronic",
+                     "samples": [{"sample_id": "s1"}, {"sample_id": "s2"}]},
+                    {"hgvs_id": "chr1:g.3000T>A", "cadd_phred": 40, "samples": {"sample_id": "s2"}}]
+        columns_by_sample, float_columns_by_sample = ns_test.get_collection_csv_columns_by_sample(
+            HelpStubCollection(variants), "samples.sample_id")
+        self.assertDictEqual({"s1": ["hgvs_id", "cadd_phred", "samples", "func_knowngene"],
+                              "s2": ["hgvs_id", "func_knowngene", "samples", "cadd_phred"]}, columns_by_sample)
+        self.assertDictEqual({"s1": {"cadd_phred"}, "s2": {"cadd_phred"}}, float_columns_by_sample)
+
+    def test_write_variants_csv(self):
+        columns_list, float_columns = ns_test.get_variants_csv_columns(self._VARIANTS)
+        num_variants = ns_test.write_variants_csv(iter(self._VARIANTS), columns_list, self._output_fp,
+                                                  float_columns=float_columns)
+
+        self.assertEqual(3, num_variants)
+        with open(self._output_fp, 'r') as file_obj:
+            self.assertEqual(self._EXPECTED_CSV, file_obj.read())
+
+    def test_write_variants_csv_matches_pandas(self):
+        # the same as writing a dataframe of all the variants at once, as VaprDataset's csv writers used to
+        expected_csv = pandas.DataFrame(self._VARIANTS).drop("_id", axis=1).to_csv()
+        self.assertEqual(self._EXPECTED_CSV, expected_csv)
+
+    def test_write_variants_csv_batch_size_independent(self):
+        columns_list, float_columns = ns_test.get_variants_csv_columns(self._VARIANTS)
+        for curr_batch_size in [1, 2, 3, 10]:
+            ns_test.write_variants_csv(self._VARIANTS, columns_list, self._output_fp, batch_size=curr_batch_size,
+                                       float_columns=float_columns)
+            with open(self._output_fp, 'r') as file_obj:
+                self.assertEqual(self._EXPECTED_CSV, file_obj.read(), curr_batch_size)
+
+    def test_write_variants_csv_compressed(self):
+        columns_list, float_columns = ns_test.get_variants_csv_columns(self._VARIANTS)
+        for curr_compression in [ns_test.CsvCompressions.GZIP, ns_test.CsvCompressions.BGZIP]:
+            ns_test.write_variants_csv(self._VARIANTS, columns_list, self._output_fp, compression=curr_compression,
+                                       batch_size=2, float_columns=float_columns)
+            with gzip.open(self._output_fp, 'rt') as file_obj:
+                self.assertEqual(self._EXPECTED_CSV, file_obj.read(), curr_compression)
+
+    def test_spool_variants_csv_columns(self):
+        # variants from a generator are used up by finding their columns, so are read back from the spool file
+        with tempfile.TemporaryFile() as spool_file_obj:
+            columns_list, float_columns = ns_test.spool_variants_csv_columns((x for x in self._VARIANTS),
+                                                                             spool_file_obj)
+            self.assertTupleEqual(ns_test.get_variants_csv_columns(self._VARIANTS), (columns_list, float_columns))
+
+            num_variants = ns_test.write_variants_csv(ns_test.iter_spooled_variants(spool_file_obj), columns_list,
+                                                      self._output_fp, batch_size=2, float_columns=float_columns)
+        self.assertEqual(3, num_variants)
+        with open(self._output_fp, 'r') as file_obj:
+            self.assertEqual(self._EXPECTED_CSV, file_obj.read())
+
+    def test_write_variants_csv_empty(self):
+        self.assertEqual(0, ns_test.write_variants_csv([], ["hgvs_id"], self._output_fp))
+        with open(self._output_fp, 'r') as file_obj:
+            self.assertEqual(",hgvs_id\n", file_obj.read())
+
+    def test_write_variants_csv_unknown_compression(self):
+        with self.assertRaises(ValueError):
+            ns_test.write_variants_csv(self._VARIANTS, ["hgvs_id"], self._output_fp, compression="zip")
+
+
+class TestCsvFanOutWriter(unittest.TestCase):
+    _VARIANTS_BY_KEY = {
+        "sample1": [{"hgvs_id": "chr1:g.1000A>C", "cadd": {"phred": 11}, "cadd_phred": 11},
+                    {"hgvs_id": "chr1:g.2000G>T", "1000g2015aug_all": 0.06},
+                    {"hgvs_id": "chr1:g.3000T>A", "cadd": {"phred": 40}, "cadd_phred": 40}],
+        "sample2": [{"hgvs_id": "chr1:g.2000G>T", "1000g2015aug_all": 0.06}],
+        "sample3": []}
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._output_fps_by_key = {x: os.path.join(self._temp_dir.name, x + ".csv") for x in self._VARIANTS_BY_KEY}
+        columns_and_float_columns_by_key = {x: ns_test.get_variants_csv_columns(y) for x, y in
+                                            self._VARIANTS_BY_KEY.items()}
+        self._columns_by_key = {x: y[0] for x, y in columns_and_float_columns_by_key.items()}
+        self._float_columns_by_key = {x: y[1] for x, y in columns_and_float_columns_by_key.items()}
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def _help_get_expected_contents(self, key):
+        expected_fp = os.path.join(self._temp_dir.name, "expected.csv")
+        ns_test.write_variants_csv(self._VARIANTS_BY_KEY[key], self._columns_by_key[key], expected_fp,
+                                   float_columns=self._float_columns_by_key[key])
+        with open(expected_fp, 'r') as file_obj:
+            return file_obj.read()
+
+    def _help_add_interleaved(self, writer):
+        for curr_index in range(3):
+            for curr_key, curr_variants_list in self._VARIANTS_BY_KEY.items():
+                if curr_index < len(curr_variants_list):
+                    writer.add(curr_key, curr_variants_list[curr_index])
+
+    def test_add_matches_write_variants_csv(self):
+        # one open file and tiny buffers force files to be closed and reopened for appending between batches
+        with ns_test.CsvFanOutWriter(self._output_fps_by_key, self._columns_by_key, max_num_open_files=1,
+                                     max_num_buffered_variants=2,
+                                     float_columns_by_key=self._float_columns_by_key) as writer:
+            self._help_add_interleaved(writer)
+
+        self.assertEqual({"sample1": 3, "sample2": 1}, dict(writer.num_variants_written_by_key))
+        for curr_key, curr_output_fp in self._output_fps_by_key.items():
+            with open(curr_output_fp, 'r') as file_obj:
+                self.assertEqual(self._help_get_expected_contents(curr_key), file_obj.read(), curr_key)
+
+    def test_add_gzip(self):
+        with ns_test.CsvFanOutWriter(self._output_fps_by_key, self._columns_by_key,
+                                     compression=ns_test.CsvCompressions.GZIP, max_num_open_files=1,
+                                     max_num_buffered_variants=1,
+                                     float_columns_by_key=self._float_columns_by_key) as writer:
+            self._help_add_interleaved(writer)
+
+        for curr_key, curr_output_fp in self._output_fps_by_key.items():
+            with gzip.open(curr_output_fp, 'rt') as file_obj:
+                self.assertEqual(self._help_get_expected_contents(curr_key), file_obj.read(), curr_key)
+
+    def test_init_bgzip_error(self):
+        with self.assertRaises(ValueError):
+            ns_test.CsvFanOutWriter(self._output_fps_by_key, self._columns_by_key,
+                                    compression=ns_test.CsvCompressions.BGZIP)
@@ -16,6 +16,25 @@ class TestFunctions(unittest.TestCase):
         real_output = ns_test.get_any_of_sample_ids_filter(["testname1", "testname2"])
         self.assertEqual(expected_output, real_output)
 
+    def test_make_variant_sample_rows_pipeline(self):
+        expected_output = [{"$unwind": "$samples"}]
+        self.assertListEqual(expected_output, ns_test.make_variant_sample_rows_pipeline())
+
+    def test_make_variant_sample_rows_pipeline_w_all(self):
+        expected_output = [
+            {"$match": {"$and": [{"cadd.phred": {"$gte": 10}}, {'samples.sample_id': {'$in': ["sample1"]}}]}},
+            {"$unwind": "$samples"},
+            {"$match": {'samples.sample_id': {'$in': ["sample1"]}}},
+            {"$project": {"_id": 0, "hgvs_id": 1, "sample_id": "$samples.sample_id"}}]
+        real_output = ns_test.make_variant_sample_rows_pipeline(
+            ["sample1"], {"cadd.phred": {"$gte": 10}}, {"_id": 0, "hgvs_id": 1, "sample_id": "$samples.sample_id"})
+        self.assertListEqual(expected_output, real_output)
+
+    def test_make_variant_sample_rows_pipeline_w_filter(self):
+        expected_output = [{"$match": {"cadd.phred": {"$gte": 10}}}, {"$unwind": "$samples"}]
+        real_output = ns_test.make_variant_sample_rows_pipeline(filter_dictionary={"cadd.phred": {"$gte": 10}})
+        self.assertListEqual(expected_output, real_output)
+
     def test_make_rare_deleterious_variants_filter_w_samples(self):
         expected_output = {
             "$and":
@@ -179,3 +198,24 @@ class TestFunctions(unittest.TestCase):
         }
         real_output = ns_test._append_sample_id_constraint_if_needed(input_list, None)
         self.assertDictEqual(expected_output, real_output)
+
+    def test_get_plan_stages(self):
+        input_explain = {"queryPlanner": {
+            "winningPlan": {"stage": "FETCH", "inputStage": {
+                "stage": "OR", "inputStages": [{"stage": "IXSCAN", "indexName": "cosmic.cosmic_id_1"},
+                                               {"stage": "IXSCAN", "indexName": "clinvar.rcv.accession_1"}]}},
+            "rejectedPlans": [{"stage": "COLLSCAN"}]}}
+        real_output = ns_test.get_plan_stages(input_explain)
+        self.assertListEqual(["FETCH", "OR", "IXSCAN", "IXSCAN"], real_output)
+        self.assertTrue(ns_test.is_index_backed(input_explain))
+
+    def test_is_index_backed_false(self):
+        input_explain = {"queryPlanner": {"winningPlan": {"stage": "COLLSCAN", "filter": {}}}}
+        self.assertFalse(ns_test.is_index_backed(input_explain))
+
+    def test_filter_index_keys_lists(self):
+        # every field the built-in filters select on leads at least one index
+        leading_fields = set(x[0][0] for x in ns_test.FILTER_INDEX_KEYS_LISTS)
+        for curr_field in [ns_test.SAMPLE_ID_SELECTOR, "func_knowngene", "genotype_subclass_by_class.heterozygous",
+                           "clinvar.rcv.accession", "cosmic.cosmic_id", "hgvs_id"]:
+            self.assertIn(curr_field, leading_fields)
@@ -0,0 +1,123 @@
+# standard libraries
+import copy
+import io
+import os
+import tempfile
+import unittest
+
+# third-party libraries
+import pandas
+
+# project-specific libraries
+import VAPr.formatting as ns_test
+
+
+def help_get_expected_maf_contents(start_index=0):
+    # the output of the original, step-by-step maf_formatter on TestFormatting._VARIANTS[start_index:], which
+    # format_maf_batch must reproduce exactly
+    expected_fp = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test_files', 'maf_formatter_output',
+                               'variants_from_{0}.maf'.format(start_index))
+    with open(expected_fp, 'r', newline='') as file_obj:
+        return file_obj.read()
+
+
+def help_get_maf_contents(maf_df):
+    buffer = io.StringIO()
+    maf_df.to_csv(buffer, sep='\t', index=False)
+    return buffer.getvalue()
+
+
+class TestFormatting(unittest.TestCase):
+    _VARIANTS = [
+        {"hgvs_id": "chr1:g.1000A>C", "chr": "chr1", "start": 1000, "end": 1000, "ref": "A", "alt": "C",
+         "gene_knowngene": "GENE1", "func_knowngene": "exonic", "exonicfunc_knowngene": "nonsynonymous SNV",
+         "aachange_knowngene": [{"gene": "GENE1", "protein": "p.K1T"}, {"gene": "GENE1", "protein": "p.K2T"}],
+         "cadd": {"phred": 11.5, "1000g": {"afr": 0.01, "eur": 0.02}, "esp": {}},
+         "dbsnp": {"rsid": "rs1"},
+         "clinvar": {"rcv": [{"accession": "RCV1", "clinical_significance": "Pathogenic"},
+                             {"accession": "RCV2", "clinical_significance": "Benign",
+                              "conditions": [{"name": "x"}]}]},
+         "samples": [{"sample_id": "s1", "AD": [10, 5], "genotype": "0/1", "genotype_likelihoods": [1.0, 0.5]},
+                     {"sample_id": "s2", "AD": [3, 7], "genotype": "1/1", "filter_passing_reads_count": 10}]},
+        {"hgvs_id": "chr1:g.2000_2001del", "chr": "chr1", "start": 2000, "end": 2001, "ref": "AT", "alt": "-",
+         "gene_knowngene": "GENE2;GENE3", "func_knowngene": "intronic;UTR3", "genedetail_knowngene": "d1",
+         "1000g2015aug_all": 0.5,
+         "samples": [{"sample_id": "s1", "AD": [1, 2]}]},
+        {"hgvs_id": "chr2:g.3000A>AGT", "chr": "chr2", "start": 3000, "end": 3000, "ref": "A", "alt": "AGT",
+         "gene_knowngene": "GENE4;GENE5;GENE6", "func_knowngene": "splicing", "genedetail_knowngene": "a;b;c",
+         "exonicfunc_knowngene": "frameshift insertion", "cosmic": {"cosmic_id": "C1"},
+         "samples": [{"sample_id": "s3", "genotype": "0/1"}]},
+        {"hgvs_id": "chr3:g.4000AC>GT", "chr": "chr3", "start": 4000, "end": 4001, "ref": "AC", "alt": "GT",
+         "gene_knowngene": "GENE7", "func_knowngene": "ncRNA_exonic", "exonicfunc_knowngene": "stopgain",
+         "samples": [{"sample_id": "s2", "AD": [0, 9]}, {"sample_id": "s3", "AD": [4, 4]}]},
+        {"hgvs_id": "chr4:g.5000ACGT>TGCA", "chr": "chr4", "start": 5000, "end": 5003, "ref": "ACGT", "alt": "TGCA",
+         "gene_knowngene": "GENE8", "func_knowngene": "upstream", "1000g2015aug_all": 0.1,
+         "samples": []},
+        {"hgvs_id": "chr5:g.6000ACG>TGC", "chr": "chr5", "start": 6000, "end": 6002, "ref": "ACG", "alt": "TGC",
+         "gene_knowngene": "GENE9", "func_knowngene": "downstream", "exonicfunc_knowngene": "synonymous SNV",
+         "1000g2015aug_all": 1, "samples": [{"sample_id": "s1", "AD": [2, 2]}]},
+    ]
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._output_fp = os.path.join(self._temp_dir.name, "out.maf")
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def test_format_maf_batch(self):
+        for curr_start_index in range(len(self._VARIANTS)):
+            curr_variants_list = self._VARIANTS[curr_start_index:]
+            expected_output = help_get_expected_maf_contents(curr_start_index)
+            real_output = help_get_maf_contents(ns_test.format_maf_batch(copy.deepcopy(curr_variants_list)))
+            self.assertEqual(expected_output, real_output, curr_start_index)
+
+    def test_format_maf_batch_values(self):
+        real_output = ns_test.format_maf_batch(self._VARIANTS)
+
+        self.assertListEqual(['SNP', 'SNP', 'DEL', 'DEL', 'INS', 'INS', 'INS', 'DNP', 'DNP', 'TNP'],
+                             list(real_output['Variant_Type']))
+        self.assertListEqual(['GENE1', 'GENE1', 'GENE2', 'GENE3', 'GENE4', 'GENE5', 'GENE6', 'GENE7', 'GENE7', 'GENE9'],
+                             list(real_output['Hugo_Symbol']))
+        self.assertListEqual(['Missense_Mutation', 'Missense_Mutation', 'Intron', "3'UTR", 'Frame_Shift_Ins',
+                              'Frame_Shift_Ins', 'Frame_Shift_Ins', 'Nonsense_Mutation', 'Nonsense_Mutation', 'Silent'],
+                             list(real_output['Variant_Classification']))
+        self.assertListEqual(['d1', 'd1', 'a', 'b', 'c'], list(real_output['genedetail_knowngene'][2:7]))
+        self.assertEqual(10, real_output['t_ref_count'][0])
+        self.assertEqual('RCV2', real_output['clinvar.rcv.accession2'][0])
+
+    def test_format_maf_batch_empty(self):
+        real_output = ns_test.format_maf_batch([])
+        self.assertEqual(0, len(real_output))
+        self.assertEqual('Hugo_Symbol', real_output.columns[0])
+
+    def test_maf_formatter(self):
+        expected_output = help_get_expected_maf_contents()
+        self.assertEqual(expected_output, help_get_maf_contents(ns_test.maf_formatter(copy.deepcopy(self._VARIANTS))))
+
+    def test_change_cols(self):
+        input_df = pandas.DataFrame([{'func_knowngene': 'intronic', 'exonicfunc_knowngene': 'stoploss', 'extra': 1},
+                                     {'func_knowngene': 'ncRNA_UTR5', 'exonicfunc_knowngene': 'unknown'},
+                                     {'func_knowngene': 'exonic'}])
+        real_output = ns_test.change_cols(input_df)
+
+        self.assertListEqual(['Nonstop_Mutation', 'RNA', 'exonic'], list(real_output['Variant_Classification']))
+        self.assertListEqual(['Hugo_Symbol', 'Chromosome', 'Start_Position', 'End_Position', 'Reference_Allele',
+                              'Tumor_Seq_Allele2', 'Variant_Type', 'Variant_Classification', 'Tumor_Sample_Barcode',
+                              'dbSNP_RS', 't_ref_count', 't_alt_count', 'Protein_Change', 'exonicfunc_knowngene',
+                              'extra'], list(real_output.columns))
+
+    def test_write_maf(self):
+        expected_output = help_get_expected_maf_contents()
+        # the file must not depend on how the variants are split into batches
+        for curr_batch_size in [1, 2, 3, 100]:
+            num_rows = ns_test.write_maf(iter(copy.deepcopy(self._VARIANTS)), self._output_fp,
+                                         batch_size=curr_batch_size)
+            self.assertEqual(10, num_rows)
+            with open(self._output_fp, 'r') as file_obj:
+                self.assertEqual(expected_output, file_obj.read(), curr_batch_size)
+
+    def test_write_maf_empty(self):
+        self.assertEqual(0, ns_test.write_maf([], self._output_fp))
+        with open(self._output_fp, 'r') as file_obj:
+            self.assertEqual(help_get_maf_contents(ns_test.format_maf_batch([])), file_obj.read())
@@ -0,0 +1,146 @@
+# standard libraries
+import threading
+import time
+import unittest
+
+# third-party libraries
+import pymongo
+import pymongo.errors
+
+# project-specific libraries
+import VAPr.mongo_bulk_writing as ns_test
+
+
+class StubCollection(object):
+    full_name = "mydb.mycol"
+
+    def __init__(self, error=None, write_secs=0, first_error=None):
+        self.batches = []
+        self.max_num_concurrent_writes = 0
+        self._error = error
+        self._first_error = first_error
+        self._write_secs = write_secs
+        self._num_concurrent_writes = 0
+        self._lock = threading.Lock()
+
+    def bulk_write(self, requests_list, ordered=True):
+        with self._lock:
+            self._num_concurrent_writes += 1
+            self.max_num_concurrent_writes = max(self.max_num_concurrent_writes, self._num_concurrent_writes)
+        time.sleep(self._write_secs)
+        with self._lock:
+            self._num_concurrent_writes -= 1
+            if self._error is not None:
+                raise self._error
+            if self._first_error is not None:
+                error, self._first_error = self._first_error, None
+                self.batches.append([x._doc for i, x in enumerate(requests_list) if i != 1])
+                raise error
+            self.batches.append([x._doc for x in requests_list])
+
+
+class TestStreamingBulkWriter(unittest.TestCase):
+    def test_add_batches_by_num_docs(self):
+        collection = StubCollection()
+        with ns_test.StreamingBulkWriter(collection, max_batch_num_docs=2) as writer:
+            for i in range(5):
+                writer.add({'hgvs_id': str(i)})
+
+        self.assertListEqual([2, 2, 1], sorted([len(x) for x in collection.batches], reverse=True))
+        self.assertEqual(5, writer.num_docs_written)
+        self.assertEqual(3, writer.num_batches_written)
+
+    def test_add_batches_by_num_bytes(self):
+        collection = StubCollection()
+        # each of these documents encodes to 32 bytes
+        with ns_test.StreamingBulkWriter(collection, max_batch_num_bytes=70) as writer:
+            for i in range(5):
+                writer.add({'hgvs_id': "chr1:g.{0}A>T".format(i + 100)})
+
+        self.assertListEqual([2, 2, 1], sorted([len(x) for x in collection.batches], reverse=True))
+
+    def test_add_oversized_doc(self):
+        collection = StubCollection()
+        with ns_test.StreamingBulkWriter(collection, max_batch_num_bytes=1) as writer:
+            writer.add({'hgvs_id': "chr1:g.100A>T"})
+            writer.add({'hgvs_id': "chr1:g.101A>T"})
+
+        self.assertListEqual([1, 1], [len(x) for x in collection.batches])
+
+    def test_add_sampled_sizes(self):
+        collection = StubCollection()
+        small_doc = {'hgvs_id': "chr1:g.100A>T"}  # encodes to 32 bytes
+        large_doc = {'hgvs_id': "chr1:g.101A>T", 'samples': ["sample{0}".format(i) for i in range(100)]}
+        writer = ns_test.StreamingBulkWriter(collection, max_batch_num_bytes=100)
+        writer.SIZE_SAMPLING_INTERVAL = 3
+        with writer:
+            # only the first of every three documents is encoded; the large ones between are counted as 32 bytes
+            for curr_doc in [small_doc, large_doc, large_doc, large_doc, small_doc]:
+                writer.add(curr_doc)
+
+        self.assertCountEqual([[small_doc, large_doc, large_doc], [large_doc], [small_doc]], collection.batches)
+
+    def test_add_request(self):
+        collection = StubCollection()
+        input_doc = {'hgvs_id': "chr1:g.100A>T"}
+        with ns_test.StreamingBulkWriter(collection) as writer:
+            writer.add_request(pymongo.ReplaceOne({'hgvs_id': "chr1:g.100A>T"}, input_doc, upsert=True))
+
+        self.assertListEqual([[input_doc]], collection.batches)
+
+    def test_add_request_batches_by_num_bytes(self):
+        collection = StubCollection()
+        with ns_test.StreamingBulkWriter(collection, max_batch_num_bytes=70) as writer:
+            for i in range(3):
+                input_doc = {'hgvs_id': "chr1:g.{0}A>T".format(i + 100)}
+                writer.add_request(pymongo.ReplaceOne({'hgvs_id': input_doc['hgvs_id']}, input_doc, upsert=True),
+                                   input_doc)
+
+        self.assertListEqual([2, 1], sorted([len(x) for x in collection.batches], reverse=True))
+
+    def test_add_request_racing_upsert(self):
+        # the second upsert loses a race to insert the same new document
+        collection = StubCollection(first_error=pymongo.errors.BulkWriteError(
+            {"writeErrors": [{"index": 1, "code": 11000, "errmsg": "duplicate key"}]}))
+        input_docs = [{'$setOnInsert': {'hgvs_id': str(i)}} for i in range(3)]
+        with ns_test.StreamingBulkWriter(collection) as writer:
+            for curr_doc in input_docs:
+                writer.add_request(pymongo.UpdateOne({'hgvs_id': curr_doc['$setOnInsert']['hgvs_id']}, curr_doc,
+                                                     upsert=True))
+
+        # only the failed upsert is retried
+        self.assertListEqual([[input_docs[0], input_docs[2]], [input_docs[1]]], collection.batches)
+        self.assertEqual(3, writer.num_docs_written)
+
+    def test_add_duplicate_insert(self):
+        # inserts aren't retried, as they would fail on the same key again
+        collection = StubCollection(first_error=pymongo.errors.BulkWriteError(
+            {"writeErrors": [{"index": 1, "code": 11000, "errmsg": "duplicate key"}]}))
+        writer = ns_test.StreamingBulkWriter(collection)
+        writer.add({'hgvs_id': "chr1:g.100A>T"})
+        writer.add({'hgvs_id': "chr1:g.100A>T"})
+        with self.assertRaises(RuntimeError):
+            writer.close()
+
+    def test_max_num_in_flight_batches(self):
+        collection = StubCollection(write_secs=0.05)
+        with ns_test.StreamingBulkWriter(collection, max_batch_num_docs=1, max_num_in_flight_batches=2) as writer:
+            for i in range(6):
+                writer.add({'hgvs_id': str(i)})
+
+        self.assertEqual(6, len(collection.batches))
+        self.assertEqual(2, collection.max_num_concurrent_writes)
+
+    def test_close_error(self):
+        collection = StubCollection(error=ValueError("bad write"))
+        writer = ns_test.StreamingBulkWriter(collection)
+        writer.add({'hgvs_id': "chr1:g.100A>T"})
+        with self.assertRaises(RuntimeError):
+            writer.close()
+
+    def test_close_empty(self):
+        collection = StubCollection()
+        writer = ns_test.StreamingBulkWriter(collection)
+        writer.close()
+        self.assertListEqual([], collection.batches)
+        self.assertEqual(0, writer.num_docs_written)
@@ -0,0 +1,143 @@
+# standard libraries
+import os
+import sqlite3
+import tempfile
+import unittest
+
+# project-specific libraries
+import VAPr.myvariant_caching as ns_test
+
+
+class TestMyVariantInfoCache(unittest.TestCase):
+    _FIELDS_LIST = ['cadd.phred', 'dbsnp.rsid']
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._cache_fp = os.path.join(self._temp_dir.name, "myvariant_cache.sqlite")
+        self.requested_ids_lists = []
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def _fetch(self, hgvs_ids_list):
+        self.requested_ids_lists.append(list(hgvs_ids_list))
+        return [{'hgvs_id': x, 'dbsnp': {'rsid': 'rs' + str(len(x))}} for x in hgvs_ids_list]
+
+    def _get_annotations(self, hgvs_ids_list, assembly="hg19", fields_list=None, **kwargs):
+        fields_list = self._FIELDS_LIST if fields_list is None else fields_list
+        cache = ns_test.MyVariantInfoCache(self._cache_fp, **kwargs)
+        try:
+            result = cache.get_annotations(hgvs_ids_list, assembly, fields_list, self._fetch)
+            counts = (cache.num_hits, cache.num_misses)
+        finally:
+            cache.close()
+        return result, counts
+
+    def test_make_fields_hash(self):
+        self.assertEqual(ns_test.MyVariantInfoCache.make_fields_hash(['a', 'b']),
+                         ns_test.MyVariantInfoCache.make_fields_hash(['b', 'a']))
+        self.assertNotEqual(ns_test.MyVariantInfoCache.make_fields_hash(['a', 'b']),
+                            ns_test.MyVariantInfoCache.make_fields_hash(['a']))
+
+    def test_get_annotations_hits_and_misses(self):
+        first_output, first_counts = self._get_annotations(["chr1:g.1A>T", "chr1:g.2A>T"])
+        second_output, second_counts = self._get_annotations(["chr1:g.2A>T", "chr1:g.3A>T"])
+
+        self.assertEqual((0, 2), first_counts)
+        self.assertEqual((1, 1), second_counts)
+        self.assertListEqual([["chr1:g.1A>T", "chr1:g.2A>T"], ["chr1:g.3A>T"]], self.requested_ids_lists)
+        self.assertListEqual(["chr1:g.2A>T", "chr1:g.3A>T"], [x['hgvs_id'] for x in second_output])
+        self.assertEqual(first_output[1], second_output[0])
+
+    def test_get_annotations_duplicate_ids(self):
+        real_output, real_counts = self._get_annotations(["chr1:g.1A>T", "chr1:g.1A>T"])
+
+        self.assertListEqual([["chr1:g.1A>T"]], self.requested_ids_lists)
+        self.assertEqual((1, 1), real_counts)
+        self.assertEqual(real_output[0], real_output[1])
+        self.assertIsNot(real_output[0], real_output[1])
+
+    def test_get_annotations_keyed_by_assembly_and_fields(self):
+        self._get_annotations(["chr1:g.1A>T"])
+        self._get_annotations(["chr1:g.1A>T"], assembly="hg38")
+        self._get_annotations(["chr1:g.1A>T"], fields_list=['cadd.phred'])
+        self.assertEqual(3, len(self.requested_ids_lists))
+
+    def test_get_annotations_stale(self):
+        self._get_annotations(["chr1:g.1A>T"])
+        _, real_counts = self._get_annotations(["chr1:g.1A>T"], ttl_secs=-1)
+        self.assertEqual((0, 1), real_counts)
+
+    def test_get_annotations_notfound_ttl(self):
+        def fetch_notfound(hgvs_ids_list):
+            self.requested_ids_lists.append(list(hgvs_ids_list))
+            return [{'hgvs_id': x, 'notfound': True} for x in hgvs_ids_list]
+
+        for curr_kwargs in [{}, {}, {"notfound_ttl_secs": -1}]:
+            cache = ns_test.MyVariantInfoCache(self._cache_fp, **curr_kwargs)
+            try:
+                cache.get_annotations(["chr1:g.1A>T"], "hg19", self._FIELDS_LIST, fetch_notfound)
+            finally:
+                cache.close()
+
+        # the notfound response is reused until it goes stale under its own, shorter, TTL
+        self.assertListEqual([["chr1:g.1A>T"], ["chr1:g.1A>T"]], self.requested_ids_lists)
+
+        # ... which doesn't apply to variants that were found
+        self._get_annotations(["chr1:g.2A>T"])
+        _, real_counts = self._get_annotations(["chr1:g.2A>T"], notfound_ttl_secs=-1)
+        self.assertEqual((1, 0), real_counts)
+
+    def test_old_cache_file(self):
+        # a cache file made before notfound responses were marked as such
+        connection = sqlite3.connect(self._cache_fp)
+        with connection:
+            connection.execute(
+                "CREATE TABLE annotations (hgvs_id TEXT NOT NULL, assembly TEXT NOT NULL, "
+                "fields_hash TEXT NOT NULL, stored_at REAL NOT NULL, annotation TEXT NOT NULL, "
+                "PRIMARY KEY (hgvs_id, assembly, fields_hash))")
+        connection.close()
+
+        self._get_annotations(["chr1:g.1A>T"])
+        _, real_counts = self._get_annotations(["chr1:g.1A>T"])
+        self.assertEqual((1, 0), real_counts)
+
+    def test_evict_only_when_needed(self):
+        cache = ns_test.MyVariantInfoCache(self._cache_fp, max_num_entries=3)
+        try:
+            cache.get_annotations(["chr1:g.1A>T"], "hg19", self._FIELDS_LIST, self._fetch)
+            # the first put evicts, learning the size of the cache; later puts don't while they can't exceed the max
+            self.assertEqual(1, cache._max_possible_num_entries)
+            cache.get_annotations(["chr1:g.2A>T", "chr1:g.3A>T"], "hg19", self._FIELDS_LIST, self._fetch)
+            self.assertEqual(3, cache._max_possible_num_entries)
+            cache.get_annotations(["chr1:g.4A>T"], "hg19", self._FIELDS_LIST, self._fetch)
+            self.assertEqual(3, cache._max_possible_num_entries)
+            self.assertEqual(3, cache.stats[ns_test.MyVariantInfoCache.NUM_ENTRIES_KEY])
+        finally:
+            cache.close()
+
+    def test_evict_max_num_entries(self):
+        self._get_annotations(["chr1:g.1A>T"])
+        self._get_annotations(["chr1:g.2A>T", "chr1:g.3A>T"], max_num_entries=2)
+
+        cache = ns_test.MyVariantInfoCache(self._cache_fp)
+        try:
+            real_stats = cache.stats
+        finally:
+            cache.close()
+        self.assertEqual(2, real_stats[ns_test.MyVariantInfoCache.NUM_ENTRIES_KEY])
+
+        _, real_counts = self._get_annotations(["chr1:g.1A>T"])
+        self.assertEqual((0, 1), real_counts)
+
+    def test_stats(self):
+        self._get_annotations(["chr1:g.1A>T", "chr1:g.2A>T"])
+        self._get_annotations(["chr1:g.1A>T"])
+
+        cache = ns_test.MyVariantInfoCache(self._cache_fp)
+        try:
+            real_stats = cache.stats
+        finally:
+            cache.close()
+        self.assertDictEqual({ns_test.MyVariantInfoCache.HITS_KEY: 1, ns_test.MyVariantInfoCache.MISSES_KEY: 2,
+                              ns_test.MyVariantInfoCache.NUM_ENTRIES_KEY: 2}, real_stats)
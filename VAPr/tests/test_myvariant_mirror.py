@@ -0,0 +1,118 @@
+# standard libraries
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+# project-specific libraries
+import VAPr.myvariant_mirror as ns_test
+
+
+class TestMyVariantInfoMirror(unittest.TestCase):
+    _DOCUMENTS = [
+        {'_id': 'chrMT:g.146T>C',
+         'dbsnp': {'_license': 'https://goo.gl/Ztr5rl', 'rsid': 'rs370482130', 'vartype': 'snv'},
+         'wellderly': {'_license': 'https://goo.gl/e8OO17',
+                       'alleles': [{'allele': 'C', 'freq': 0.0625}, {'allele': 'T', 'freq': 0.9375}]}},
+        {'_id': 'chr1:g.69511A>G',
+         'cadd': {'_license': 'http://bit.ly/2TIuab9', 'phred': 0.002, 'gerp': {'n': 2.31}},
+         'clinvar': {'_license': 'https://goo.gl/1hnqgR',
+                     'rcv': [{'accession': 'RCV1', 'origin': 'germline'},
+                             {'accession': 'RCV2', 'origin': 'somatic', 'conditions': {'name': 'x'}}]}},
+        {'_id': 'chr10:g.1000A>G', 'dbsnp': {'rsid': 'old'}},
+        {'_id': 'chr10:g.1000A>G', 'dbsnp': {'rsid': 'rs10'}}
+    ]
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._dump_fp = os.path.join(self._temp_dir.name, "dump.json")
+        with open(self._dump_fp, 'w') as dump_file_obj:
+            for curr_document in self._DOCUMENTS:
+                dump_file_obj.write(json.dumps(curr_document) + "\n")
+            dump_file_obj.write("\n")
+        self._mirror_fp = os.path.join(self._temp_dir.name, "mirror.idx")
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def _build_and_open(self, dump_fp=None):
+        dump_fp = self._dump_fp if dump_fp is None else dump_fp
+        num_variants = ns_test.build_mirror(dump_fp, self._mirror_fp, "hg19")
+        self.assertEqual(3, num_variants)
+        mirror = ns_test.MyVariantInfoMirror(self._mirror_fp)
+        self.addCleanup(mirror.close)
+        return mirror
+
+    def test_get_document(self):
+        mirror = self._build_and_open()
+        self.assertEqual(3, len(mirror))
+        self.assertEqual("hg19", mirror.assembly)
+        self.assertDictEqual(self._DOCUMENTS[0], mirror.get_document('chrMT:g.146T>C'))
+        self.assertDictEqual(self._DOCUMENTS[1], mirror.get_document('chr1:g.69511A>G'))
+        # the last document for a duplicated id wins
+        self.assertDictEqual(self._DOCUMENTS[3], mirror.get_document('chr10:g.1000A>G'))
+        self.assertIsNone(mirror.get_document('chr1:g.195C>T'))
+        self.assertIsNone(mirror.get_document('chrZ:g.1A>T'))
+
+    def test_build_mirror_gzipped(self):
+        gzipped_dump_fp = self._dump_fp + ".gz"
+        with open(self._dump_fp, 'rb') as dump_file_obj, gzip.open(gzipped_dump_fp, 'wb') as gzipped_file_obj:
+            gzipped_file_obj.write(dump_file_obj.read())
+
+        mirror = self._build_and_open(gzipped_dump_fp)
+        self.assertDictEqual(self._DOCUMENTS[1], mirror.get_document('chr1:g.69511A>G'))
+
+    def test_getvariants(self):
+        mirror = self._build_and_open()
+        input_fields = ['dbsnp.rsid', 'wellderly.alleles', 'cadd.phred', 'clinvar.rcv.accession']
+        expected_output = [{'_id': 'chrMT:g.146T>C', 'query': 'chrMT:g.146T>C',
+                            'dbsnp': {'_license': 'https://goo.gl/Ztr5rl', 'rsid': 'rs370482130'},
+                            'wellderly': {'_license': 'https://goo.gl/e8OO17',
+                                          'alleles': [{'allele': 'C', 'freq': 0.0625},
+                                                      {'allele': 'T', 'freq': 0.9375}]}},
+                           {'query': 'chr1:g.195C>T', 'notfound': True},
+                           {'_id': 'chr1:g.69511A>G', 'query': 'chr1:g.69511A>G',
+                            'cadd': {'_license': 'http://bit.ly/2TIuab9', 'phred': 0.002},
+                            'clinvar': {'_license': 'https://goo.gl/1hnqgR',
+                                        'rcv': [{'accession': 'RCV1'}, {'accession': 'RCV2'}]}}]
+
+        real_output = mirror.getvariants(['chrMT:g.146T>C', 'chr1:g.195C>T', 'chr1:g.69511A>G'], verbose=0,
+                                         as_dataframe=False, fields=input_fields, assembly="hg19")
+        self.assertListEqual(expected_output, real_output)
+
+    def test_getvariants_missing_nested_fields(self):
+        # as MyVariant.info does, leave out objects and list items in which none of the requested fields are found,
+        # rather than keeping them empty (or with just their '_license')
+        mirror = self._build_and_open()
+        input_fields = ['dbsnp.rsid', 'cadd.gerp.s', 'wellderly.alleles.count', 'clinvar.rcv.conditions.name',
+                        'clinvar.rcv.origin.name']
+        expected_output = [{'_id': 'chrMT:g.146T>C', 'query': 'chrMT:g.146T>C',
+                            'dbsnp': {'_license': 'https://goo.gl/Ztr5rl', 'rsid': 'rs370482130'}},
+                           {'_id': 'chr1:g.69511A>G', 'query': 'chr1:g.69511A>G',
+                            'clinvar': {'_license': 'https://goo.gl/1hnqgR', 'rcv': [{'conditions': {'name': 'x'}}]}}]
+
+        real_output = mirror.getvariants(['chrMT:g.146T>C', 'chr1:g.69511A>G'], verbose=0, as_dataframe=False,
+                                         fields=input_fields, assembly="hg19")
+        self.assertListEqual(expected_output, real_output)
+
+    def test_getvariants_wrong_assembly(self):
+        mirror = self._build_and_open()
+        with self.assertRaises(ValueError):
+            mirror.getvariants(['chrMT:g.146T>C'], assembly="hg38")
+
+    def test_getvariants_no_ids(self):
+        mirror = self._build_and_open()
+        with self.assertRaises(ValueError):
+            mirror.getvariants(None)
+
+    def test_init_not_mirror(self):
+        with self.assertRaises(ValueError):
+            ns_test.MyVariantInfoMirror(self._dump_fp)
+
+    def test_main(self):
+        self.assertEqual(0, ns_test.main([self._dump_fp, self._mirror_fp, "--assembly", "hg38"]))
+        mirror = ns_test.MyVariantInfoMirror(self._mirror_fp)
+        self.addCleanup(mirror.close)
+        self.assertEqual("hg38", mirror.assembly)
+        self.assertEqual(3, len(mirror))
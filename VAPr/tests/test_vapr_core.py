@@ -1,6 +1,11 @@
 # standard libraries
+import copy
+import gzip
+import hashlib
 import os
 import tempfile
+import threading
+import time
 import unittest
 import warnings
 
@@ -8,7 +13,10 @@ import warnings
 import VAPr.vcf_merging as ns_merge
 import VAPr.tests.test_vcf_merging as ns_merge_test
 import VAPr.filtering as ns_filter
+import VAPr.formatting as ns_format
 import VAPr.vapr_core as ns_test
+import VAPr.chunk_processing as ns_chunk
+import VAPr.tests.test_chunk_processing as ns_chunk_help
 
 
 def help_make_filter(sample_names=None):
@@ -90,6 +98,13 @@ class TestVaprDataset(unittest.TestCase):
                            "'queries_test.collect'."
             self.assertEqual(expected_msg, warn_msg)
 
+    def test__warn_if_no_output_num_items(self):
+        test_dataset = ns_test.VaprDataset(self._db_name, self._collection_name)
+        with warnings.catch_warnings(record=True) as warning_set:
+            self.assertTrue(test_dataset._warn_if_no_output("test", None, num_items=0))
+            self.assertFalse(test_dataset._warn_if_no_output("test", None, num_items=2))
+            self.assertEqual(1, len(warning_set))
+
     def test__warn_if_no_output_false(self):
         test_dataset = ns_test.VaprDataset(self._db_name, self._collection_name)
         with warnings.catch_warnings(record=True) as warning_set:
@@ -372,17 +387,77 @@ class TestVaprDataset(unittest.TestCase):
         bgzip_filepath = self.test_bgzipped_fps[0]
         test_dataset = ns_test.VaprDataset(self._db_name, self._collection_name, bgzip_filepath)
 
-        test_dataset._write_annotated_vcf(variant_input, out_path)
+        test_dataset._write_annotated_vcf("test__write_annotated_vcf", variant_input, out_path)
         self.assertTrue(os.path.isfile(out_path))
         with open(out_path, 'r') as file_handle:
             real_output_contents = file_handle.read()
         self.assertEqual(expected_contents, real_output_contents)
 
+        # the output of an iter_* method gives the same file as a list of the same variants
+        test_dataset._mongo_db_collection.delete_many({})
+        test_dataset._mongo_db_collection.insert_many(copy.deepcopy(variant_input))
+        iter_out_path = os.path.join(temp_dir.name, "test_iter_out.vcf")
+        test_dataset.write_filtered_annotated_vcf(test_dataset.iter_all_variants(projection={"_id": 0}, batch_size=1),
+                                                  iter_out_path)
+        with open(iter_out_path, 'r') as file_handle:
+            self.assertEqual(expected_contents, file_handle.read())
+
+        # with their mongo ids, the variants are read back from mongo db as they are written
+        list_out_path = os.path.join(temp_dir.name, "test_list_out.vcf")
+        test_dataset.write_filtered_annotated_vcf(test_dataset.get_all_variants(), list_out_path)
+        test_dataset.write_filtered_annotated_vcf(test_dataset.iter_all_variants(batch_size=1), iter_out_path)
+        with open(list_out_path, 'r') as expected_file_handle, open(iter_out_path, 'r') as file_handle:
+            self.assertEqual(expected_file_handle.read(), file_handle.read())
+
+    def test__join_template_records_to_variants(self):
+        class HelpRecord(object):
+            def __init__(self, chrom, pos, ref):
+                self.CHROM = chrom
+                self.POS = pos
+                self.REF = ref
+
+        template_records = [HelpRecord("1", 100, "A"), HelpRecord("1", 199, "CTT"), HelpRecord("1", 201, "G"),
+                            HelpRecord("2", 50, "T"), HelpRecord("MT", 10, "C")]
+        variant_input = [{"hgvs_id": "chr1:g.201G>A"}, {"hgvs_id": "chr1:g.100A>C"}, {"hgvs_id": "chrMT:g.10C>T"},
+                         {"hgvs_id": "chr1:g.200_201del"}, {"hgvs_id": "chr3:g.5A>G"}]
+
+        variants_by_chrom, num_variants = ns_test.VaprDataset._get_sorted_variants_by_chrom(variant_input)
+        self.assertEqual(5, num_variants)
+        real_output = [(record.POS, variant["hgvs_id"]) for record, variant in
+                       ns_test.VaprDataset._join_template_records_to_variants(template_records, variants_by_chrom)]
+        # the deletion at 199 overlaps both the variant at 200 and the one at 201; the one at 201 also matches 201
+        self.assertListEqual([(100, "chr1:g.100A>C"), (199, "chr1:g.200_201del"), (199, "chr1:g.201G>A"),
+                              (201, "chr1:g.200_201del"), (201, "chr1:g.201G>A"), (10, "chrMT:g.10C>T")], real_output)
+
+    def test__get_sorted_variants_by_chrom_keep_ids(self):
+        variant_input = [{"_id": 1, "hgvs_id": "chr1:g.201G>A"}, {"_id": 2, "hgvs_id": "chr1:g.100A>C"},
+                         {"hgvs_id": "chrMT:g.10C>T"}]
+
+        variants_by_chrom, num_variants = ns_test.VaprDataset._get_sorted_variants_by_chrom(variant_input,
+                                                                                            keep_ids=True)
+        self.assertEqual(3, num_variants)
+        # only the ids are kept, except for a variant without one
+        self.assertDictEqual({"1": [(100, 1, 2), (201, 0, 1)], "MT": [(10, 2, {"hgvs_id": "chrMT:g.10C>T"})]},
+                             variants_by_chrom)
+
+    def test__iter_records_with_fetched_variants(self):
+        test_dataset = ns_test.VaprDataset(self._db_name, self._collection_name)
+        test_dataset._mongo_db_collection.delete_many({})
+        input_ids = test_dataset._mongo_db_collection.insert_many(
+            [dict(self.var1), dict(self.var2), dict(self.var3)]).inserted_ids
+
+        input_pairs = [("rec1", input_ids[2]), ("rec1", input_ids[0]), ("rec2", {"hgvs_id": "chr2:g.5A>G"}),
+                       ("rec3", input_ids[1])]
+        real_output = [(record, variant["hgvs_id"]) for record, variant in
+                       test_dataset._iter_records_with_fetched_variants(iter(input_pairs), batch_size=2)]
+        self.assertListEqual([("rec1", self.var3["hgvs_id"]), ("rec1", self.var1["hgvs_id"]),
+                              ("rec2", "chr2:g.5A>G"), ("rec3", self.var2["hgvs_id"])], real_output)
+
     def test__write_annotated_csv(self):
-        expected_output_csv = """,1000g2015aug_all,cadd,clinvar,cosmic,exonicfunc_knowngene,func_knowngene,genotype_subclass_by_class,hgvs_id,samples
-0,0.05,"{'esp': {'af': 0.05}, 'phred': 11}","{'rcv': {'accession': 'ABC123', 'clinical_significance': 'Pathogenic'}}",{'cosmic_id': 'XYZ789'},nonsynonymous SNV,exonic,,chr1:g.1000A>C,{'sample_id': 'sample1'}
-1,0.06,{'esp': {'af': 0.05}},,{'cosmic_id': 'XYZ789'},nonsynonymous SNV,intronic,,chr1:g.2000G>T,{'sample_id': 'sample2'}
-2,0.05,"{'esp': {'af': 0.95}, 'phred': 40}",,,synonymous SNV,exonic,{'heterozygous': 'compound'},chr1:g.3000T>A,{'sample_id': 'sample3'}
+        expected_output_csv = """,hgvs_id,cadd,func_knowngene,1000g2015aug_all,exonicfunc_knowngene,clinvar,cosmic,samples,genotype_subclass_by_class
+0,chr1:g.1000A>C,"{'esp': {'af': 0.05}, 'phred': 11}",exonic,0.05,nonsynonymous SNV,"{'rcv': {'accession': 'ABC123', 'clinical_significance': 'Pathogenic'}}",{'cosmic_id': 'XYZ789'},{'sample_id': 'sample1'},
+1,chr1:g.2000G>T,{'esp': {'af': 0.05}},intronic,0.06,nonsynonymous SNV,,{'cosmic_id': 'XYZ789'},{'sample_id': 'sample2'},
+2,chr1:g.3000T>A,"{'esp': {'af': 0.95}, 'phred': 40}",exonic,0.05,synonymous SNV,,,{'sample_id': 'sample3'},{'heterozygous': 'compound'}
 """
 
         test_dataset = ns_test.VaprDataset(self._db_name, self._collection_name)
@@ -402,6 +477,127 @@ class TestVaprDataset(unittest.TestCase):
             real_output_contents = file_handle.read()
         self.assertEqual(expected_output_csv, real_output_contents)
 
+    def test_write_filtered_annotated_csv_iter(self):
+        test_dataset = ns_test.VaprDataset(self._db_name, self._collection_name)
+        test_dataset._mongo_db_collection.delete_many({})
+        test_dataset._mongo_db_collection.insert_many([dict(self.var1), dict(self.var2), dict(self.var3)])
+
+        temp_dir = tempfile.TemporaryDirectory()
+        expected_out_path = os.path.join(temp_dir.name, "expected_out.csv")
+        test_dataset.write_filtered_annotated_csv(test_dataset.get_variants_for_samples(["sample1", "sample3"]),
+                                                  expected_out_path)
+
+        # the output of an iter_* method gives the same file as the list from the matching get_* method
+        out_path = os.path.join(temp_dir.name, "test_out.csv")
+        test_dataset.write_filtered_annotated_csv(
+            test_dataset.iter_variants_for_samples(["sample1", "sample3"], batch_size=1), out_path)
+        with open(out_path, 'r') as file_handle:
+            real_output_contents = file_handle.read()
+        self.assertEqual(3, len(real_output_contents.splitlines()))  # header and one row per variant
+        with open(expected_out_path, 'r') as file_handle:
+            self.assertEqual(file_handle.read(), real_output_contents)
+
+    def test__write_annotated_csv_generator(self):
+        # a generator can be read only once, but must give the same file as a list of the same variants
+        input_list = [dict(self.var1), dict(self.var2), dict(self.var3)]
+        test_dataset = ns_test.VaprDataset(self._db_name, self._collection_name)
+        temp_dir = tempfile.TemporaryDirectory()
+        expected_out_path = os.path.join(temp_dir.name, "expected_out.csv")
+        test_dataset._write_annotated_csv("test__write_annotated_csv_generator", input_list, expected_out_path)
+
+        out_path = os.path.join(temp_dir.name, "test_out.csv")
+        test_dataset._write_annotated_csv("test__write_annotated_csv_generator", (x for x in input_list), out_path)
+        with open(out_path, 'r') as file_handle:
+            real_output_contents = file_handle.read()
+        self.assertEqual(4, len(real_output_contents.splitlines()))  # header and one row per variant
+        with open(expected_out_path, 'r') as file_handle:
+            self.assertEqual(file_handle.read(), real_output_contents)
+
+    def test_write_unfiltered_annotated_csv_bgzipped(self):
+        expected_output_csv = """,hgvs_id,cadd,func_knowngene,1000g2015aug_all,exonicfunc_knowngene,cosmic,samples
+0,chr1:g.2000G>T,{'esp': {'af': 0.05}},intronic,0.06,nonsynonymous SNV,{'cosmic_id': 'XYZ789'},{'sample_id': 'sample2'}
+"""
+
+        test_dataset = ns_test.VaprDataset(self._db_name, self._collection_name)
+        test_dataset._mongo_db_collection.delete_many({})
+        test_dataset._mongo_db_collection.insert_many([dict(self.var2)])
+
+        temp_dir = tempfile.TemporaryDirectory()
+        out_path = os.path.join(temp_dir.name, "test_out.csv.gz")
+
+        test_dataset.write_unfiltered_annotated_csv(out_path, compression="bgzip", batch_size=1)
+        with gzip.open(out_path, 'rt') as file_handle:
+            real_output_contents = file_handle.read()
+        self.assertEqual(expected_output_csv, real_output_contents)
+
+    def test__get_variant_sample_ids(self):
+        self.assertListEqual(["sample1"], ns_test.VaprDataset._get_variant_sample_ids(self.var1))
+        self.assertListEqual(["s2", "s1"], ns_test.VaprDataset._get_variant_sample_ids(
+            {"samples": [{"sample_id": "s2"}, {"sample_id": "s1"}, {"sample_id": "s2"}]}))
+        self.assertListEqual([], ns_test.VaprDataset._get_variant_sample_ids({"hgvs_id": "chr1:g.1000A>C"}))
+
+    def test_write_unfiltered_annotated_csvs_per_sample(self):
+        test_dataset = ns_test.VaprDataset(self._db_name, self._collection_name)
+        test_dataset._mongo_db_collection.delete_many({})
+        shared_var = dict(self.var2, samples=[{"sample_id": "sample1"}, {"sample_id": "sample2"}])
+        test_dataset._mongo_db_collection.insert_many([dict(self.var1), shared_var, dict(self.var3)])
+
+        temp_dir = tempfile.TemporaryDirectory()
+        for curr_num_processes in [1, 2]:
+            curr_output_dir = os.path.join(temp_dir.name, str(curr_num_processes))
+            os.mkdir(curr_output_dir)
+            test_dataset.write_unfiltered_annotated_csvs_per_sample(curr_output_dir, num_processes=curr_num_processes,
+                                                                    max_num_open_files=1)
+
+            # each file must be the same as writing the variants found by querying for its sample alone
+            for curr_sample_id in ["sample1", "sample2", "sample3"]:
+                expected_fp = os.path.join(temp_dir.name, "expected.csv")
+                test_dataset.write_filtered_annotated_csv(test_dataset.get_variants_for_sample(curr_sample_id),
+                                                          expected_fp)
+                with open(expected_fp, 'r') as file_handle:
+                    expected_contents = file_handle.read()
+                with open(os.path.join(curr_output_dir, curr_sample_id + 'unfiltered_annotated_variants.csv'),
+                          'r') as file_handle:
+                    self.assertEqual(expected_contents, file_handle.read())
+
+    def test_iter_variant_sample_rows(self):
+        test_dataset = ns_test.VaprDataset(self._db_name, self._collection_name)
+        test_dataset._mongo_db_collection.delete_many({})
+        shared_var = dict(self.var2, samples=[{"sample_id": "sample1"}, {"sample_id": "sample2"}])
+        input_list = [dict(self.var1, samples=[self.var1["samples"]]), shared_var,
+                      dict(self.var3, samples=[self.var3["samples"]])]
+        test_dataset._mongo_db_collection.insert_many(input_list)
+
+        # without arguments, the rows are the same as extract_samples makes
+        expected_output = ns_format.extract_samples(test_dataset.get_all_variants())
+        self.assertListEqual(expected_output, list(test_dataset.iter_variant_sample_rows(batch_size=1)))
+
+        real_output = test_dataset.iter_variant_sample_rows(
+            ["sample1"], projection={"_id": 0, "hgvs_id": 1, "sample_id": "$samples.sample_id"})
+        self.assertListEqual([{"hgvs_id": self.var1["hgvs_id"], "sample_id": "sample1"},
+                              {"hgvs_id": self.var2["hgvs_id"], "sample_id": "sample1"}], list(real_output))
+
+    def test_write_maf(self):
+        test_dataset = ns_test.VaprDataset(self._db_name, self._collection_name)
+        test_dataset._mongo_db_collection.delete_many({})
+        input_list = [{"hgvs_id": "chr1:g.1000A>C", "ref": "A", "alt": "C", "gene_knowngene": "GENE1;GENE2",
+                       "func_knowngene": "exonic", "exonicfunc_knowngene": "stopgain",
+                       "samples": [{"sample_id": "sample1", "AD": [3, 4]}, {"sample_id": "sample2"}]},
+                      {"hgvs_id": "chr1:g.2000G>TT", "ref": "G", "alt": "TT", "gene_knowngene": "GENE3",
+                       "func_knowngene": "intronic", "samples": [{"sample_id": "sample2", "AD": [1, 2]}]}]
+        test_dataset._mongo_db_collection.insert_many(copy.deepcopy(input_list))
+
+        temp_dir = tempfile.TemporaryDirectory()
+        out_path = os.path.join(temp_dir.name, "test_out.maf")
+        expected_df = ns_format.maf_formatter(test_dataset.get_all_variants())
+        for curr_batch_size in [1, 10]:
+            real_num_rows = test_dataset.write_maf(out_path, batch_size=curr_batch_size)
+            self.assertEqual(5, real_num_rows)
+            with open(out_path, 'r') as file_handle:
+                self.assertEqual(expected_df.to_csv(sep='\t', index=False), file_handle.read())
+
+        self.assertEqual(1, test_dataset.write_maf(out_path, filter_dictionary={"hgvs_id": "chr1:g.2000G>TT"}))
+
     def test_de_novo_variants(self):
         test_dataset = ns_test.VaprDataset(self._db_name, self._collection_name)
         test_dataset._mongo_db_collection.delete_many({})
@@ -486,6 +682,42 @@ class TestVaprDataset(unittest.TestCase):
         real_output = test_dataset.get_distinct_sample_ids()
         self.assertListEqual(['sample1', 'sample2', 'sample3'], real_output)
 
+    def test_get_sample_roster(self):
+        test_dataset = ns_test.VaprDataset(self._db_name, self._collection_name)
+        metadata_collection = ns_chunk.get_metadata_collection(test_dataset._mongo_client, self._db_name,
+                                                               self._collection_name)
+        metadata_collection.delete_many({})
+        self.assertDictEqual({'sample_ids': [], 'sparse_sample_ids': []}, test_dataset.get_sample_roster())
+
+        ns_chunk.record_sample_roster(metadata_collection, ['sample2', 'sample1'], sparse_samples=True)
+        ns_chunk.record_sample_roster(metadata_collection, ['sample3', 'sample2'])
+        self.assertDictEqual({'sample_ids': ['sample1', 'sample2', 'sample3'],
+                              'sparse_sample_ids': ['sample1', 'sample2']}, test_dataset.get_sample_roster())
+
+    def test_ensure_indexes(self):
+        test_dataset = ns_test.VaprDataset(self._db_name, self._collection_name)
+        test_dataset._mongo_db_collection.delete_many({})
+        test_dataset._mongo_db_collection.drop_indexes()
+
+        test_dataset._mongo_db_collection.insert_many([dict(self.var1), dict(self.var2), dict(self.var3)])
+        real_output = test_dataset.ensure_indexes()
+        self.assertEqual(len(ns_filter.FILTER_INDEX_KEYS_LISTS), len(real_output))
+        # creating them again is harmless
+        self.assertListEqual(real_output, test_dataset.ensure_indexes())
+
+    def test_explain_builtin_filters(self):
+        test_dataset = ns_test.VaprDataset(self._db_name, self._collection_name)
+        test_dataset._mongo_db_collection.delete_many({})
+
+        test_dataset._mongo_db_collection.insert_many([dict(self.var1), dict(self.var2), dict(self.var3)])
+        test_dataset.ensure_indexes()
+        real_output = test_dataset.explain_builtin_filters(["sample1"])
+
+        self.assertSetEqual({"rare_deleterious_variants", "known_disease_variants",
+                             "deleterious_compound_heterozygous_variants", "variants_for_samples"}, set(real_output))
+        for curr_name, curr_explain in real_output.items():
+            self.assertTrue(ns_filter.is_index_backed(curr_explain), curr_name)
+
     def test_get_all_variants(self):
         test_dataset = ns_test.VaprDataset(self._db_name, self._collection_name)
         test_dataset._mongo_db_collection.delete_many({})
@@ -513,6 +745,33 @@ class TestVaprDataset(unittest.TestCase):
         self.assertTrue(len(sample_var) == 2)
         self.assertListEqual([var['hgvs_id'] for var in sample_var], [self.var1['hgvs_id'], self.var2['hgvs_id']])
 
+    def test_iter_all_variants(self):
+        test_dataset = ns_test.VaprDataset(self._db_name, self._collection_name)
+        test_dataset._mongo_db_collection.delete_many({})
+
+        test_dataset._mongo_db_collection.insert_many([self.var1, self.var2, self.var3])
+        real_output = test_dataset.iter_all_variants(projection={"_id": False, "hgvs_id": True},
+                                                     sort=[("hgvs_id", -1)], batch_size=1)
+        self.assertNotIsInstance(real_output, list)
+        self.assertListEqual([{"hgvs_id": self.var3["hgvs_id"]}, {"hgvs_id": self.var2["hgvs_id"]},
+                              {"hgvs_id": self.var1["hgvs_id"]}], list(real_output))
+
+    def test_iter_variants_for_sample(self):
+        test_dataset = ns_test.VaprDataset(self._db_name, self._collection_name)
+        test_dataset._mongo_db_collection.delete_many({})
+
+        test_dataset._mongo_db_collection.insert_many([self.var1, self.var2, self.var3])
+        real_output = list(test_dataset.iter_variants_for_sample("sample2"))
+        self.assertListEqual([self.var2['hgvs_id']], [var['hgvs_id'] for var in real_output])
+
+    def test_iter_variants_for_samples(self):
+        test_dataset = ns_test.VaprDataset(self._db_name, self._collection_name)
+        test_dataset._mongo_db_collection.delete_many({})
+
+        test_dataset._mongo_db_collection.insert_many([self.var1, self.var2, self.var3])
+        real_output = list(test_dataset.iter_variants_for_samples(["sample1", "sample3"], sort=[("hgvs_id", 1)]))
+        self.assertListEqual([self.var1['hgvs_id'], self.var3['hgvs_id']], [var['hgvs_id'] for var in real_output])
+
     def test_get_variants_as_dataframe_all(self):
         expected_output_csv = """,1000g2015aug_all,cadd,clinvar,cosmic,exonicfunc_knowngene,func_knowngene,genotype_subclass_by_class,hgvs_id,samples
 0,0.05,"{'esp': {'af': 0.05}, 'phred': 11}","{'rcv': {'accession': 'ABC123', 'clinical_significance': 'Pathogenic'}}",{'cosmic_id': 'XYZ789'},nonsynonymous SNV,exonic,,chr1:g.1000A>C,{'sample_id': 'sample1'}
@@ -559,6 +818,45 @@ class TestVaprAnnotator(unittest.TestCase):
         real_output = ns_test.VaprAnnotator._get_num_lines_in_file(temp_file.name)
         self.assertEqual(num_lines, real_output)
 
+    # region _get_num_data_lines_and_chunk_start_offsets tests
+    def test__get_num_data_lines_and_chunk_start_offsets_one_header_line(self):
+        temp_file = tempfile.NamedTemporaryFile(delete=False)
+        temp_file.write(b'header\nline0\nline1\nline2\nline3\nline4\n')
+        temp_file.close()  # but don't delete yet, as delete=False
+
+        real_num_lines, real_offsets = ns_test.VaprAnnotator._get_num_data_lines_and_chunk_start_offsets(
+            temp_file.name, 2, num_header_lines=1)
+        self.assertEqual(5, real_num_lines)
+        self.assertListEqual([7, 19, 31], real_offsets)
+
+        # every offset must land on the first line of its chunk
+        with open(temp_file.name, 'r') as file_obj:
+            for curr_chunk_index, curr_offset in enumerate(real_offsets):
+                file_obj.seek(curr_offset)
+                self.assertEqual('line{0}\n'.format(curr_chunk_index * 2), file_obj.readline())
+
+    def test__get_num_data_lines_and_chunk_start_offsets_vcf_header(self):
+        temp_file = tempfile.NamedTemporaryFile(delete=False)
+        temp_file.write(b'##fileformat=VCFv4.1\n#CHROM\tPOS\nrec0\nrec1\n\nrec2\n')
+        temp_file.close()  # but don't delete yet, as delete=False
+
+        real_num_lines, real_offsets = ns_test.VaprAnnotator._get_num_data_lines_and_chunk_start_offsets(
+            temp_file.name, 2)
+        self.assertEqual(3, real_num_lines)
+        self.assertListEqual([32, 43], real_offsets)
+
+    def test__get_num_data_lines_and_chunk_start_offsets_no_data(self):
+        temp_file = tempfile.NamedTemporaryFile(delete=False)
+        temp_file.write(b'header\n')
+        temp_file.close()  # but don't delete yet, as delete=False
+
+        real_num_lines, real_offsets = ns_test.VaprAnnotator._get_num_data_lines_and_chunk_start_offsets(
+            temp_file.name, 2, num_header_lines=1)
+        self.assertEqual(0, real_num_lines)
+        self.assertListEqual([], real_offsets)
+
+    # endregion
+
     # region _make_jobs_params_tuples_list tests
     def test__make_jobs_params_tuples_list_no_samples_default_verbose(self):
         input_file_path = "my/path/to/file.txt"
@@ -570,11 +868,11 @@ class TestVaprAnnotator(unittest.TestCase):
         default_verbose_level = 1
 
         expected_output = [(0, input_file_path, input_chunk_size, input_db_name, input_collection_name,
-                            input_build_version, default_verbose_level),
+                            input_build_version, default_verbose_level, None, None, None, None, None, False, None),
                            (1, input_file_path, input_chunk_size, input_db_name, input_collection_name,
-                            input_build_version, default_verbose_level),
+                            input_build_version, default_verbose_level, None, None, None, None, None, False, None),
                            (2, input_file_path, input_chunk_size, input_db_name, input_collection_name,
-                            input_build_version, default_verbose_level)]
+                            input_build_version, default_verbose_level, None, None, None, None, None, False, None)]
 
         real_output = ns_test.VaprAnnotator._make_jobs_params_tuples_list(
             input_file_path, input_num_file_lines, input_chunk_size, input_db_name, input_collection_name,
@@ -592,7 +890,7 @@ class TestVaprAnnotator(unittest.TestCase):
         default_verbose_level = 1
 
         expected_output = [(0, input_file_path, input_chunk_size, input_db_name, input_collection_name,
-                            input_build_version, default_verbose_level)]
+                            input_build_version, default_verbose_level, None, None, None, None, None, False, None)]
 
         real_output = ns_test.VaprAnnotator._make_jobs_params_tuples_list(
             input_file_path, input_num_file_lines, input_chunk_size, input_db_name, input_collection_name,
@@ -611,11 +909,14 @@ class TestVaprAnnotator(unittest.TestCase):
         input_sample_names_list = ["sample_1", "sample_2"]
 
         expected_output = [(0, input_file_path, input_chunk_size, input_db_name, input_collection_name,
-                            input_build_version, input_verbose_level, input_sample_names_list),
+                            input_build_version, input_verbose_level, input_sample_names_list, None, None,
+                            None, None, False, None),
                            (1, input_file_path, input_chunk_size, input_db_name, input_collection_name,
-                            input_build_version, input_verbose_level, input_sample_names_list),
+                            input_build_version, input_verbose_level, input_sample_names_list, None, None,
+                            None, None, False, None),
                            (2, input_file_path, input_chunk_size, input_db_name, input_collection_name,
-                            input_build_version, input_verbose_level, input_sample_names_list)]
+                            input_build_version, input_verbose_level, input_sample_names_list, None, None,
+                            None, None, False, None)]
 
         real_output = ns_test.VaprAnnotator._make_jobs_params_tuples_list(
             input_file_path, input_num_file_lines, input_chunk_size, input_db_name, input_collection_name,
@@ -623,8 +924,263 @@ class TestVaprAnnotator(unittest.TestCase):
 
         self.assertListEqual(expected_output, real_output)
 
+    def test__make_jobs_params_tuples_list_samples_with_offsets(self):
+        input_file_path = "my/path/to/file.txt"
+        input_num_file_lines = 21
+        input_chunk_size = 10
+        input_db_name = "mydb"
+        input_collection_name = "mycol"
+        input_build_version = "hg19"
+        input_verbose_level = 2
+        input_sample_names_list = ["sample_1", "sample_2"]
+        input_chunk_start_offsets = [150, 1150, 2150]
+
+        expected_output = [(0, input_file_path, input_chunk_size, input_db_name, input_collection_name,
+                            input_build_version, input_verbose_level, input_sample_names_list, 150, None,
+                            None, None, False, None),
+                           (1, input_file_path, input_chunk_size, input_db_name, input_collection_name,
+                            input_build_version, input_verbose_level, input_sample_names_list, 1150, None,
+                            None, None, False, None),
+                           (2, input_file_path, input_chunk_size, input_db_name, input_collection_name,
+                            input_build_version, input_verbose_level, input_sample_names_list, 2150, None,
+                            None, None, False, None)]
+
+        real_output = ns_test.VaprAnnotator._make_jobs_params_tuples_list(
+            input_file_path, input_num_file_lines, input_chunk_size, input_db_name, input_collection_name,
+            input_build_version, sample_names_list=input_sample_names_list, verbose_level=input_verbose_level,
+            chunk_start_offsets_list=input_chunk_start_offsets)
+
+        self.assertListEqual(expected_output, real_output)
+
+    def test__make_jobs_params_tuples_list_w_myvariant_cache(self):
+        input_file_path = "my/path/to/file.txt"
+        input_num_file_lines = 2
+        input_chunk_size = 10
+        input_db_name = "mydb"
+        input_collection_name = "mycol"
+        input_build_version = "hg19"
+        default_verbose_level = 1
+        input_cache_fp = "my/path/to/cache.sqlite"
+
+        expected_output = [(0, input_file_path, input_chunk_size, input_db_name, input_collection_name,
+                            input_build_version, default_verbose_level, None, None,
+                            input_cache_fp, None, None, False, None)]
+
+        real_output = ns_test.VaprAnnotator._make_jobs_params_tuples_list(
+            input_file_path, input_num_file_lines, input_chunk_size, input_db_name, input_collection_name,
+            input_build_version, myvariant_cache_fp=input_cache_fp)
+
+        self.assertListEqual(expected_output, real_output)
+
+    def test__make_jobs_params_tuples_list_w_myvariant_mirror(self):
+        input_file_path = "my/path/to/file.txt"
+        input_num_file_lines = 2
+        input_chunk_size = 10
+        input_db_name = "mydb"
+        input_collection_name = "mycol"
+        input_build_version = "hg19"
+        default_verbose_level = 1
+        input_mirror_fp = "my/path/to/mirror.idx"
+
+        expected_output = [(0, input_file_path, input_chunk_size, input_db_name, input_collection_name,
+                            input_build_version, default_verbose_level, None, None,
+                            None, input_mirror_fp, None, False, None)]
+
+        real_output = ns_test.VaprAnnotator._make_jobs_params_tuples_list(
+            input_file_path, input_num_file_lines, input_chunk_size, input_db_name, input_collection_name,
+            input_build_version, myvariant_mirror_fp=input_mirror_fp)
+
+        self.assertListEqual(expected_output, real_output)
+
     # endregion
 
+    def test__get_storage_mode(self):
+        self.assertEqual(ns_chunk.StorageModes.INSERT, ns_test.VaprAnnotator._get_storage_mode(False, False))
+        self.assertEqual(ns_chunk.StorageModes.REPLACE, ns_test.VaprAnnotator._get_storage_mode(True, False))
+        self.assertEqual(ns_chunk.StorageModes.MERGE_SAMPLES, ns_test.VaprAnnotator._get_storage_mode(False, True))
+        self.assertEqual(ns_chunk.StorageModes.MERGE_SAMPLES, ns_test.VaprAnnotator._get_storage_mode(True, True))
+
+    # region _get_jobs_params_tuples_to_run tests
+    def test__get_jobs_params_tuples_to_run_resume(self):
+        input_jobs = ns_test.VaprAnnotator._make_jobs_params_tuples_list(
+            "my/file.txt", 30, 10, "mydb", "mycol", "hg19", input_fingerprint="abc")
+        ledger_collection = ns_chunk_help.HelpStubLedgerCollection(
+            [{"input_fingerprint": "abc", "file_path": "my/file.txt", "chunk_size": 10, "chunk_index": 1},
+             {"input_fingerprint": "abc", "file_path": "my/file.txt", "chunk_size": 5, "chunk_index": 2}])
+
+        real_output = ns_test.VaprAnnotator._get_jobs_params_tuples_to_run(
+            input_jobs, ledger_collection, "my/file.txt", 10, "abc", resume=True)
+
+        self.assertListEqual([input_jobs[0], input_jobs[2], input_jobs[3]], real_output)
+        self.assertEqual(2, len(ledger_collection.docs_list))
+
+    def test__get_jobs_params_tuples_to_run_resume_changed_contents(self):
+        # e.g., an ANNOVAR shard holding different variants because the number of shards changed
+        input_jobs = ns_test.VaprAnnotator._make_jobs_params_tuples_list(
+            "my/file.txt", 30, 10, "mydb", "mycol", "hg19", input_fingerprint="def")
+        ledger_collection = ns_chunk_help.HelpStubLedgerCollection(
+            [{"input_fingerprint": "abc", "file_path": "my/file.txt", "chunk_size": 10, "chunk_index": 1}])
+
+        with self.assertRaises(ValueError):
+            ns_test.VaprAnnotator._get_jobs_params_tuples_to_run(
+                input_jobs, ledger_collection, "my/file.txt", 10, "def", resume=True)
+
+    def test__get_jobs_params_tuples_to_run_no_resume(self):
+        input_jobs = ns_test.VaprAnnotator._make_jobs_params_tuples_list(
+            "my/file.txt", 30, 10, "mydb", "mycol", "hg19", input_fingerprint="abc")
+        ledger_collection = ns_chunk_help.HelpStubLedgerCollection(
+            [{"input_fingerprint": "def", "file_path": "my/file.txt", "chunk_size": 10, "chunk_index": 1},
+             {"input_fingerprint": "abc", "file_path": "other/file.txt", "chunk_size": 10, "chunk_index": 2},
+             {"input_fingerprint": "abc", "file_path": "my/file.txt", "chunk_size": 5, "chunk_index": 2}])
+
+        real_output = ns_test.VaprAnnotator._get_jobs_params_tuples_to_run(
+            input_jobs, ledger_collection, "my/file.txt", 10, "abc", resume=False)
+
+        self.assertListEqual(input_jobs, real_output)
+        # the earlier runs' records of the file's chunks, and of chunks of the same contents, are cleared
+        self.assertListEqual([{"input_fingerprint": "abc", "file_path": "my/file.txt", "chunk_size": 5,
+                               "chunk_index": 2}], ledger_collection.docs_list)
+
+    # endregion
+
+    def test__iter_jobs_params_tuples_to_run(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_paths = [os.path.join(temp_dir, "shard{0}.txt".format(i)) for i in range(2)]
+            for curr_file_path, curr_num_lines in zip(file_paths, [3, 1]):
+                with open(curr_file_path, "w") as file_obj:
+                    file_obj.write("header\n" + "".join("line{0}\n".format(i) for i in range(curr_num_lines)))
+            with open(file_paths[0], "rb") as file_obj:
+                first_file_fingerprint = hashlib.sha256(file_obj.read()).hexdigest()
+            ledger_collection = ns_chunk_help.HelpStubLedgerCollection(
+                [{"input_fingerprint": first_file_fingerprint, "file_path": file_paths[0], "chunk_size": 2,
+                  "chunk_index": 0}])
+            files_yielded = []
+
+            def help_generate_file_paths():
+                for curr_file_path in file_paths:
+                    files_yielded.append(curr_file_path)
+                    yield curr_file_path
+
+            real_output = ns_test.VaprAnnotator._iter_jobs_params_tuples_to_run(
+                help_generate_file_paths(), 2, "mydb", "mycol", "hg19", ledger_collection, resume=True,
+                sample_names_list=["sample1"])
+
+            # each file is only read once the jobs before it have been taken
+            self.assertEqual((1, file_paths[0], 19), self._help_get_job_file_info(next(real_output)))
+            self.assertListEqual(file_paths[:1], files_yielded)
+            self.assertListEqual([(0, file_paths[1], 7)], [self._help_get_job_file_info(x) for x in real_output])
+            self.assertListEqual(file_paths, files_yielded)
+
+    # region _run_annotation_pipeline tests
+    class HelpStubPipeline(object):
+        """Stands in for the process pool and the fetching and storing stages, recording how many chunks are in
+        flight (submitted but not yet stored) and how many are being fetched at once"""
+
+        def __init__(self, failing_job=None, failing_stage=None):
+            self.submitted_jobs = []
+            self.stored_jobs = []
+            self.max_num_in_flight = 0
+            self.max_num_fetching = 0
+            self._num_in_flight = 0
+            self._num_fetching = 0
+            self._failing_job = failing_job
+            self._failing_stage = failing_stage
+            self._lock = threading.Lock()
+
+        def apply_async(self, func, args, callback, error_callback):
+            with self._lock:
+                self.submitted_jobs.append(args[0])
+                self._num_in_flight += 1
+                self.max_num_in_flight = max(self.max_num_in_flight, self._num_in_flight)
+
+            def help_read_chunk():
+                time.sleep(0.01)
+                try:
+                    self._help_fail_if_needed(args[0], "read")
+                except ValueError as error:
+                    error_callback(error)
+                else:
+                    callback((args[0], [args[0]], None))
+
+            threading.Thread(target=help_read_chunk).start()
+
+        def fetch_chunk(self, job, hgvs_ids_list, annovar_variants):
+            with self._lock:
+                self._num_fetching += 1
+                self.max_num_fetching = max(self.max_num_fetching, self._num_fetching)
+            time.sleep(0.02)
+            with self._lock:
+                self._num_fetching -= 1
+            self._help_fail_if_needed(job, "fetch")
+            return job, [{"hgvs_id": x} for x in hgvs_ids_list], annovar_variants
+
+        def store_chunk(self, job, myvariants_variants, annovar_variants):
+            time.sleep(0.01)
+            try:
+                self._help_fail_if_needed(job, "store")
+                with self._lock:
+                    self.stored_jobs.append(job)
+            finally:
+                with self._lock:
+                    self._num_in_flight -= 1
+
+        def _help_fail_if_needed(self, job, stage):
+            if job == self._failing_job and stage == self._failing_stage:
+                if stage != "store":
+                    with self._lock:
+                        self._num_in_flight -= 1
+                raise ValueError("failed")
+
+    @staticmethod
+    def _help_run_annotation_pipeline(stub_pipeline, jobs_params_tuples, num_fetch_threads,
+                                      max_num_chunks_in_flight):
+        return ns_test.VaprAnnotator._run_annotation_pipeline(
+            stub_pipeline, jobs_params_tuples, stub_pipeline.fetch_chunk, stub_pipeline.store_chunk,
+            num_fetch_threads, 1, max_num_chunks_in_flight)
+
+    def test__run_annotation_pipeline(self):
+        stub_pipeline = self.HelpStubPipeline()
+        real_output = self._help_run_annotation_pipeline(stub_pipeline, list(range(10)), 2, 6)
+        self.assertEqual(10, real_output)
+        self.assertListEqual(list(range(10)), stub_pipeline.submitted_jobs)
+        self.assertListEqual(list(range(10)), sorted(stub_pipeline.stored_jobs))
+        # chunks are still read while others are being fetched, but no more than the fetch threads are fetched at once
+        self.assertEqual(6, stub_pipeline.max_num_in_flight)
+        self.assertEqual(2, stub_pipeline.max_num_fetching)
+
+    def test__run_annotation_pipeline_error(self):
+        for curr_stage in ["read", "fetch", "store"]:
+            stub_pipeline = self.HelpStubPipeline(failing_job=1, failing_stage=curr_stage)
+            with self.assertRaises(ValueError):
+                self._help_run_annotation_pipeline(stub_pipeline, iter(range(10)), 2, 1)
+            # no jobs are submitted after the failure is seen
+            self.assertListEqual([0, 1], stub_pipeline.submitted_jobs)
+            self.assertListEqual([0], stub_pipeline.stored_jobs)
+
+    def test__run_annotation_pipeline_waiting_jobs(self):
+        stub_pipeline = self.HelpStubPipeline()
+
+        def help_generate_jobs():
+            # like a shard still being annotated, the second job only becomes available once the first is stored
+            yield 0
+            deadline = time.time() + 5
+            while len(stub_pipeline.stored_jobs) == 0:
+                self.assertLess(time.time(), deadline)
+                time.sleep(0.01)
+            yield 1
+
+        real_output = self._help_run_annotation_pipeline(stub_pipeline, help_generate_jobs(), 2, 4)
+        self.assertEqual(2, real_output)
+        self.assertEqual(1, stub_pipeline.max_num_in_flight)
+
+    # endregion
+
+    @staticmethod
+    def _help_get_job_file_info(job_params_tuple):
+        return (job_params_tuple[ns_chunk.AnnotationJobParamsIndices.CHUNK_INDEX_INDEX],
+                job_params_tuple[ns_chunk.AnnotationJobParamsIndices.FILE_PATH_INDEX],
+                job_params_tuple[ns_chunk.AnnotationJobParamsIndices.CHUNK_START_OFFSET_INDEX])
+
     # region _get_validated_genome_version tests
     def test__get_validated_genome_version_default(self):
         real_output = ns_test.VaprAnnotator._get_validated_genome_version(None)
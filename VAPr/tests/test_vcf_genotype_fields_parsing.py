@@ -183,6 +183,18 @@ class TestVCFGenotypeInfo(unittest.TestCase):
 
     # endregion
 
+    def test_unprocessed_info(self):
+        dummy_vcfgenotypeinfo = ns_test.VCFGenotypeInfo('')
+        self.assertEqual({}, dummy_vcfgenotypeinfo.unprocessed_info)
+        dummy_vcfgenotypeinfo.unprocessed_info["SB"] = 1.0
+        self.assertEqual({"SB": 1.0}, dummy_vcfgenotypeinfo.unprocessed_info)
+
+    def test_slots(self):
+        dummy_vcfgenotypeinfo = ns_test.VCFGenotypeInfo('')
+        self.assertFalse(hasattr(dummy_vcfgenotypeinfo, "__dict__"))
+        with self.assertRaises(AttributeError):
+            dummy_vcfgenotypeinfo.genotype_quality = 99
+
 
 class TestAllele(unittest.TestCase):
     # No tests of __init__ as it is just setting values
@@ -201,6 +213,9 @@ class TestAllele(unittest.TestCase):
         with self.assertRaises(ValueError):
             dummy_allele.unfiltered_read_counts = 48.5
 
+    def test_slots(self):
+        self.assertFalse(hasattr(ns_test.Allele(0), "__dict__"))
+
 
 class TestGenotypeLikelihood(unittest.TestCase):
     # No tests of init as just calls tested setters
@@ -275,6 +290,9 @@ class TestGenotypeLikelihood(unittest.TestCase):
 
     # endregion
 
+    def test_slots(self):
+        self.assertFalse(hasattr(ns_test.GenotypeLikelihood(0, 1, "2.5"), "__dict__"))
+
 
 class TestVCFGenotypeString(unittest.TestCase):
     def test_is_valid_genotype_fields_string_true(self):
@@ -329,3 +347,109 @@ class TestVCFGenotypeString(unittest.TestCase):
             self.assertEqual("Encountered error 'list index out of range' so genotype fields information could not be "
                              "captured for the current variant.", _help_get_warn_msg(w))
             self.assertIsNone(genotype_to_fill)  # warn and return None but don't error out if any one parse fails
+
+    def test_parse_unprocessed_fields(self):
+        format_string = 'GT:SB:FT'
+        info_string = '0/1:1,2,3.5,x:PASS'
+        genotype_to_fill = ns_test.VCFGenotypeParser.parse(format_string, info_string)
+        self.assertEqual({'SB': [1.0, 2.0, 3.5, 'x'], 'FT': 'PASS'}, genotype_to_fill.unprocessed_info)
+
+    def test_parse_to_dict_GT_AD_DP_GQ_PL_XX(self):
+        format_string = 'GT:AD:DP:GQ:PL:XX'
+        info_string = '0/1:173,141:282:99:255,0,255:7'
+        expected_output = {'genotype': '0/1',
+                           'genotype_subclass_by_class': {'heterozygous': 'reference'},
+                           'filter_passing_reads_count': 282,
+                           'genotype_confidence': 99.0,
+                           'unfiltered_read_counts': [173, 141],
+                           'genotype_likelihoods': [255.0, 0.0, 255.0],
+                           'unprocessed_info': {'XX': 7.0}}
+        real_output = ns_test.VCFGenotypeParser.parse_to_dict(format_string, info_string)
+        self.assertEqual(expected_output, real_output)
+
+    def test_parse_to_dict_exclude_unprocessed(self):
+        real_output = ns_test.VCFGenotypeParser.parse_to_dict('GT:XX', '0/0:7', include_unprocessed=False)
+        self.assertEqual('0/0', real_output['genotype'])
+        self.assertEqual({'homozygous': 'reference'}, real_output['genotype_subclass_by_class'])
+        self.assertEqual({}, real_output['unprocessed_info'])
+
+    def test_parse_to_dict_PL_without_AD(self):
+        real_output = ns_test.VCFGenotypeParser.parse_to_dict('GT:GQ:PL', '1/2:6:89,6,0,70,2,60')
+        self.assertEqual([None, None, None], real_output['unfiltered_read_counts'])
+        self.assertEqual([89, 6, 0, 70, 2, 60], real_output['genotype_likelihoods'])
+
+    def test_parse_to_dict_matches_parse(self):
+        format_string = 'GT:GQ:PL:AD:DP'
+        info_strings = ['1|0:.:1187.2,101,0:.,34:.', '1/1:99:1,2,3,4,5,6:0,34:NULL', '0/0:2:0,1:1,2,3:0']
+        for curr_info_string in info_strings:
+            genotype_info = ns_test.VCFGenotypeParser.parse(format_string, curr_info_string)
+            real_output = ns_test.VCFGenotypeParser.parse_to_dict(format_string, curr_info_string)
+            self.assertEqual(genotype_info.genotype, real_output['genotype'])
+            self.assertEqual(genotype_info.genotype_subclass_by_class, real_output['genotype_subclass_by_class'])
+            self.assertEqual(genotype_info.filter_passing_reads_count, real_output['filter_passing_reads_count'])
+            self.assertEqual(genotype_info.genotype_confidence, real_output['genotype_confidence'])
+            self.assertEqual([x.unfiltered_read_counts for x in genotype_info.alleles],
+                             real_output['unfiltered_read_counts'])
+            self.assertEqual([x.likelihood_neg_exponent for x in genotype_info.genotype_likelihoods],
+                             real_output['genotype_likelihoods'])
+
+    def test_parse_to_dict_likelihood_allele_numbers(self):
+        genotype_info = ns_test.VCFGenotypeParser.parse('GT:PL', '1/2:1,2,3,4,5,6')
+        self.assertEqual([(0, 0), (0, 1), (1, 1), (0, 2), (1, 2), (2, 2)],
+                         [(x.allele1_number, x.allele2_number) for x in genotype_info.genotype_likelihoods])
+
+    def test_parse_to_dict_warn_too_many_likelihoods(self):
+        with warnings.catch_warnings(record=True) as w:
+            real_output = ns_test.VCFGenotypeParser.parse_to_dict('GT:AD:PL', '0/1:1,2:1,2,3,4')
+            self.assertEqual("The PL tag value 1,2,3,4 appears to contain information for more alleles than expected "
+                             "so 'normalized' Phred-scaled likelihoods of possible genotypes information could not be "
+                             "captured for the current variant.", _help_get_warn_msg(w))
+        self.assertEqual([], real_output['genotype_likelihoods'])
+        self.assertEqual([1, 2], real_output['unfiltered_read_counts'])
+
+    def test_parse_to_dict_invalid_string(self):
+        self.assertIsNone(ns_test.VCFGenotypeParser.parse_to_dict('GT:AD', './.:0,0'))
+
+    def test_parse_to_dict_error_reported_as_warn(self):
+        with warnings.catch_warnings(record=True) as w:
+            real_output = ns_test.VCFGenotypeParser.parse_to_dict('GT:AD:GQ:XX', '0/1:1,2:99', include_unprocessed=False)
+            self.assertEqual("Encountered error 'list index out of range' so genotype fields information could not be "
+                             "captured for the current variant.", _help_get_warn_msg(w))
+            self.assertIsNone(real_output)
+
+    def test_parse_to_dict_bad_count_reported_as_warn(self):
+        with warnings.catch_warnings(record=True) as w:
+            real_output = ns_test.VCFGenotypeParser.parse_to_dict('GT:DP', '0/1:-3')
+            self.assertEqual("Encountered error 'Input (-3) must be a non-negative integer' so genotype fields "
+                             "information could not be captured for the current variant.", _help_get_warn_msg(w))
+            self.assertIsNone(real_output)
+
+    def test_is_valid_genotype_fields_string_phased_no_call(self):
+        # '|' isn't among the characters treated as lacking content, so this is (historically) considered valid
+        self.assertTrue(ns_test.VCFGenotypeParser.is_valid_genotype_fields_string(".|."))
+
+    def test_parse_row_to_dicts(self):
+        format_string = 'GT:AD:DP:XX'
+        info_strings = ['0/1:1,2:3:7', './.', '1/1:0,2:.:x', './.:.:.:.']
+        expected_output = [ns_test.VCFGenotypeParser.parse_to_dict(format_string, x) for x in info_strings]
+        real_output = ns_test.VCFGenotypeParser.parse_row_to_dicts(format_string, info_strings)
+        self.assertEqual(expected_output, real_output)
+        self.assertIsNone(real_output[1])
+        self.assertIsNone(real_output[3])
+        self.assertEqual({'XX': 'x'}, real_output[2]['unprocessed_info'])
+
+    def test_parse_row_to_dicts_error_reported_as_warn(self):
+        with warnings.catch_warnings(record=True) as w:
+            real_output = ns_test.VCFGenotypeParser.parse_row_to_dicts('GT:DP', ['0/1:-3', '0/0:5', './.'])
+            self.assertEqual(1, len(w))
+            self.assertEqual("Encountered error 'Input (-3) must be a non-negative integer' so genotype fields "
+                             "information could not be captured for the current variant.", _help_get_warn_msg(w))
+        self.assertIsNone(real_output[0])
+        self.assertEqual(5, real_output[1]['filter_passing_reads_count'])
+        self.assertIsNone(real_output[2])
+
+    def test__get_plan(self):
+        plan = ns_test.VCFGenotypeParser._get_plan('GT:XX:PL')
+        self.assertEqual([(0, 'GT'), (1, 'XX'), (2, 'PL')], [(x[0], x[1]) for x in plan])
+        self.assertEqual([ns_test._parse_genotype, None, ns_test._parse_genotype_likelihoods], [x[2] for x in plan])
+        self.assertIs(plan, ns_test.VCFGenotypeParser._get_plan('GT:XX:PL'))
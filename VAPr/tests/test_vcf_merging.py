@@ -600,6 +600,10 @@ class TestFunctions(unittest.TestCase):
         real_output = ns_test._build_bgzip_vcf_command_str("my/vcf_folder/vcf_file1.vcf")
         self.assertEqual("bgzip -c my/vcf_folder/vcf_file1.vcf", real_output)
 
+    def test__build_bgzip_vcf_command_str_threads(self):
+        real_output = ns_test._build_bgzip_vcf_command_str("my/vcf_folder/vcf_file1.vcf", 4)
+        self.assertEqual("bgzip -c -@ 4 my/vcf_folder/vcf_file1.vcf", real_output)
+
     def test__build_index_vcf_command_str(self):
         real_output = ns_test._build_index_vcf_command_str("my/vcf_folder/vcf_file1.vcf.gz")
         self.assertEqual('tabix -p vcf my/vcf_folder/vcf_file1.vcf.gz', real_output)
@@ -627,8 +631,46 @@ class TestFunctions(unittest.TestCase):
         self.assertTrue(os.path.isfile(temp_HG00097_vcf_file.name + ".gz.tbi"))
         self.assertEqual(expected_output, real_output)
 
+    def test_bgzip_and_index_vcf_up_to_date(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_fp = os.path.join(temp_dir, "HG00097.vcf")
+            for curr_fp, curr_mtime in [(input_fp, 1000), (input_fp + ".gz", 2000), (input_fp + ".gz.tbi", 3000)]:
+                with open(curr_fp, "w") as file_obj:
+                    file_obj.write("contents")
+                os.utime(curr_fp, (curr_mtime, curr_mtime))
+
+            # nothing is run, so the (fake) bgzipped file and index are left as they are
+            real_output = ns_test.bgzip_and_index_vcfs([input_fp, input_fp], num_workers=2)
+            self.assertListEqual([input_fp + ".gz"], real_output)
+            with open(input_fp + ".gz") as file_obj:
+                self.assertEqual("contents", file_obj.read())
+
     # endregion
 
+    def test__is_bgzipped_and_indexed_vcf_up_to_date(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_fp = os.path.join(temp_dir, "HG00097.vcf")
+            bgzipped_fp = input_fp + ".gz"
+            index_fp = bgzipped_fp + ".tbi"
+
+            def help_set_mtimes(*mtimes):
+                for curr_fp, curr_mtime in zip([input_fp, bgzipped_fp, index_fp], mtimes):
+                    if curr_mtime is None:
+                        if os.path.exists(curr_fp):
+                            os.remove(curr_fp)
+                    else:
+                        open(curr_fp, "a").close()
+                        os.utime(curr_fp, (curr_mtime, curr_mtime))
+
+            help_set_mtimes(1000, 2000, 3000)
+            self.assertTrue(ns_test._is_bgzipped_and_indexed_vcf_up_to_date(input_fp, bgzipped_fp))
+            help_set_mtimes(2500, 2000, 3000)  # the vcf was changed after it was compressed
+            self.assertFalse(ns_test._is_bgzipped_and_indexed_vcf_up_to_date(input_fp, bgzipped_fp))
+            help_set_mtimes(1000, 2000, 1500)  # the index is older than the compressed vcf
+            self.assertFalse(ns_test._is_bgzipped_and_indexed_vcf_up_to_date(input_fp, bgzipped_fp))
+            help_set_mtimes(1000, 2000, None)
+            self.assertFalse(ns_test._is_bgzipped_and_indexed_vcf_up_to_date(input_fp, bgzipped_fp))
+
     def test__merge_bgzipped_indexed_vcfs(self):
         # NB: This method works on *already-bgzipped-and-indexed* vcf files, which is why I'm depending on
         # pre-provided test files rather than making my own temporary test files.
@@ -644,6 +686,47 @@ class TestFunctions(unittest.TestCase):
         self.assertTrue(os.path.isfile(output_vcf_fp))
         self.assertTrue(os.stat(output_vcf_fp).st_size > 0)  # file size > 0
 
+    # region split_vcf tests
+    def test_split_vcf(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_fp = os.path.join(temp_dir, "HG00097.vcf")
+            with open(input_fp, "w") as input_file_obj:
+                input_file_obj.write(self.HG00097_VCF_CONTENTS)
+
+            real_output = ns_test.split_vcf(input_fp, temp_dir, 3)
+            self.assertListEqual([os.path.join(temp_dir, "HG00097_shard{0:04d}.vcf".format(i)) for i in range(3)],
+                                 real_output)
+
+            header_lines = [x for x in self.HG00097_VCF_CONTENTS.splitlines(True) if x.startswith("#")]
+            record_lines = [x for x in self.HG00097_VCF_CONTENTS.splitlines(True) if not x.startswith("#")]
+            shard_record_lines = []
+            for curr_shard_fp in real_output:
+                with open(curr_shard_fp) as shard_file_obj:
+                    curr_lines = shard_file_obj.readlines()
+                self.assertListEqual(header_lines, curr_lines[:len(header_lines)])
+                shard_record_lines.extend(curr_lines[len(header_lines):])
+            self.assertListEqual(record_lines, shard_record_lines)
+
+    def test_split_vcf_more_shards_than_records(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_fp = os.path.join(temp_dir, "HG00097.vcf")
+            with open(input_fp, "w") as input_file_obj:
+                input_file_obj.write(self.HG00097_VCF_CONTENTS)
+            num_records = len([x for x in self.HG00097_VCF_CONTENTS.splitlines() if not x.startswith("#")])
+
+            real_output = ns_test.split_vcf(input_fp, temp_dir, num_records + 5)
+            self.assertEqual(num_records, len(real_output))
+
+    def test_split_vcf_gzipped(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            real_output = ns_test.split_vcf(self.test_bgzipped_fps[0], temp_dir, 2)
+            self.assertListEqual([os.path.join(temp_dir, "HG00096_shard{0:04d}.vcf".format(i)) for i in range(2)],
+                                 real_output)
+            self.assertEqual(len(list(vcf.Reader(filename=self.test_bgzipped_fps[0]))),
+                             sum(len(list(vcf.Reader(filename=x))) for x in real_output))
+
+    # endregion
+
     # region merge_vcfs tests
     def test_merge_vcfs_multiple_by_dir_not_bgzipped(self):
         temp_dir = tempfile.TemporaryDirectory()
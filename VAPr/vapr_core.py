@@ -1,11 +1,17 @@
 from __future__ import division, print_function
 
 # built-in libraries
+import concurrent.futures
+import functools
+import hashlib
+import itertools
 import logging
 import multiprocessing
 import os
 import pymongo
 import re
+import tempfile
+import threading
 import tqdm
 import warnings
 
@@ -18,10 +24,17 @@ import VAPr.vcf_merging
 import VAPr.annovar_running
 import VAPr.filtering
 import VAPr.chunk_processing
-from VAPr.annovar_output_parsing import AnnovarTxtParser
+import VAPr.csv_writing
+import VAPr.formatting
+from VAPr.annovar_output_parsing import AnnovarTxtParser, AnnovarAnnotatedVariant
+from VAPr.myvariant_caching import MyVariantInfoCache
+from VAPr.myvariant_mirror import MyVariantInfoMirror
 
 
 class VaprDataset(object):
+    DEFAULT_CURSOR_BATCH_SIZE = 1000
+    DEFAULT_MAX_NUM_OPEN_CSV_FILES = VAPr.csv_writing.CsvFanOutWriter.DEFAULT_MAX_NUM_OPEN_FILES
+
     def __init__(self, mongo_db_name, mongo_collection_name, merged_vcf_path=None):
 
         """Class that contains methods to interact with a parsed database of variants
@@ -80,6 +93,24 @@ class VaprDataset(object):
 
         return self._mongo_db_collection.count()
 
+    def iter_rare_deleterious_variants(self, sample_names_list=None, projection=None, sort=None,
+                                       batch_size=DEFAULT_CURSOR_BATCH_SIZE):
+        """Like get_rare_deleterious_variants, but yields the variants one at a time as they are read from mongo db
+
+        Args:
+          sample_names_list(list: list, optional): list of samples to draw variants from (Default value = None)
+          projection(dict or list, optional): fields to include (or exclude) in each variant, as for pymongo's find (Default value = None)
+          sort(list, optional): list of (key, direction) pairs to sort the variants by (Default value = None)
+          batch_size(int, optional): number of variants to fetch from mongo db at a time (Default value = DEFAULT_CURSOR_BATCH_SIZE)
+
+        Returns:
+          generator: variants
+
+        """
+
+        return self._iter_filtered_variants_by_sample(VAPr.filtering.make_rare_deleterious_variants_filter, sample_names_list,
+                                                      projection=projection, sort=sort, batch_size=batch_size)
+
     def get_rare_deleterious_variants(self, sample_names_list=None):
         """See :ref:`rare-del-variants` for more information on how this is implemented
 
@@ -94,6 +125,24 @@ class VaprDataset(object):
         return self._get_filtered_variants_by_sample(VAPr.filtering.make_rare_deleterious_variants_filter,
                                                      sample_names_list)
 
+    def iter_known_disease_variants(self, sample_names_list=None, projection=None, sort=None,
+                                    batch_size=DEFAULT_CURSOR_BATCH_SIZE):
+        """Like get_known_disease_variants, but yields the variants one at a time as they are read from mongo db
+
+        Args:
+          sample_names_list(list: list, optional): list of samples to draw variants from (Default value = None)
+          projection(dict or list, optional): fields to include (or exclude) in each variant, as for pymongo's find (Default value = None)
+          sort(list, optional): list of (key, direction) pairs to sort the variants by (Default value = None)
+          batch_size(int, optional): number of variants to fetch from mongo db at a time (Default value = DEFAULT_CURSOR_BATCH_SIZE)
+
+        Returns:
+          generator: variants
+
+        """
+
+        return self._iter_filtered_variants_by_sample(VAPr.filtering.make_known_disease_variants_filter, sample_names_list,
+                                                      projection=projection, sort=sort, batch_size=batch_size)
+
     def get_known_disease_variants(self, sample_names_list=None):
         """See :ref:`known-disease` for more information on how this is implemented
 
@@ -108,6 +157,24 @@ class VaprDataset(object):
         return self._get_filtered_variants_by_sample(VAPr.filtering.make_known_disease_variants_filter,
                                                      sample_names_list)
 
+    def iter_deleterious_compound_heterozygous_variants(self, sample_names_list=None, projection=None, sort=None,
+                                                        batch_size=DEFAULT_CURSOR_BATCH_SIZE):
+        """Like get_deleterious_compound_heterozygous_variants, but yields the variants one at a time as they are read from mongo db
+
+        Args:
+          sample_names_list(list: list, optional): list of samples to draw variants from (Default value = None)
+          projection(dict or list, optional): fields to include (or exclude) in each variant, as for pymongo's find (Default value = None)
+          sort(list, optional): list of (key, direction) pairs to sort the variants by (Default value = None)
+          batch_size(int, optional): number of variants to fetch from mongo db at a time (Default value = DEFAULT_CURSOR_BATCH_SIZE)
+
+        Returns:
+          generator: variants
+
+        """
+
+        return self._iter_filtered_variants_by_sample(VAPr.filtering.make_deleterious_compound_heterozygous_variants_filter, sample_names_list,
+                                                      projection=projection, sort=sort, batch_size=batch_size)
+
     def get_deleterious_compound_heterozygous_variants(self, sample_names_list=None):
         """See :ref:`del-compound` for more information on how this is implemented
 
@@ -149,9 +216,100 @@ class VaprDataset(object):
 
         """
 
+        return list(self.iter_custom_filtered_variants(filter_dictionary))
+
+    def iter_custom_filtered_variants(self, filter_dictionary, projection=None, sort=None,
+                                      batch_size=DEFAULT_CURSOR_BATCH_SIZE):
+        """Like get_custom_filtered_variants, but yields the variants one at a time as they are read from mongo db,
+        so that memory use doesn't grow with the number of variants
+
+        Args:
+          filter_dictionary(dictionary: dict): mongodb custom filter
+          projection(dict or list, optional): fields to include (or exclude) in each variant, as for pymongo's find (Default value = None)
+          sort(list, optional): list of (key, direction) pairs to sort the variants by (Default value = None)
+          batch_size(int, optional): number of variants to fetch from mongo db at a time (Default value = DEFAULT_CURSOR_BATCH_SIZE)
+
+        Returns:
+          generator: variants
+
+        """
+
         if self.is_empty:
             warnings.warn("Dataset '{0}' is empty, so all filters return an empty list.".format(self.full_name))
-        return list(self._mongo_db_collection.find(filter_dictionary))
+        cursor = self._mongo_db_collection.find(filter_dictionary, projection=projection, sort=sort,
+                                                batch_size=batch_size)
+        return self._iter_cursor(cursor)
+
+    def ensure_indexes(self):
+        """Create (if they don't already exist) the indexes that back the built-in filters
+
+        Args:
+
+        Returns:
+          list: names of the indexes
+
+        """
+
+        # an index on the same keys may already exist with other options (such as the unique hgvs_id index made when
+        # merging samples), which mongo db won't let be created again without them
+        existing_index_names_by_keys = {tuple(tuple(x) for x in curr_index_info["key"]): curr_index_name for
+                                        curr_index_name, curr_index_info in
+                                        self._mongo_db_collection.index_information().items()}
+        index_names_by_keys = {}
+        index_models = []
+        for curr_keys_list in VAPr.filtering.FILTER_INDEX_KEYS_LISTS:
+            curr_keys = tuple(curr_keys_list)
+            if curr_keys in existing_index_names_by_keys:
+                index_names_by_keys[curr_keys] = existing_index_names_by_keys[curr_keys]
+            else:
+                index_models.append(pymongo.IndexModel(curr_keys_list))
+
+        if len(index_models) > 0:
+            for curr_index_model, curr_index_name in zip(index_models,
+                                                         self._mongo_db_collection.create_indexes(index_models)):
+                index_names_by_keys[tuple(curr_index_model.document["key"].items())] = curr_index_name
+        return [index_names_by_keys[tuple(x)] for x in VAPr.filtering.FILTER_INDEX_KEYS_LISTS]
+
+    def explain_custom_filtered_variants(self, filter_dictionary):
+        """Get mongo db's explanation of how it would run a filter, such as whether it would use an index
+
+        Args:
+          filter_dictionary(dictionary: dict): mongodb custom filter
+
+        Returns:
+          dict: the output of explain() for the filter's query
+
+        """
+
+        return self._mongo_db_collection.find(filter_dictionary).explain()
+
+    def explain_builtin_filters(self, sample_names_list=None):
+        """Get mongo db's explanation of how it would run each of the built-in filters
+
+        Use VAPr.filtering.is_index_backed or VAPr.filtering.get_plan_stages on each explanation to check whether the
+        filter is answered using indexes.
+
+        Args:
+          sample_names_list(list: list, optional): list of samples to draw variants from (Default value = None)
+
+        Returns:
+          dict: the output of explain() for each filter, keyed by filter name
+
+        """
+
+        if sample_names_list is not None and not isinstance(sample_names_list, list):
+            sample_names_list = [sample_names_list]
+
+        filters_by_name = {
+            "rare_deleterious_variants": VAPr.filtering.make_rare_deleterious_variants_filter(sample_names_list),
+            "known_disease_variants": VAPr.filtering.make_known_disease_variants_filter(sample_names_list),
+            "deleterious_compound_heterozygous_variants":
+                VAPr.filtering.make_deleterious_compound_heterozygous_variants_filter(sample_names_list)}
+        if sample_names_list is not None:
+            filters_by_name["variants_for_samples"] = VAPr.filtering.get_any_of_sample_ids_filter(sample_names_list)
+
+        return {curr_name: self.explain_custom_filtered_variants(curr_filter)
+                for curr_name, curr_filter in filters_by_name.items()}
 
     def get_distinct_sample_ids(self):
         """Self-explanatory
@@ -166,6 +324,22 @@ class VaprDataset(object):
         result = self._mongo_db_collection.distinct(VAPr.filtering.SAMPLE_ID_SELECTOR)
         return result
 
+    def get_sample_roster(self):
+        """Get all the samples whose genotypes have been stored to the collection, including any that are listed in no
+        variant because they were stored sparsely and have only homozygous reference or uncalled genotypes
+
+        Args:
+
+        Returns:
+          dict: sorted sample ids of all the samples stored (under 'sample_ids') and of those stored sparsely (under
+            'sparse_sample_ids'); a sparsely stored sample's absence from a variant means it is homozygous reference or
+            not called there
+
+        """
+
+        return VAPr.chunk_processing.get_sample_roster(VAPr.chunk_processing.get_metadata_collection(
+            self._mongo_client, self._mongo_db_name, self._mongo_collection_name))
+
     def get_all_variants(self):
         """Self-explanatory
 
@@ -178,6 +352,21 @@ class VaprDataset(object):
 
         return self.get_custom_filtered_variants({})
 
+    def iter_all_variants(self, projection=None, sort=None, batch_size=DEFAULT_CURSOR_BATCH_SIZE):
+        """Like get_all_variants, but yields the variants one at a time as they are read from mongo db
+
+        Args:
+          projection(dict or list, optional): fields to include (or exclude) in each variant, as for pymongo's find (Default value = None)
+          sort(list, optional): list of (key, direction) pairs to sort the variants by (Default value = None)
+          batch_size(int, optional): number of variants to fetch from mongo db at a time (Default value = DEFAULT_CURSOR_BATCH_SIZE)
+
+        Returns:
+          generator: variants
+
+        """
+
+        return self.iter_custom_filtered_variants({}, projection=projection, sort=sort, batch_size=batch_size)
+
     def get_variants_for_sample(self, sample_name):
         """Return variants for a specific sample
 
@@ -192,6 +381,23 @@ class VaprDataset(object):
         filter_dict = VAPr.filtering.get_sample_id_filter(sample_name)
         return self.get_custom_filtered_variants(filter_dict)
 
+    def iter_variants_for_sample(self, sample_name, projection=None, sort=None, batch_size=DEFAULT_CURSOR_BATCH_SIZE):
+        """Like get_variants_for_sample, but yields the variants one at a time as they are read from mongo db
+
+        Args:
+          sample_name(str): name of sample
+          projection(dict or list, optional): fields to include (or exclude) in each variant, as for pymongo's find (Default value = None)
+          sort(list, optional): list of (key, direction) pairs to sort the variants by (Default value = None)
+          batch_size(int, optional): number of variants to fetch from mongo db at a time (Default value = DEFAULT_CURSOR_BATCH_SIZE)
+
+        Returns:
+          generator: variants
+
+        """
+
+        filter_dict = VAPr.filtering.get_sample_id_filter(sample_name)
+        return self.iter_custom_filtered_variants(filter_dict, projection=projection, sort=sort, batch_size=batch_size)
+
     def get_variants_for_samples(self, specific_sample_names):
         """Return variants from multiple samples
 
@@ -206,6 +412,48 @@ class VaprDataset(object):
         filter_dict = VAPr.filtering.get_any_of_sample_ids_filter(specific_sample_names)
         return self.get_custom_filtered_variants(filter_dict)
 
+    def iter_variants_for_samples(self, specific_sample_names, projection=None, sort=None,
+                                  batch_size=DEFAULT_CURSOR_BATCH_SIZE):
+        """Like get_variants_for_samples, but yields the variants one at a time as they are read from mongo db
+
+        Args:
+          specific_sample_names(list): name of samples
+          projection(dict or list, optional): fields to include (or exclude) in each variant, as for pymongo's find (Default value = None)
+          sort(list, optional): list of (key, direction) pairs to sort the variants by (Default value = None)
+          batch_size(int, optional): number of variants to fetch from mongo db at a time (Default value = DEFAULT_CURSOR_BATCH_SIZE)
+
+        Returns:
+          generator: variants
+
+        """
+
+        filter_dict = VAPr.filtering.get_any_of_sample_ids_filter(specific_sample_names)
+        return self.iter_custom_filtered_variants(filter_dict, projection=projection, sort=sort, batch_size=batch_size)
+
+    def iter_variant_sample_rows(self, sample_names_list=None, filter_dictionary=None, projection=None,
+                                 batch_size=DEFAULT_CURSOR_BATCH_SIZE):
+        """Yields one row per (variant, sample): the variant with its samples replaced by just that sample's dict, as
+        produced by VAPr.formatting.extract_samples.  The rows are made by an aggregation in mongo db rather than by
+        copying variants in python, and are read in batches as they are consumed.
+
+        Args:
+          sample_names_list(list, optional): samples to make rows for; if None, rows are made for every sample (Default value = None)
+          filter_dictionary(dict, optional): mongodb filter selecting the variants to make rows for (Default value = None)
+          projection(dict, optional): $project specification to reshape each row, such as {'_id': 0, 'hgvs_id': 1, 'sample_id': '$samples.sample_id'} (Default value = None)
+          batch_size(int, optional): number of rows to fetch from mongo db at a time (Default value = DEFAULT_CURSOR_BATCH_SIZE)
+
+        Returns:
+          generator: rows
+
+        """
+
+        if self.is_empty:
+            warnings.warn("Dataset '{0}' is empty, so all filters return an empty list.".format(self.full_name))
+        pipeline = VAPr.filtering.make_variant_sample_rows_pipeline(sample_names_list, filter_dictionary, projection)
+        # unwinding can produce many more rows than there are variants, so let mongo db spill to disk if need be
+        cursor = self._mongo_db_collection.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size)
+        return self._iter_cursor(cursor)
+
     def get_variants_as_dataframe(self, filtered_variants=None):
         """Utility to get a dataframe from variants, either all of them or a filtered subset
 
@@ -224,33 +472,60 @@ class VaprDataset(object):
         result.drop('_id', axis=1, inplace=True)
         return result
 
-    def write_unfiltered_annotated_csv(self, output_fp):
-        """Full csv file containing annotations from both annovar and myvariant.info
+    def write_unfiltered_annotated_csv(self, output_fp, compression=None, batch_size=DEFAULT_CURSOR_BATCH_SIZE):
+        """Full csv file containing annotations from both annovar and myvariant.info, streamed from MongoDB in batches
 
         Args:
           output_fp(str): Output file path
+          compression(str, optional): one of the VAPr.csv_writing.CsvCompressions values (Default value = None)
+          batch_size(int, optional): number of variants to hold in memory at once (Default value = DEFAULT_CURSOR_BATCH_SIZE)
 
         Returns:
           None
 
         """
 
-        all_variants = self.get_all_variants()
-        self._write_annotated_csv("write_unfiltered_annotated_csv", all_variants, output_fp)
+        # find the columns in first passes on the server so the variants themselves only have to be read once
+        columns_list, float_columns = VAPr.csv_writing.get_collection_csv_columns(self._mongo_db_collection)
+        self._write_annotated_csv("write_unfiltered_annotated_csv", self.iter_all_variants(batch_size=batch_size),
+                                  output_fp, columns_list=columns_list, float_columns=float_columns,
+                                  compression=compression, batch_size=batch_size)
 
-    def write_filtered_annotated_csv(self, filtered_variants, output_fp):
+    def write_filtered_annotated_csv(self, filtered_variants, output_fp, compression=None):
         """Filtered csv file containing annotations from a list passed to it, coming from MongoDB
 
         Args:
-          filtered_variants(list): variants coming from MongoDB
+          filtered_variants(Iterable[dict]): variants coming from MongoDB, as a list or from one of the iter_* methods
           output_fp(str): Output file path
+          compression(str, optional): one of the VAPr.csv_writing.CsvCompressions values (Default value = None)
 
         Returns:
           None
 
         """
 
-        self._write_annotated_csv("write_filtered_annotated_csv", filtered_variants, output_fp)
+        self._write_annotated_csv("write_filtered_annotated_csv", filtered_variants, output_fp,
+                                  compression=compression)
+
+    def write_maf(self, output_fp, filter_dictionary=None, batch_size=DEFAULT_CURSOR_BATCH_SIZE):
+        """MAF (tab-separated) file of variants, formatted as VAPr.formatting.maf_formatter does, streamed from MongoDB
+        in batches so that memory use doesn't grow with the size of the collection
+
+        Args:
+          output_fp(str): Output file path
+          filter_dictionary(dict, optional): mongodb filter selecting the variants to write; if None, all are written (Default value = None)
+          batch_size(int, optional): number of variants to hold in memory at once (Default value = DEFAULT_CURSOR_BATCH_SIZE)
+
+        Returns:
+          int: number of MAF rows written
+
+        """
+
+        variants_iter = self.iter_custom_filtered_variants({} if filter_dictionary is None else filter_dictionary,
+                                                           batch_size=batch_size)
+        result = VAPr.formatting.write_maf(variants_iter, output_fp, batch_size=batch_size)
+        self._warn_if_no_output("write_maf", None, num_items=result)
+        return result
 
     def write_unfiltered_annotated_vcf(self, vcf_output_path, info_out=True):
         """Filtered vcf file containing annotations from a list passed to it, coming from MongoDB
@@ -265,14 +540,15 @@ class VaprDataset(object):
 
         """
 
-        filtered_variants = self.get_all_variants()
-        self._write_annotated_vcf(filtered_variants, vcf_output_path, info_out=info_out)
+        # only the variants' ids are read up front; their annotations are read as they are written
+        variants_iter = self.iter_all_variants(projection=[AnnovarAnnotatedVariant.HGVS_ID_KEY])
+        self._write_annotated_vcf("write_unfiltered_annotated_vcf", variants_iter, vcf_output_path, info_out=info_out)
 
     def write_filtered_annotated_vcf(self, filtered_variants, vcf_output_path, info_out=True):
         """
 
         Args:
-          filtered_variants(list): variants coming from MongoDB
+          filtered_variants(Iterable[dict]): variants coming from MongoDB, as a list or from one of the iter_* methods
           vcf_output_path(str): Output file path
           info_out: if True, extra annotation information will be written to the vcf file (Default value = True)
           info_out: bool (Default value = True)
@@ -282,80 +558,238 @@ class VaprDataset(object):
 
         """
 
-        self._write_annotated_vcf(filtered_variants, vcf_output_path, info_out=info_out)
+        self._write_annotated_vcf("write_filtered_annotated_vcf", filtered_variants, vcf_output_path,
+                                  info_out=info_out)
 
-    def write_unfiltered_annotated_csvs_per_sample(self, output_dir):
-        """
+    def write_unfiltered_annotated_csvs_per_sample(self, output_dir, num_processes=1,
+                                                   max_num_open_files=DEFAULT_MAX_NUM_OPEN_CSV_FILES):
+        """Write one csv file per sample of all of that sample's variants, reading the collection only once
 
         Args:
-          output_dir: return: None
+          output_dir(str): directory in which to write the csv files
+          num_processes(int, optional): number of processes among which to divide the samples; each process reads only the variants of its own samples (Default value = 1)
+          max_num_open_files(int, optional): maximum number of csv files each process holds open at once (Default value = DEFAULT_MAX_NUM_OPEN_CSV_FILES)
 
         Returns:
           None
 
         """
 
-        sample_ids_list = self.get_distinct_sample_ids()
+        # find every sample's columns in first passes on the server rather than by reading each sample's variants
+        columns_by_sample, float_columns_by_sample = VAPr.csv_writing.get_collection_csv_columns_by_sample(
+            self._mongo_db_collection, VAPr.filtering.SAMPLE_ID_SELECTOR)
+        sample_ids_list = sorted(columns_by_sample)
 
-        for curr_sample_id in sample_ids_list:
-            variant_dicts_list = self.get_variants_for_sample(curr_sample_id)
-            curr_output_fp = os.path.join(output_dir, curr_sample_id + 'unfiltered_annotated_variants.csv')
-            self.write_filtered_annotated_csv(variant_dicts_list, curr_output_fp)
+        if num_processes <= 1 or len(sample_ids_list) <= 1:
+            _write_annotated_csvs_for_samples(self._mongo_db_name, self._mongo_collection_name, columns_by_sample,
+                                              float_columns_by_sample, output_dir, max_num_open_files,
+                                              read_all_variants=True, dataset=self)
+        else:
+            jobs_params_list = []
+            for curr_process_index in range(num_processes):
+                curr_sample_ids_list = sample_ids_list[curr_process_index::num_processes]
+                if len(curr_sample_ids_list) > 0:
+                    curr_columns_by_sample = {x: columns_by_sample[x] for x in curr_sample_ids_list}
+                    curr_float_columns_by_sample = {x: float_columns_by_sample[x] for x in curr_sample_ids_list}
+                    jobs_params_list.append((self._mongo_db_name, self._mongo_collection_name,
+                                             curr_columns_by_sample, curr_float_columns_by_sample, output_dir,
+                                             max_num_open_files))
+
+            pool = multiprocessing.Pool(processes=len(jobs_params_list))
+            try:
+                pool.starmap(_write_annotated_csvs_for_samples, jobs_params_list)
+            finally:
+                pool.close()
+                pool.join()
 
         self._warn_if_no_output("write_unfiltered_annotated_csvs_per_sample", sample_ids_list)
 
-    def _write_annotated_csv(self, func_name, filtered_variants, output_fp):
+    @staticmethod
+    def _get_per_sample_csv_fp(output_dir, sample_id):
+        return os.path.join(output_dir, sample_id + 'unfiltered_annotated_variants.csv')
+
+    @staticmethod
+    def _get_variant_sample_ids(variant_dict):
+        # samples is normally a list of dicts, but a variant of a single sample may hold just that sample's dict; a
+        # sample listed more than once gets the variant only once, as a query on its sample id would return it once
+        samples = variant_dict.get("samples", [])
+        if isinstance(samples, dict):
+            samples = [samples]
+        result = []
+        for curr_sample in samples:
+            curr_sample_id = curr_sample.get("sample_id")
+            if curr_sample_id is not None and curr_sample_id not in result:
+                result.append(curr_sample_id)
+        return result
 
-        no_output = self._warn_if_no_output(func_name, filtered_variants)
+    def _write_annotated_csv(self, func_name, filtered_variants, output_fp, columns_list=None, float_columns=None,
+                             compression=None, batch_size=DEFAULT_CURSOR_BATCH_SIZE):
+
+        if columns_list is None and not isinstance(filtered_variants, list):
+            # filtered_variants may be any iterable, such as one of the iter_* generators, which finding the columns
+            # would use up; so copy the variants to a temporary file while finding them, and write from that
+            with tempfile.TemporaryFile() as spool_file_obj:
+                columns_list, float_columns = VAPr.csv_writing.spool_variants_csv_columns(filtered_variants,
+                                                                                          spool_file_obj)
+                self._write_annotated_csv(func_name, VAPr.csv_writing.iter_spooled_variants(spool_file_obj),
+                                          output_fp, columns_list=columns_list, float_columns=float_columns,
+                                          compression=compression, batch_size=batch_size)
+            return
+
+        if columns_list is None:
+            columns_list, float_columns = VAPr.csv_writing.get_variants_csv_columns(filtered_variants)
+
+        # every variant has at least an hgvs_id, so there are no columns only if there are no variants
+        no_output = self._warn_if_no_output(func_name, columns_list)
         if not no_output:
-            dataframe = self.get_variants_as_dataframe(filtered_variants)
-            dataframe.to_csv(output_fp)
+            VAPr.csv_writing.write_variants_csv(filtered_variants, columns_list, output_fp, compression=compression,
+                                                batch_size=batch_size, float_columns=float_columns)
 
     def _get_filtered_variants_by_sample(self, filter_builder_func, sample_names=None):
 
+        return list(self._iter_filtered_variants_by_sample(filter_builder_func, sample_names))
+
+    def _iter_filtered_variants_by_sample(self, filter_builder_func, sample_names=None, projection=None, sort=None,
+                                          batch_size=DEFAULT_CURSOR_BATCH_SIZE):
+
         if sample_names is not None and not isinstance(sample_names, list):
             sample_names = [sample_names]
         filter_dict = filter_builder_func(sample_names)
-        return self.get_custom_filtered_variants(filter_dict)
+        return self.iter_custom_filtered_variants(filter_dict, projection=projection, sort=sort, batch_size=batch_size)
+
+    @staticmethod
+    def _iter_cursor(cursor):
+        # close the cursor as soon as iteration stops, even if the caller stops early, rather than leaving the
+        # server-side cursor open until it times out
+        try:
+            for curr_variant_dict in cursor:
+                yield curr_variant_dict
+        finally:
+            cursor.close()
 
-    def _write_annotated_vcf(self, filtered_variants_dicts_list, vcf_output_path, info_out=True):
+    def _write_annotated_vcf(self, func_name, filtered_variants, vcf_output_path, info_out=True,
+                             batch_size=DEFAULT_CURSOR_BATCH_SIZE):
 
         if self._merged_vcf_path is None:
             raise ValueError("Original vcf file (to be used as template for output vcf) is not set.")
 
-        # match at least one character of anything but a : followed by :g. followed by at least one digit followed
-        # by at least one NOT digit followed by the end of the line
-        hgvs_regex = r"^([^:]+):g\.(\d+)[^\d].*$"
+        # Rather than looking up each variant in the template with a tabix fetch (one random seek per variant), sort
+        # the variants by position and join them to the template in a single sequential pass over it.
+        # filtered_variants may be any iterable, such as one of the iter_* generators; unless it is a list (whose
+        # variants the caller holds anyway), only the position and mongo id of each variant are kept while sorting, and
+        # the variants are read back from mongo db a batch at a time as they are written.
+        keep_ids = not isinstance(filtered_variants, list)
+        variants_by_chrom, num_variants = self._get_sorted_variants_by_chrom(filtered_variants, info_out, keep_ids)
 
-        vcf_template_path = VAPr.vcf_merging.bgzip_and_index_vcf(self._merged_vcf_path)
         # This open is done using the filename rather than passing a file handle directly (as is done elsewhere)
         # because compressed files must be opened with 'rb' while regular files must be opened with 'r';
         # vcf.Reader will work this out for itself if you pass the file name and let it do the opening.
         # The slight drawback here is that vcf.Reader doesn't clean up after itself well: it leaves its file
         # handle open after use, causing a niggling ResourceWarning: unclosed file warning.
-        vcf_reader = vcf.Reader(filename=vcf_template_path)
+        vcf_reader = vcf.Reader(filename=self._merged_vcf_path)
         vcf_writer = vcf.Writer(open(vcf_output_path, 'w'), vcf_reader)
 
-        for curr_record_dict in filtered_variants_dicts_list:
-            curr_hgvs_id = curr_record_dict["hgvs_id"]
-            match_obj = re.match(hgvs_regex, curr_hgvs_id)
+        records_and_variants = self._join_template_records_to_variants(vcf_reader, variants_by_chrom)
+        if info_out and keep_ids:
+            records_and_variants = self._iter_records_with_fetched_variants(records_and_variants, batch_size)
+        for record, curr_record_dict in records_and_variants:
+            if info_out is True:
+                template_info = record.INFO
+                record.INFO = dict(template_info)
+                record.INFO.update(curr_record_dict)
+                vcf_writer.write_record(record)
+                record.INFO = template_info
+            else:
+                vcf_writer.write_record(record)
+
+        vcf_writer.close()
+        self._warn_if_no_output(func_name, None, num_items=num_variants)
+
+    @staticmethod
+    def _get_sorted_variants_by_chrom(variant_dicts, keep_dicts=True, keep_ids=False):
+        # Each chromosome's list holds (start, input index, value) tuples, where the value is the variant dict, or if
+        # keep_ids is True and the variant has one, just its mongo id (or None if keep_dicts is False)
+        # match at least one character of anything but a : followed by :g. followed by at least one digit followed
+        # by at least one NOT digit followed by the end of the line
+        hgvs_regex = re.compile(r"^([^:]+):g\.(\d+)[^\d].*$")
+
+        variants_by_chrom = {}
+        num_variants = 0
+        for curr_record_dict in variant_dicts:
+            match_obj = hgvs_regex.match(curr_record_dict["hgvs_id"])
             curr_chrom = match_obj.group(1).replace(AnnovarTxtParser.CHR_HEADER, "")
             if curr_chrom == AnnovarTxtParser.STANDARDIZED_CHR_MT_VAL:
                 curr_chrom = AnnovarTxtParser.RAW_CHR_MT_VAL
             curr_start = int(match_obj.group(2))
 
-            for record in vcf_reader.fetch(curr_chrom, curr_start - 1, curr_start + 1):
-                if info_out is True:
-                    record.INFO.update(curr_record_dict)
-                vcf_writer.write_record(record)
-
-        vcf_writer.close()
-        self._warn_if_no_output("write_unfiltered_annotated_csvs_per_sample", filtered_variants_dicts_list)
+            curr_value = None
+            if keep_dicts:
+                curr_value = curr_record_dict.get("_id", curr_record_dict) if keep_ids else curr_record_dict
+
+            # the variant's index keeps variants at the same position in their input order after sorting
+            variants_by_chrom.setdefault(curr_chrom, []).append((curr_start, num_variants, curr_value))
+            num_variants += 1
+
+        for curr_variants_list in variants_by_chrom.values():
+            curr_variants_list.sort(key=lambda x: x[:2])
+        return variants_by_chrom, num_variants
+
+    def _iter_records_with_fetched_variants(self, records_and_variants, batch_size=DEFAULT_CURSOR_BATCH_SIZE):
+        # Yields the (template record, variant) pairs, in the same order, replacing each variant given by its mongo id
+        # (i.e., not as a dict) by its document, read from mongo db along with the rest of its batch
+        pairs_batch = []
+        for curr_pair in itertools.chain(records_and_variants, [None]):
+            if curr_pair is not None:
+                pairs_batch.append(curr_pair)
+                if len(pairs_batch) < batch_size:
+                    continue
+
+            ids_list = list(set(x for _, x in pairs_batch if not isinstance(x, dict)))
+            variants_by_id = {}
+            if len(ids_list) > 0:
+                variants_by_id = {x["_id"]: x for x in self._mongo_db_collection.find({"_id": {"$in": ids_list}})}
+            for record, curr_variant in pairs_batch:
+                if not isinstance(curr_variant, dict):
+                    curr_variant = variants_by_id.get(curr_variant)
+                    if curr_variant is None:
+                        continue  # removed from the collection since its id was read
+                yield record, curr_variant
+            pairs_batch = []
 
-    def _warn_if_no_output(self, output_func_name, items_list):
+    @staticmethod
+    def _join_template_records_to_variants(vcf_reader, variants_by_chrom):
+        # Yields (template record, variant dict) for every variant a template record overlaps, in template order.
+        # A record overlaps the variant at start s when it would have been returned by the tabix fetch previously used
+        # here, fetch(chrom, s - 1, s + 1): that is, when the record's position p and REF length satisfy p <= s + 1 and
+        # p + len(REF) > s.  This requires only that the template be sorted by position within each chromosome, as an
+        # indexable vcf must be.
+        curr_chrom = None
+        curr_variants_list = []
+        first_candidate_index = 0
+        for record in vcf_reader:
+            if record.CHROM != curr_chrom:
+                curr_chrom = record.CHROM
+                curr_variants_list = variants_by_chrom.get(curr_chrom, [])
+                first_candidate_index = 0
+
+            # template positions never decrease, so variants too far behind this record can never match again
+            while first_candidate_index < len(curr_variants_list) and \
+                    curr_variants_list[first_candidate_index][0] < record.POS - 1:
+                first_candidate_index += 1
+
+            record_end = record.POS + len(record.REF)
+            curr_index = first_candidate_index
+            while curr_index < len(curr_variants_list) and curr_variants_list[curr_index][0] < record_end:
+                yield record, curr_variants_list[curr_index][2]
+                curr_index += 1
+
+    def _warn_if_no_output(self, output_func_name, items_list, num_items=None):
+
+        if num_items is None:
+            num_items = len(items_list)
 
         no_output = False
-        if len(items_list) == 0:
+        if num_items == 0:
             no_output = True
             warnings.warn("{0} wrote no file(s) because no relevant samples were found in dataset '{1}'.".format(
                 output_func_name, self._mongo_db_collection.full_name))
@@ -363,6 +797,30 @@ class VaprDataset(object):
         return no_output
 
 
+def _write_annotated_csvs_for_samples(mongo_db_name, mongo_collection_name, columns_by_sample, float_columns_by_sample,
+                                      output_dir, max_num_open_files, read_all_variants=False, dataset=None):
+    # Module-level (rather than a VaprDataset method) so that it can be run in pool worker processes, each of which
+    # makes its own dataset and so its own connection to mongo db.
+    if dataset is None:
+        dataset = VaprDataset(mongo_db_name, mongo_collection_name)
+
+    output_fps_by_sample = {x: VaprDataset._get_per_sample_csv_fp(output_dir, x) for x in columns_by_sample}
+    if read_all_variants:
+        variants_iter = dataset.iter_all_variants()
+    else:
+        # read only the variants of these samples, but still in natural order (rather than, say, the order of an index
+        # on the sample ids) so each file's rows come in the same order as when all variants are read
+        variants_iter = dataset.iter_variants_for_samples(list(columns_by_sample), sort=[("$natural", 1)])
+
+    with VAPr.csv_writing.CsvFanOutWriter(output_fps_by_sample, columns_by_sample,
+                                          max_num_open_files=max_num_open_files,
+                                          float_columns_by_key=float_columns_by_sample) as writer:
+        for curr_variant_dict in variants_iter:
+            for curr_sample_id in VaprDataset._get_variant_sample_ids(curr_variant_dict):
+                if curr_sample_id in output_fps_by_sample:
+                    writer.add(curr_sample_id, curr_variant_dict)
+
+
 class VaprAnnotator(object):
 
     """Class in charge of gathering requirements, finding files, downloading databases required
@@ -387,6 +845,13 @@ class VaprAnnotator(object):
     HG38_VERSION = "hg38"
     DEFAULT_GENOME_VERSION = HG19_VERSION
     SUPPORTED_GENOME_BUILD_VERSIONS = [HG19_VERSION, HG38_VERSION]
+    DEFAULT_MYVARIANT_CACHE_FILE_NAME = "myvariant_cache.sqlite"
+    DEFAULT_NUM_FETCH_THREADS = 4
+    NUM_STORE_THREADS = 2
+    # chunks submitted but not yet stored, per worker (process or thread) of the annotation pipeline: one being worked
+    # on and one waiting
+    NUM_CHUNKS_IN_FLIGHT_PER_WORKER = 2
+    DEFAULT_NUM_DOWNLOAD_WORKERS = VAPr.annovar_running.AnnovarWrapper.DEFAULT_NUM_DOWNLOAD_WORKERS
 
     @staticmethod
     def _get_num_lines_in_file(file_path):
@@ -395,17 +860,65 @@ class VaprAnnotator(object):
             result = sum(1 for _ in file_obj)
         return result
 
+    @staticmethod
+    def _get_num_data_lines_and_chunk_start_offsets(file_path, chunk_size, num_header_lines=None, content_hash=None):
+        """Count the data lines in a file and find the byte offset of the first data line of each chunk, in one pass.
+
+        Args:
+          file_path(str): path to the file to index
+          chunk_size(int): number of data lines per chunk
+          num_header_lines(int, optional): number of header lines at the top of the file; if None, all leading
+            lines starting with '#' (as in a vcf) are treated as header lines.  Defaults to None
+          content_hash(hashlib hash object, optional): hash object to update with the whole of the file's contents, in
+            the same pass.  Defaults to None
+
+        Returns:
+          tuple(int, list): number of data lines in the file, and the byte offset of the first data line of each
+            chunk, in chunk index order
+
+        """
+
+        chunk_start_offsets_list = []
+        num_data_lines = 0
+        curr_offset = 0
+        in_header = True
+
+        # Read in binary mode so that the running total of line lengths is a true byte offset that can be seek()-ed to
+        with open(file_path, 'rb') as file_obj:
+            for line_index, curr_line in enumerate(file_obj):
+                curr_line_start = curr_offset
+                curr_offset += len(curr_line)
+                if content_hash is not None:
+                    content_hash.update(curr_line)
+
+                if in_header:
+                    if num_header_lines is None:
+                        in_header = curr_line.startswith(b'#')
+                    else:
+                        in_header = line_index < num_header_lines
+                    if in_header:
+                        continue
+
+                # blank lines are skipped by the readers, so they don't count toward the chunk size
+                if len(curr_line.strip()) == 0:
+                    continue
+
+                if num_data_lines % chunk_size == 0:
+                    chunk_start_offsets_list.append(curr_line_start)
+                num_data_lines += 1
+
+        return num_data_lines, chunk_start_offsets_list
+
     @staticmethod
     def _make_jobs_params_tuples_list(file_path, num_file_lines, chunk_size, db_name, collection_name,
-                                      genome_build_version, sample_names_list=None, verbose_level=1):
+                                      genome_build_version, sample_names_list=None, verbose_level=1,
+                                      chunk_start_offsets_list=None, myvariant_cache_fp=None,
+                                      myvariant_mirror_fp=None, storage_mode=None, sparse_samples=False,
+                                      input_fingerprint=None):
 
         num_params = VAPr.chunk_processing.AnnotationJobParamsIndices.get_num_possible_indices()
-        if sample_names_list is not None:
-            shared_job_params = [None] * num_params
-            shared_job_params[VAPr.chunk_processing.AnnotationJobParamsIndices.SAMPLE_LIST_INDEX] = sample_names_list
-        else:
-            shared_job_params = [None] * (num_params - 1)
-
+        shared_job_params = [None] * num_params
+        shared_job_params[VAPr.chunk_processing.AnnotationJobParamsIndices.SAMPLE_LIST_INDEX] = sample_names_list
         shared_job_params[VAPr.chunk_processing.AnnotationJobParamsIndices.CHUNK_SIZE_INDEX] = chunk_size
         shared_job_params[VAPr.chunk_processing.AnnotationJobParamsIndices.FILE_PATH_INDEX] = file_path
         shared_job_params[VAPr.chunk_processing.AnnotationJobParamsIndices.DB_NAME_INDEX] = db_name
@@ -413,11 +926,25 @@ class VaprAnnotator(object):
         shared_job_params[VAPr.chunk_processing.AnnotationJobParamsIndices.GENOME_BUILD_VERSION_INDEX] = \
             genome_build_version
         shared_job_params[VAPr.chunk_processing.AnnotationJobParamsIndices.VERBOSE_LEVEL_INDEX] = verbose_level
+        shared_job_params[VAPr.chunk_processing.AnnotationJobParamsIndices.MYVARIANT_CACHE_FP_INDEX] = \
+            myvariant_cache_fp
+        shared_job_params[VAPr.chunk_processing.AnnotationJobParamsIndices.MYVARIANT_MIRROR_FP_INDEX] = \
+            myvariant_mirror_fp
+        shared_job_params[VAPr.chunk_processing.AnnotationJobParamsIndices.STORAGE_MODE_INDEX] = storage_mode
+        shared_job_params[VAPr.chunk_processing.AnnotationJobParamsIndices.SPARSE_SAMPLES_INDEX] = sparse_samples
+        shared_job_params[VAPr.chunk_processing.AnnotationJobParamsIndices.INPUT_FINGERPRINT_INDEX] = input_fingerprint
+
+        if chunk_start_offsets_list is None:
+            num_steps = int(num_file_lines / chunk_size) + 1
+        else:
+            num_steps = len(chunk_start_offsets_list)
 
         jobs_params_tuples_list = []
-        num_steps = int(num_file_lines / chunk_size) + 1
         for curr_chunk_index in range(num_steps):
             shared_job_params[VAPr.chunk_processing.AnnotationJobParamsIndices.CHUNK_INDEX_INDEX] = curr_chunk_index
+            if chunk_start_offsets_list is not None:
+                shared_job_params[VAPr.chunk_processing.AnnotationJobParamsIndices.CHUNK_START_OFFSET_INDEX] = \
+                    chunk_start_offsets_list[curr_chunk_index]
             curr_job_params_tuple = tuple(shared_job_params)
             jobs_params_tuples_list.append(curr_job_params_tuple)
 
@@ -487,20 +1014,24 @@ class VaprAnnotator(object):
         except OSError:
             logging.info('Output directory %s for analysis already exists; using existing directory' % output_dir)
 
-    def download_annovar_databases(self):
-        """ Needed for ANNOVAR to run, it will download the required databases
+    def download_annovar_databases(self, num_download_workers=DEFAULT_NUM_DOWNLOAD_WORKERS):
+        """ Needed for ANNOVAR to run, it will download the required databases, skipping any already downloaded
 
         Args:
+          num_download_workers(int, optional): int maximum number of databases to download at once. Defaults to 4
 
         Returns:
+          OrderedDict: seconds taken to download each database, or None for those already downloaded, keyed by database name
 
         """
         if self._path_to_annovar_install is None:
             raise ValueError("No ANNOVAR install path provided.")
 
-        self._annovar_wrapper.download_databases()
+        return self._annovar_wrapper.download_databases(num_download_workers)
 
-    def annotate_lite(self, num_processes=8, chunk_size=2000, verbose_level=1, allow_adds=False):
+    def annotate_lite(self, num_processes=8, chunk_size=2000, verbose_level=1, allow_adds=False,
+                      use_myvariant_cache=False, myvariant_cache_fp=None, myvariant_mirror_fp=None,
+                      num_fetch_threads=DEFAULT_NUM_FETCH_THREADS, resume=False, merge_samples=False):
         """'Lite' Annotation: it will query `myvariant.info <myvariant.info>`_ only, without
         generating annotations from Annovar. It requires solely VAPr to be installed.
         The execution will grab the HGVS ids from the vcf files and query the variant data from MyVariant.info.
@@ -516,17 +1047,32 @@ class VaprAnnotator(object):
           chunk_size(int, optional): int number of variants to be processed at once. Defaults to 2000
           verbose_level(int, optional): int higher verbosity will give more feedback, raise to 2 or 3 when debugging. Defaults to 1
           allow_adds(bool, optional): bool Allow adding new variants to a pre-existing Mongo collection, or overwrite it (Default value = False)
+          use_myvariant_cache(bool, optional): bool Keep MyVariant.info annotations in a local on-disk cache and only fetch variants not already in it (Default value = False)
+          myvariant_cache_fp(str, optional): str Path to the cache file; if None, a file in the output directory is used (Default value = None)
+          myvariant_mirror_fp(str, optional): str Path to a local MyVariant.info mirror file (see VAPr.myvariant_mirror) to query instead of the MyVariant.info web service (Default value = None)
+          num_fetch_threads(int, optional): int number of chunks whose MyVariant.info annotations are fetched at once, however many processes are reading chunks. Defaults to 4
+          resume(bool, optional): bool Continue an interrupted run into the same collection, storing only the chunks not recorded as complete by it; variants are upserted on hgvs_id so that re-storing a partially-stored chunk doesn't create duplicates. Chunks are matched to the interrupted run's by the contents of the file they are read from, and resuming fails if a file now holds different variants than in that run (Default value = False)
+          merge_samples(bool, optional): bool Add to an existing collection incrementally: the samples of variants already in it are added to their existing documents, and only variants not already in it are fetched from MyVariant.info and inserted (Default value = False)
 
         Returns:
           class:`~VAPr.vapr_core.VaprDataset`
 
         """
-        result = self._make_dataset_for_results("annotate_lite", allow_adds)
-        self._collect_annotations_and_store(self._single_vcf_path, chunk_size, num_processes, sample_names_list=None,
-                                            verbose_level=verbose_level)
+        result = self._make_dataset_for_results("annotate_lite", allow_adds or resume or merge_samples)
+        self._collect_annotations_and_store([self._single_vcf_path], chunk_size, num_processes, sample_names_list=None,
+                                            verbose_level=verbose_level,
+                                            myvariant_cache_fp=self._get_myvariant_cache_fp(use_myvariant_cache,
+                                                                                            myvariant_cache_fp),
+                                            myvariant_mirror_fp=myvariant_mirror_fp,
+                                            num_fetch_threads=num_fetch_threads, resume=resume,
+                                            merge_samples=merge_samples)
+        result.ensure_indexes()
         return result
 
-    def annotate(self, num_processes=4, chunk_size=2000, verbose_level=1, allow_adds=False):
+    def annotate(self, num_processes=4, chunk_size=2000, verbose_level=1, allow_adds=False,
+                 use_myvariant_cache=False, myvariant_cache_fp=None, myvariant_mirror_fp=None,
+                 num_fetch_threads=DEFAULT_NUM_FETCH_THREADS, resume=False, merge_samples=False,
+                 sparse_samples=False, num_annovar_processes=1, stream_annovar_output=False, force_annovar=False):
         """This is the main function of the package. It will run Annovar beforehand, and will kick-start the full
         annotation functionality. Namely, it will collect all the variant data from Annovar annotations, combine
         it with data coming from MyVariant.info, and parse it to MongoDB, in the database and collection specified in
@@ -540,6 +1086,16 @@ class VaprAnnotator(object):
           chunk_size(int, optional): int number of variants to be processed at once. Defaults to 2000
           verbose_level(int, optional): int higher verbosity will give more feedback, raise to 2 or 3 when debugging. Defaults to 1
           allow_adds(bool, optional): bool Allow adding new variants to a pre-existing Mongo collection, or overwrite it (Default value = False)
+          use_myvariant_cache(bool, optional): bool Keep MyVariant.info annotations in a local on-disk cache and only fetch variants not already in it (Default value = False)
+          myvariant_cache_fp(str, optional): str Path to the cache file; if None, a file in the output directory is used (Default value = None)
+          myvariant_mirror_fp(str, optional): str Path to a local MyVariant.info mirror file (see VAPr.myvariant_mirror) to query instead of the MyVariant.info web service (Default value = None)
+          num_fetch_threads(int, optional): int number of chunks whose MyVariant.info annotations are fetched at once, however many processes are reading chunks. Defaults to 4
+          resume(bool, optional): bool Continue an interrupted run into the same collection, storing only the chunks not recorded as complete by it; variants are upserted on hgvs_id so that re-storing a partially-stored chunk doesn't create duplicates. Chunks are matched to the interrupted run's by the contents of the file they are read from, and resuming fails if a file now holds different variants than in that run (Default value = False)
+          merge_samples(bool, optional): bool Add to an existing collection incrementally: the samples of variants already in it are added to their existing documents, and only variants not already in it are fetched from MyVariant.info and inserted (Default value = False)
+          sparse_samples(bool, optional): bool List in each variant only the samples with a non-reference genotype for it, leaving out those that are homozygous reference or not called; the full sample roster is recorded in the collection's metadata (see VaprDataset.get_sample_roster) (Default value = False)
+          num_annovar_processes(int, optional): int number of ANNOVAR processes to run at once, each annotating a shard of consecutive variants of the vcf (Default value = 1)
+          stream_annovar_output(bool, optional): bool Start reading, annotating and storing the variants of each ANNOVAR shard as soon as its ANNOVAR process finishes, rather than after all of them have; the shards are still combined into the usual ANNOVAR output file at the end. Most useful with num_annovar_processes greater than 1 (Default value = False)
+          force_annovar(bool, optional): bool Run ANNOVAR even if the output of an earlier run on the same variants, samples, genome build and ANNOVAR databases can be reused (Default value = False)
 
         Returns:
           class: class:`~VAPr.vapr_core.VaprDataset`
@@ -549,11 +1105,25 @@ class VaprAnnotator(object):
         if self._path_to_annovar_install is None:
             raise ValueError("No ANNOVAR install path provided.")
 
-        result = self._make_dataset_for_results("annotate", allow_adds)
-        annovar_output_fp = self._annovar_wrapper.run_annotation(self._single_vcf_path, self._output_basename,
-                                                                 self._output_dir)
-        self._collect_annotations_and_store(annovar_output_fp, chunk_size, num_processes,
-                                            sample_names_list=self._sample_names_list, verbose_level=verbose_level)
+        result = self._make_dataset_for_results("annotate", allow_adds or resume or merge_samples)
+        collect_kwargs = dict(sample_names_list=self._sample_names_list, verbose_level=verbose_level,
+                              myvariant_cache_fp=self._get_myvariant_cache_fp(use_myvariant_cache, myvariant_cache_fp),
+                              myvariant_mirror_fp=myvariant_mirror_fp, num_fetch_threads=num_fetch_threads,
+                              resume=resume, merge_samples=merge_samples, sparse_samples=sparse_samples)
+        if stream_annovar_output:
+            # this thread waits on the shards to finish, submitting the (bounded number of) chunks of each to the
+            # process pool as soon as it is annotated
+            with self._annovar_wrapper.start_sharded_annotation(self._single_vcf_path, self._output_basename,
+                                                                self._output_dir, num_annovar_processes,
+                                                                force_annovar) as sharded_run:
+                self._collect_annotations_and_store(sharded_run.iter_finished_shard_output_fps(), chunk_size,
+                                                    num_processes, **collect_kwargs)
+        else:
+            annovar_output_fp = self._annovar_wrapper.run_annotation(self._single_vcf_path, self._output_basename,
+                                                                     self._output_dir, num_annovar_processes,
+                                                                     force_annovar)
+            self._collect_annotations_and_store([annovar_output_fp], chunk_size, num_processes, **collect_kwargs)
+        result.ensure_indexes()
         return result
 
     def _make_dataset_for_results(self, func_name, allow_adds):
@@ -573,20 +1143,218 @@ class VaprAnnotator(object):
 
         return result
 
-    # TODO: someday: extra_data from design file needs to come back in here
-    def _collect_annotations_and_store(self, file_path, chunk_size, num_processes, sample_names_list=None,
-                                       verbose_level=1):
+    def _get_myvariant_cache_fp(self, use_myvariant_cache, myvariant_cache_fp):
 
-        num_file_lines = self._get_num_lines_in_file(file_path)
-        jobs_params_tuples_list = self._make_jobs_params_tuples_list(
-            file_path, num_file_lines, chunk_size, self._mongo_db_name, self._mongo_collection_name,
-            self._genome_build_version, sample_names_list, verbose_level)
+        result = None
+        if use_myvariant_cache:
+            result = myvariant_cache_fp
+            if result is None:
+                result = os.path.join(self._output_dir, self.DEFAULT_MYVARIANT_CACHE_FILE_NAME)
+        return result
 
+    # TODO: someday: extra_data from design file needs to come back in here
+    def _collect_annotations_and_store(self, file_paths, chunk_size, num_processes, sample_names_list=None,
+                                       verbose_level=1, myvariant_cache_fp=None, myvariant_mirror_fp=None,
+                                       num_fetch_threads=DEFAULT_NUM_FETCH_THREADS, resume=False,
+                                       merge_samples=False, sparse_samples=False):
+        # file_paths are ANNOVAR outputs (or, with no sample names, vcfs).  They may be generated as they are written,
+        # such as ANNOVAR shard outputs; each file is then only split into chunks once yielded, while the chunks of
+        # earlier files are already being processed.  The generator is only drawn on from this thread (see
+        # _run_annotation_pipeline), never from one of the process pool's threads, so waiting on it doesn't hold up
+        # the chunks already submitted.
+        if myvariant_mirror_fp is not None:
+            self._validate_myvariant_mirror(myvariant_mirror_fp)
+
+        storage_mode = self._get_storage_mode(resume, merge_samples)
+        client = pymongo.MongoClient(maxPoolSize=None, waitQueueTimeoutMS=200)
+        try:
+            if storage_mode != VAPr.chunk_processing.StorageModes.INSERT:
+                # upserts look variants up by hgvs_id; when merging, chunks sharing a variant new to the collection
+                # could otherwise each insert it
+                collection = getattr(getattr(client, self._mongo_db_name), self._mongo_collection_name)
+                VAPr.chunk_processing.ensure_hgvs_id_index(
+                    collection, unique=storage_mode == VAPr.chunk_processing.StorageModes.MERGE_SAMPLES)
+            if sample_names_list is not None:
+                # record the samples up front, so the roster is complete even if the run is interrupted
+                VAPr.chunk_processing.record_sample_roster(
+                    VAPr.chunk_processing.get_metadata_collection(client, self._mongo_db_name,
+                                                                  self._mongo_collection_name),
+                    sample_names_list, sparse_samples)
+        finally:
+            client.close()
+
+        initial_cache_stats = None
+        if myvariant_cache_fp is not None:
+            initial_cache_stats = self._get_myvariant_cache_stats(myvariant_cache_fp)
+
+        # the worker processes only read chunks; the client is opened after forking them, and is shared by the jobs
+        # generation below and by all the fetching and storing threads
         pool = multiprocessing.Pool(num_processes)
-        for _ in tqdm.tqdm(
-                pool.imap_unordered(
-                    VAPr.chunk_processing.collect_chunk_annotations_and_store, jobs_params_tuples_list),
-                total=len(jobs_params_tuples_list)):
-            pass
-        pool.close()
-        pool.join()
+        client = pymongo.MongoClient(maxPoolSize=None, waitQueueTimeoutMS=200)
+        try:
+            ledger_collection = VAPr.chunk_processing.get_chunk_ledger_collection(
+                client, self._mongo_db_name, self._mongo_collection_name)
+            jobs_params_tuples = self._iter_jobs_params_tuples_to_run(
+                file_paths, chunk_size, self._mongo_db_name, self._mongo_collection_name, self._genome_build_version,
+                ledger_collection, resume, sample_names_list, verbose_level, myvariant_cache_fp, myvariant_mirror_fp,
+                storage_mode, sparse_samples)
+            if isinstance(file_paths, list):
+                # the files are all already written, so make all the jobs up front to give the progress bar a total
+                jobs_params_tuples = list(jobs_params_tuples)
+            num_chunks = self._run_annotation_pipeline(
+                pool, jobs_params_tuples,
+                functools.partial(VAPr.chunk_processing.fetch_chunk_myvariant_annotations, client=client),
+                functools.partial(VAPr.chunk_processing.merge_and_store_chunk_annotations, client=client),
+                num_fetch_threads, self.NUM_STORE_THREADS,
+                (num_processes + num_fetch_threads + self.NUM_STORE_THREADS) * self.NUM_CHUNKS_IN_FLIGHT_PER_WORKER)
+        finally:
+            pool.close()
+            pool.join()
+            client.close()
+            # the fetching threads opened any caches in this process
+            VAPr.chunk_processing.close_myvariant_caches()
+        logging.info("Stored {0} chunks".format(num_chunks))
+
+        if myvariant_cache_fp is not None:
+            final_cache_stats = self._get_myvariant_cache_stats(myvariant_cache_fp)
+            logging.info("MyVariant.info cache '{0}': {1} hits, {2} misses this run; {3} annotations cached".format(
+                myvariant_cache_fp,
+                final_cache_stats[MyVariantInfoCache.HITS_KEY] - initial_cache_stats[MyVariantInfoCache.HITS_KEY],
+                final_cache_stats[MyVariantInfoCache.MISSES_KEY] - initial_cache_stats[MyVariantInfoCache.MISSES_KEY],
+                final_cache_stats[MyVariantInfoCache.NUM_ENTRIES_KEY]))
+
+    @staticmethod
+    def _get_storage_mode(resume, merge_samples):
+        if merge_samples:
+            # merging is idempotent, so it is also safe for redoing chunks partially stored by an interrupted run
+            result = VAPr.chunk_processing.StorageModes.MERGE_SAMPLES
+        elif resume:
+            # upsert rather than insert so that chunks partially stored by the interrupted run can be redone
+            result = VAPr.chunk_processing.StorageModes.REPLACE
+        else:
+            result = VAPr.chunk_processing.StorageModes.INSERT
+        return result
+
+    @classmethod
+    def _iter_jobs_params_tuples_to_run(cls, file_paths, chunk_size, db_name, collection_name, genome_build_version,
+                                        ledger_collection, resume=False, sample_names_list=None, verbose_level=1,
+                                        myvariant_cache_fp=None, myvariant_mirror_fp=None, storage_mode=None,
+                                        sparse_samples=False):
+        # ANNOVAR output has a single header line; a vcf has a variable number of header lines, all starting with '#'
+        num_header_lines = None if sample_names_list is None else 1
+        for curr_file_path in file_paths:
+            # the file's contents, rather than its path, identify its chunks in the ledger
+            content_hash = hashlib.sha256()
+            num_data_lines, chunk_start_offsets_list = cls._get_num_data_lines_and_chunk_start_offsets(
+                curr_file_path, chunk_size, num_header_lines, content_hash)
+            input_fingerprint = content_hash.hexdigest()
+            jobs_params_tuples_list = cls._make_jobs_params_tuples_list(
+                curr_file_path, num_data_lines, chunk_size, db_name, collection_name, genome_build_version,
+                sample_names_list, verbose_level, chunk_start_offsets_list, myvariant_cache_fp, myvariant_mirror_fp,
+                storage_mode, sparse_samples, input_fingerprint)
+            for curr_job_params_tuple in cls._get_jobs_params_tuples_to_run(
+                    jobs_params_tuples_list, ledger_collection, curr_file_path, chunk_size, input_fingerprint, resume):
+                yield curr_job_params_tuple
+
+    @staticmethod
+    def _get_jobs_params_tuples_to_run(jobs_params_tuples_list, ledger_collection, file_path, chunk_size,
+                                       input_fingerprint, resume):
+        if not resume:
+            VAPr.chunk_processing.reset_chunk_ledger(ledger_collection, file_path, chunk_size, input_fingerprint)
+            return jobs_params_tuples_list
+
+        VAPr.chunk_processing.ensure_chunk_ledger_index(ledger_collection)
+        completed_chunk_indices = VAPr.chunk_processing.get_completed_chunk_indices(ledger_collection, file_path,
+                                                                                    chunk_size, input_fingerprint)
+        result = [x for x in jobs_params_tuples_list if
+                  x[VAPr.chunk_processing.AnnotationJobParamsIndices.CHUNK_INDEX_INDEX] not in completed_chunk_indices]
+        logging.info("Resuming annotation of '{0}': {1} of {2} chunks already stored, {3} to go".format(
+            file_path, len(jobs_params_tuples_list) - len(result), len(jobs_params_tuples_list), len(result)))
+        return result
+
+    @staticmethod
+    def _run_annotation_pipeline(pool, jobs_params_tuples, fetch_chunk_func, store_chunk_func, num_fetch_threads,
+                                 num_store_threads, max_num_chunks_in_flight):
+        # Each chunk goes through three stages, each with its own workers: it is read (and parsed) by the process pool,
+        # its MyVariant.info annotations are fetched by fetch_chunk_func on one of num_fetch_threads threads, and it is
+        # merged and stored by store_chunk_func on one of num_store_threads threads.  A chunk is handed on to the next
+        # stage as soon as it is done with the last, so the processes keep reading while the fetches wait on the
+        # network, however many of each there are.  Jobs are submitted from this thread as they are drawn from
+        # jobs_params_tuples, which may be a generator that waits (e.g. on ANNOVAR shards still being annotated) while
+        # the submitted chunks go through the stages, but no more than max_num_chunks_in_flight chunks are ever
+        # submitted and not yet stored.
+        chunk_slots = threading.BoundedSemaphore(max_num_chunks_in_flight)
+        chunk_errors = []
+        chunk_futures = []
+        finish_lock = threading.Lock()
+
+        num_jobs = len(jobs_params_tuples) if isinstance(jobs_params_tuples, list) else None
+        with tqdm.tqdm(total=num_jobs) as progress_bar, \
+                concurrent.futures.ThreadPoolExecutor(num_fetch_threads) as fetch_executor, \
+                concurrent.futures.ThreadPoolExecutor(num_store_threads) as store_executor:
+
+            def finish_chunk(chunk_future, error=None):
+                with finish_lock:
+                    if error is None:
+                        progress_bar.update()
+                        chunk_future.set_result(None)
+                    else:
+                        chunk_errors.append(error)
+                        chunk_future.set_exception(error)
+                chunk_slots.release()
+
+            def on_chunk_read(chunk_future, read_result):
+                # runs on the process pool's result-handling thread, so it only hands the chunk on
+                try:
+                    fetch_future = fetch_executor.submit(fetch_chunk_func, *read_result)
+                    fetch_future.add_done_callback(functools.partial(on_chunk_fetched, chunk_future))
+                except Exception as error:
+                    finish_chunk(chunk_future, error)
+
+            def on_chunk_fetched(chunk_future, fetch_future):
+                try:
+                    store_future = store_executor.submit(store_chunk_func, *fetch_future.result())
+                    store_future.add_done_callback(lambda x: finish_chunk(chunk_future, x.exception()))
+                except Exception as error:
+                    finish_chunk(chunk_future, error)
+
+            try:
+                for curr_job_params_tuple in jobs_params_tuples:
+                    chunk_slots.acquire()
+                    if len(chunk_errors) > 0:
+                        # stop submitting; the error is raised below
+                        break
+                    curr_chunk_future = concurrent.futures.Future()
+                    chunk_futures.append(curr_chunk_future)
+                    pool.apply_async(VAPr.chunk_processing.read_chunk_variants, (curr_job_params_tuple,),
+                                     callback=functools.partial(on_chunk_read, curr_chunk_future),
+                                     error_callback=functools.partial(finish_chunk, curr_chunk_future))
+            finally:
+                # the executors can't be shut down while chunks are still being handed on to them
+                concurrent.futures.wait(chunk_futures)
+
+            # surface any error raised while reading, fetching or storing
+            for curr_chunk_future in chunk_futures:
+                curr_chunk_future.result()
+
+        return len(chunk_futures)
+
+    def _validate_myvariant_mirror(self, myvariant_mirror_fp):
+        # fail fast, rather than in every worker process, if the mirror is unreadable or for the wrong assembly
+        myvariant_mirror = MyVariantInfoMirror(myvariant_mirror_fp)
+        try:
+            if myvariant_mirror.assembly != self._genome_build_version:
+                raise ValueError("MyVariant.info mirror '{0}' is for assembly '{1}', not '{2}'".format(
+                    myvariant_mirror_fp, myvariant_mirror.assembly, self._genome_build_version))
+        finally:
+            myvariant_mirror.close()
+
+    @staticmethod
+    def _get_myvariant_cache_stats(myvariant_cache_fp):
+
+        myvariant_cache = MyVariantInfoCache(myvariant_cache_fp)
+        try:
+            result = myvariant_cache.stats
+        finally:
+            myvariant_cache.close()
+        return result
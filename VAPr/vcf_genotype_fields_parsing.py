@@ -23,20 +23,18 @@ def _warn_of_unparseable_format_field(field_desc, field_tag, field_value, failur
     warnings.warn(warn_msg)
 
 
-def _capture_unprocessed_field(field_tag, field_value, genotype_info_to_fill):
-    """Attempt basic delimiter splitting and/or numeric casting for input field, and store results in VCFGenotypeInfo.
+def _parse_unprocessed_value(field_value):
+    """Attempt basic delimiter splitting and/or numeric casting for the value of a field without a dedicated parser.
 
     Args:
-        field_tag (str): The two- or three-character key for this field in the VCF format line (e.g., AD, PL, etc).
         field_value (str): The string value associated with the field in the VCF format value line.
-        genotype_info_to_fill (VCFGenotypeInfo): A partially filled VCFGenotypeInfo object
 
     Returns:
-        VCFGenotypeInfo: The input VCFGenotypeInfo with additional entries added to unprocessed_info dictionary.
-
+        float, str, or List[float or str]: The value as a float if possible; otherwise, if it contains commas, the list
+            of its comma-delimited parts, each cast to float if possible; otherwise, the unchanged value.
     """
     try:
-        genotype_info_to_fill.unprocessed_info[field_tag] = float(field_value)
+        return float(field_value)
     except ValueError:  # if the value can't be converted to a float
         split_list = field_value.split(",")
         cast_split_list = []
@@ -48,22 +46,18 @@ def _capture_unprocessed_field(field_tag, field_value, genotype_info_to_fill):
                 cast_split_list.append(value)
 
         if len(cast_split_list) > 1:
-            genotype_info_to_fill.unprocessed_info[field_tag] = cast_split_list
-        else:
-            genotype_info_to_fill.unprocessed_info[field_tag] = cast_split_list[0]
-
-    return genotype_info_to_fill
+            return cast_split_list
+        return cast_split_list[0]
 
 
-def _fill_genotype_class(alleles, genotype_info_to_fill):
-    """Id genotype class (homozygous/heterozygous) and subclass (reference, alt, compound) and store in VCFGenotypeInfo.
+def _get_genotype_subclass_by_class(alleles):
+    """Id genotype class (homozygous/heterozygous) and subclass (reference, alt, compound).
 
     Args:
         alleles (List[str]): Results of splitting the value for the GT (genotype) format tag.
-        genotype_info_to_fill (VCFGenotypeInfo): A partially filled VCFGenotypeInfo object.
 
     Returns:
-        VCFGenotypeInfo: The input VCFGenotypeInfo with genotype_subclass_by_class value set.
+        Dict[str, str]: Genotype subclass keyed by genotype class, e.g. {'heterozygous': 'compound'}.
 
     """
     genotype_class = "homozygous"
@@ -77,20 +71,31 @@ def _fill_genotype_class(alleles, genotype_info_to_fill):
     if "0" not in alleles:
         genotype_subclass = alt_subclass_name
 
-    result = {genotype_class: genotype_subclass}
-    genotype_info_to_fill.genotype_subclass_by_class = result
-    return result
+    return {genotype_class: genotype_subclass}
 
 
-def _fill_genotype(field_value, genotype_info_to_fill):
-    """Parse the genotype of this sample at this site and store in the VCFGenotypeInfo.
+_NULL_VALUES = frozenset(['.', '', 'NULL'])  # as in VAPr.validation.convert_to_nullable
+_MAX_EXACT_INT_DIGITS = 15  # longer integers may not round-trip through float, as VAPr.validation converts them
+
+
+def _convert_to_nullable_float(value):
+    return None if value in _NULL_VALUES else float(value)
+
+
+def _convert_to_nullable_nonneg_int(value):
+    # plain digit strings (by far the most common case) are converted directly; anything else goes through validation
+    if value.isdigit() and value.isascii() and len(value) <= _MAX_EXACT_INT_DIGITS:
+        return int(value)
+    return VAPr.validation.convert_to_nonneg_int(value, nullable=True)
+
+
+def _parse_genotype(field_value, parsed_fields):
+    """Parse the genotype of this sample at this site and store it (and its class and subclass) in parsed_fields.
 
     Args:
         field_value (str): The value associated with the GT tag in the format value string.
-        genotype_info_to_fill (VCFGenotypeInfo): A partially filled VCFGenotypeInfo object.
-
-    Returns:
-        VCFGenotypeInfo: the input VCFGenotypeInfo with additional fields filled in.
+        parsed_fields (dict): The partially filled dictionary of parsed fields, keyed as for
+            VCFGenotypeParser.parse_to_dict.
 
     From https://gatkforums.broadinstitute.org/gatk/discussion/1268/what-is-a-vcf-and-how-should-i-interpret-it :
     " GT : The genotype of this sample at this site.
@@ -108,7 +113,6 @@ def _fill_genotype(field_value, genotype_info_to_fill):
       For non-diploids, the same pattern applies; in the haploid case there will be just a single value in GT; for
       polyploids there will be more, e.g. 4 values for a tetraploid organism."
     """
-
     alleles = field_value.split('/')
     if len(alleles) == 1:
         alleles = field_value.split('|')
@@ -116,21 +120,18 @@ def _fill_genotype(field_value, genotype_info_to_fill):
     if len(alleles) != 2:
         _warn_of_unparseable_format_field("genotype", VCFGenotypeParser.GENOTYPE_TAG, field_value,
                                           "does not split into exactly two values")
-        return genotype_info_to_fill
-    genotype_info_to_fill.genotype = field_value
-    _fill_genotype_class(alleles, genotype_info_to_fill)
-    return genotype_info_to_fill
+        return
+    parsed_fields[VCFGenotypeParser.GENOTYPE_KEY] = field_value
+    parsed_fields[VCFGenotypeParser.GENOTYPE_SUBCLASS_BY_CLASS_KEY] = _get_genotype_subclass_by_class(alleles)
 
 
-def _fill_unfiltered_reads_counts(field_value, genotype_info_to_fill):
-    """Parse the unfiltered reads counts for this sample at this site and store in the VCFGenotypeInfo.
+def _parse_unfiltered_reads_counts(field_value, parsed_fields):
+    """Parse the unfiltered reads counts for this sample at this site and add them to parsed_fields.
 
     Args:
         field_value (str): The value associated with the AD tag in the format value string.
-        genotype_info_to_fill (VCFGenotypeInfo): A partially filled VCFGenotypeInfo object.
-
-    Returns:
-        VCFGenotypeInfo: The input VCFGenotypeInfo with new entries added to the alleles list.
+        parsed_fields (dict): The partially filled dictionary of parsed fields, keyed as for
+            VCFGenotypeParser.parse_to_dict.
 
     From https://gatkforums.broadinstitute.org/gatk/discussion/1268/what-is-a-vcf-and-how-should-i-interpret-it  :
     " AD ... : Allele depth ....
@@ -139,28 +140,22 @@ def _fill_unfiltered_reads_counts(field_value, genotype_info_to_fill):
       except reads that were considered uninformative. Reads are considered uninformative when they do not provide
       enough statistical evidence to support one allele over another."
     """
-    delimiter = ','
-    counts = field_value.split(delimiter)
+    counts = field_value.split(',')
     if len(counts) < 2:
         _warn_of_unparseable_format_field("unfiltered allele depth", VCFGenotypeParser.UNFILTERED_ALLELE_DEPTH_TAG,
                                           field_value, "does not split into at least two values")
     else:
-        for curr_count in counts:
-            new_allele = Allele(curr_count)
-            genotype_info_to_fill.alleles.append(new_allele)
-
-    return genotype_info_to_fill
+        parsed_fields[VCFGenotypeParser.UNFILTERED_READ_COUNTS_KEY].extend(
+            [_convert_to_nullable_nonneg_int(x) for x in counts])
 
 
-def _fill_filtered_reads_count(field_value, genotype_info_to_fill):
-    """Parse the filtered depth of coverage of this sample at this site and store in the VCFGenotypeInfo.
+def _parse_filtered_reads_count(field_value, parsed_fields):
+    """Parse the filtered depth of coverage of this sample at this site and store it in parsed_fields.
 
     Args:
         field_value (str): The value associated with the DP tag in the format value string.
-        genotype_info_to_fill (VCFGenotypeInfo): A partially filled VCFGenotypeInfo object.
-
-    Returns:
-        VCFGenotypeInfo: The input VCFGenotypeInfo with filter_passing_reads_count filled in.
+        parsed_fields (dict): The partially filled dictionary of parsed fields, keyed as for
+            VCFGenotypeParser.parse_to_dict.
 
     From https://gatkforums.broadinstitute.org/gatk/discussion/1268/what-is-a-vcf-and-how-should-i-interpret-it :
     " DP : ... depth of coverage
@@ -169,19 +164,16 @@ def _fill_filtered_reads_count(field_value, genotype_info_to_fill):
       default. Only reads that passed the variant caller’s filters are included in this number. However, unlike the AD
       calculation, uninformative reads are included in DP."
     """
-    genotype_info_to_fill.filter_passing_reads_count = field_value
-    return genotype_info_to_fill
+    parsed_fields[VCFGenotypeParser.FILTER_PASSING_READS_COUNT_KEY] = _convert_to_nullable_nonneg_int(field_value)
 
 
-def _fill_genotype_confidence(field_value, genotype_info_to_fill):
-    """Parse the genotype quality (confidence) of this sample at this site and store in the VCFGenotypeInfo.
+def _parse_genotype_confidence(field_value, parsed_fields):
+    """Parse the genotype quality (confidence) of this sample at this site and store it in parsed_fields.
 
     Args:
         field_value (str): The value associated with the GQ tag in the format value string.
-        genotype_info_to_fill (VCFGenotypeInfo): A partially filled VCFGenotypeInfo object.
-
-    Returns:
-        VCFGenotypeInfo: The input VCFGenotypeInfo with genotype_confidence filled in.
+        parsed_fields (dict): The partially filled dictionary of parsed fields, keyed as for
+            VCFGenotypeParser.parse_to_dict.
 
     From https://gatkforums.broadinstitute.org/gatk/discussion/1268/what-is-a-vcf-and-how-should-i-interpret-it :
     " GQ : Quality of the assigned genotype.
@@ -200,26 +192,23 @@ def _fill_genotype_confidence(field_value, genotype_info_to_fill):
       Not to be confused with the site-level annotation QUAL; see this FAQ article for an explanation of the differences
       in what they mean and how they should be used."
     """
-    genotype_info_to_fill.genotype_confidence = field_value
-    return genotype_info_to_fill
+    parsed_fields[VCFGenotypeParser.GENOTYPE_CONFIDENCE_KEY] = _convert_to_nullable_float(field_value)
 
 
-def _fill_genotype_likelihoods(field_value, genotype_info_to_fill):
+def _parse_genotype_likelihoods(field_value, parsed_fields):
     """Parse the "normalized" Phred-scaled likelihoods of possible genotypes of this sample at this site and store.
 
     Args:
         field_value (str): The value associated with the PL tag in the format value string.
-        genotype_info_to_fill (VCFGenotypeInfo): A partially filled VCFGenotypeInfo object.
+        parsed_fields (dict): The partially filled dictionary of parsed fields, keyed as for
+            VCFGenotypeParser.parse_to_dict.
 
-    Returns:
-        VCFGenotypeInfo: The input VCFGenotypeInfo with additional fields filled in.
-
-    Note that this function will MAKE the number of Allele objects implied by the likelihood string if no alleles have
-    been filled into the genotype_info_to_fill by the time this function is called. The reason for this is that there
-    ARE valid VCF format strings (e.g., 'GT:GQ:PL') that have the PL tag (likelihood) but no AD tag in them, and since
-    Allele objects are usually created in the processing of the AD tag, some back-up approach was needed to infer
-    Alleles in this situation.  Of course, the Alleles created in this situation will all have None as their
-    read_counts, since the read_counts value comes from the AD tag.
+    Note that this function will MAKE the number of alleles implied by the likelihood string if no alleles have been
+    filled into parsed_fields by the time this function is called. The reason for this is that there ARE valid VCF
+    format strings (e.g., 'GT:GQ:PL') that have the PL tag (likelihood) but no AD tag in them, and since alleles are
+    usually created in the processing of the AD tag, some back-up approach was needed to infer alleles in this
+    situation.  Of course, the alleles created in this situation will all have None as their read counts, since the
+    read counts come from the AD tag.
 
     From https://gatkforums.broadinstitute.org/gatk/discussion/1268/what-is-a-vcf-and-how-should-i-interpret-it:
     " PL : "Normalized" Phred-scaled likelihoods of the possible genotypes.
@@ -233,56 +222,98 @@ def _fill_genotype_likelihoods(field_value, genotype_info_to_fill):
       likelihood of the genotype", we mean it is "How much less likely that genotype is compared to the best one".
     "
     """
-    generate_alleles = False
-    delimiter = ','
-    likelihoods = field_value.split(delimiter)
+    likelihoods = field_value.split(',')
+    read_counts = parsed_fields[VCFGenotypeParser.UNFILTERED_READ_COUNTS_KEY]
+    parsed_likelihoods = parsed_fields[VCFGenotypeParser.GENOTYPE_LIKELIHOODS_KEY]
 
-    num_expected_alleles = len(genotype_info_to_fill.alleles)
-    if num_expected_alleles == 0:
-        generate_alleles = True
-        genotype_info_to_fill.alleles.append(Allele(None))
+    num_expected_alleles = len(read_counts)
+    generate_alleles = num_expected_alleles == 0
+    if generate_alleles:
+        read_counts.append(None)
 
     allele_number = 0
     likelihood_number = 0
-    for index in range(len(likelihoods)):
+    for curr_likelihood in likelihoods:
         if likelihood_number > allele_number:
             allele_number += 1
             likelihood_number = 0
 
             if generate_alleles:
-                genotype_info_to_fill.alleles.append(Allele(None))
+                read_counts.append(None)
 
-            # NB: The check below looks at the *current* number of alleles in genotype_info_to_fill, which may be
-            # different than the value found above and stored in num_expected_alleles due to the alleles.append
-            # statements at various points above.
-            if allele_number >= len(genotype_info_to_fill.alleles):
+            if allele_number >= len(read_counts):
                 _warn_of_unparseable_format_field("'normalized' Phred-scaled likelihoods of possible genotypes",
                                                   VCFGenotypeParser.NORMALIZED_SCALED_LIKELIHOODS_TAG,
                                                   field_value,
                                                   "appears to contain information for more alleles than expected")
+                parsed_fields[VCFGenotypeParser.GENOTYPE_LIKELIHOODS_KEY] = []
+                return
 
-                # in case of warning, clear any already-parsed genotype likelihoods (they probably can't be trusted)
-                # and return out of function
-                genotype_info_to_fill.genotype_likelihoods = []
-                return genotype_info_to_fill
-            # end warn
-        # end if likelihood_number > allele_number
-
-        new_likelihood = GenotypeLikelihood(likelihood_number, allele_number, likelihoods[index])
-        genotype_info_to_fill.genotype_likelihoods.append(new_likelihood)
+        parsed_likelihoods.append(_convert_to_nullable_float(curr_likelihood))
         likelihood_number += 1
 
     if allele_number < (num_expected_alleles-1) or likelihood_number < num_expected_alleles:
         _warn_of_unparseable_format_field("'normalized' Phred-scaled likelihoods of possible genotypes",
                                           VCFGenotypeParser.NORMALIZED_SCALED_LIKELIHOODS_TAG,
                                           field_value, "appears to contain information for fewer alleles than expected")
+        parsed_fields[VCFGenotypeParser.GENOTYPE_LIKELIHOODS_KEY] = []
 
-        # in case of warning, clear any already-parsed genotype likelihoods (they probably can't be trusted)
-        genotype_info_to_fill.genotype_likelihoods = []
 
+# The _fill_* functions below store the results of the _parse_* functions above in VCFGenotypeInfo, Allele and
+# GenotypeLikelihood objects rather than in a dictionary; parsing itself is done only by the _parse_* functions.
+
+def _fill_with_dict_parser(parse_func, field_value, genotype_info_to_fill):
+    """Parse a field's value with the input _parse_* function and store the results in the VCFGenotypeInfo.
+
+    Args:
+        parse_func (Callable[str, dict]): The _parse_* function for the field's tag.
+        field_value (str): The value associated with the field's tag in the format value string.
+        genotype_info_to_fill (VCFGenotypeInfo): A partially filled VCFGenotypeInfo object.
+
+    Returns:
+        VCFGenotypeInfo: The input VCFGenotypeInfo with additional fields filled in.
+    """
+    parsed_fields = VCFGenotypeParser._get_parsed_fields(genotype_info_to_fill)
+    parse_func(field_value, parsed_fields)
+    VCFGenotypeParser._fill_from_parsed_fields(genotype_info_to_fill, parsed_fields)
     return genotype_info_to_fill
 
 
+def _fill_genotype(field_value, genotype_info_to_fill):
+    """Parse the genotype of this sample at this site (see _parse_genotype) and store in the VCFGenotypeInfo."""
+    return _fill_with_dict_parser(_parse_genotype, field_value, genotype_info_to_fill)
+
+
+def _fill_unfiltered_reads_counts(field_value, genotype_info_to_fill):
+    """Parse the unfiltered reads counts (see _parse_unfiltered_reads_counts) and store in the VCFGenotypeInfo."""
+    return _fill_with_dict_parser(_parse_unfiltered_reads_counts, field_value, genotype_info_to_fill)
+
+
+def _fill_filtered_reads_count(field_value, genotype_info_to_fill):
+    """Parse the filtered depth of coverage (see _parse_filtered_reads_count) and store in the VCFGenotypeInfo."""
+    return _fill_with_dict_parser(_parse_filtered_reads_count, field_value, genotype_info_to_fill)
+
+
+def _fill_genotype_confidence(field_value, genotype_info_to_fill):
+    """Parse the genotype quality (see _parse_genotype_confidence) and store in the VCFGenotypeInfo."""
+    return _fill_with_dict_parser(_parse_genotype_confidence, field_value, genotype_info_to_fill)
+
+
+def _fill_genotype_likelihoods(field_value, genotype_info_to_fill):
+    """Parse the genotype likelihoods (see _parse_genotype_likelihoods) and store in the VCFGenotypeInfo."""
+    return _fill_with_dict_parser(_parse_genotype_likelihoods, field_value, genotype_info_to_fill)
+
+
+def _iter_likelihood_allele_numbers():
+    # Yields the (allele1_number, allele2_number) pairs implied by successive genotype likelihoods: (0, 0), (0, 1),
+    # (1, 1), (0, 2), ...; see GenotypeLikelihood._validate_allele_relationship
+    allele_number = 0
+    while True:
+        for likelihood_number in range(allele_number + 1):
+            yield likelihood_number, allele_number
+        allele_number += 1
+
+
 class VCFGenotypeInfo(object):
     """Store parsed info from VCF genotype fields for a single sample.
 
@@ -296,8 +327,14 @@ class VCFGenotypeInfo(object):
             dedicated attributes of VCFGenotypeInfo.  Values are parsed to lists and/or floats if possible.
         genotype_subclass_by_class (Dict[str, str]): Genotype subclass (reference, alt, compound) keyed by genotype
             class (homozygous/heterozygous).
+
+    Millions of these are created when parsing a large multi-sample VCF, so they (like Allele and GenotypeLikelihood)
+    use __slots__ rather than a per-instance __dict__, and unprocessed_info is only created when first used.
     """
 
+    __slots__ = ['_raw_string', '_genotype_confidence', '_filter_passing_reads_count', '_unprocessed_info', 'genotype',
+                 'alleles', 'genotype_likelihoods', 'genotype_subclass_by_class']
+
     def __init__(self, raw_string):
         """Create VCFGenotypeInfo object.
 
@@ -312,8 +349,19 @@ class VCFGenotypeInfo(object):
         self.genotype = None
         self.alleles = []  # 0 is ref, 1 is first alt, etc
         self.genotype_likelihoods = []
-        self.unprocessed_info = {}
         self.genotype_subclass_by_class = None
+        self._unprocessed_info = None
+
+    @property
+    def unprocessed_info(self):
+        """Dict[str, Any]: Dictionary of field tag and value(s) for any fields not stored in dedicated attributes."""
+        if self._unprocessed_info is None:
+            self._unprocessed_info = {}
+        return self._unprocessed_info
+
+    @unprocessed_info.setter
+    def unprocessed_info(self, value):
+        self._unprocessed_info = value
 
     @property
     def genotype_confidence(self):
@@ -343,6 +391,8 @@ class VCFGenotypeInfo(object):
 class Allele(object):
     """Store unfiltered read counts, if any, for a particular allele."""
 
+    __slots__ = ['_unfiltered_read_counts']
+
     def __init__(self, unfiltered_read_counts=None):
         """Create Allele object.
 
@@ -367,6 +417,8 @@ class Allele(object):
 class GenotypeLikelihood(object):
     """Store parsed info from VCF genotype likelihood field for a single sample."""
 
+    __slots__ = ['_allele1_number', '_allele2_number', '_likelihood_neg_exponent']
+
     @staticmethod
     def _validate_allele_relationship(allele1_number, allele2_number):
         """Ensure that allele1_number is not greater than allele2_number.
@@ -453,7 +505,12 @@ class GenotypeLikelihood(object):
 
 
 class VCFGenotypeParser(object):
-    """Mine format string and genotype fields string to create a filled VCFGenotypeInfo object."""
+    """Mine format string and genotype fields string to create a filled VCFGenotypeInfo object (or, more cheaply, a
+    dictionary of the same information)."""
+
+    # this regex means "one or more characters that is not a comma, period, colon, zero, or forward slash"
+    _CONTENT_CHAR_REGEX = re.compile(r"[^,.:0\/]+")
+    _NO_CALL_STRINGS = frozenset([".", "./."])  # the commonest strings without real content
 
     @staticmethod
     def is_valid_genotype_fields_string(genotype_fields_string):
@@ -465,15 +522,15 @@ class VCFGenotypeParser(object):
         Returns
             bool: true if input has any real genotype fields content, false if is just periods, zeroes, and delimiters.
         """
-        result = False
-        # this regex means "one or more characters that is not a comma, period, colon, zero, or forward slash"
-        content_char_match = re.search(r"[^,.:0\/]+", genotype_fields_string)
-        # NB: necessary to ALSO check first character of string, even if no match to above regex is found, because
-        # "0/0" should be a valid genotype (even though all the characters it contains could signal null content in
-        # other configurations), and a genotype fields string with nothing but a genotype in it should be legal.
-        if content_char_match is not None or not genotype_fields_string.startswith("."):
-            result = True
-        return result
+        # NB: necessary to check first character of string, even if it holds nothing but commas, periods, colons,
+        # zeroes, and forward slashes, because "0/0" should be a valid genotype (even though all the characters it
+        # contains could signal null content in other configurations), and a genotype fields string with nothing but a
+        # genotype in it should be legal.  Checking it first also means most strings never need the regex search.
+        if not genotype_fields_string.startswith("."):
+            return True
+        if genotype_fields_string in VCFGenotypeParser._NO_CALL_STRINGS:
+            return False
+        return VCFGenotypeParser._CONTENT_CHAR_REGEX.search(genotype_fields_string) is not None
 
     GENOTYPE_TAG = "GT"  # str: VCF tag for the genotype of this sample at this site.
     UNFILTERED_ALLELE_DEPTH_TAG = "AD"  # str: VCF tag for the unfiltered allele depth of this sample at this site.
@@ -481,19 +538,145 @@ class VCFGenotypeParser(object):
     GENOTYPE_QUALITY_TAG = "GQ"  # str: VCF tag for the genotype quality of this sample at this site.
     NORMALIZED_SCALED_LIKELIHOODS_TAG = "PL"  # str: VCF tag for the genotype likelihoods of this sample at this site.
 
-    _DELIMITER = ':'  # str: Delimiter between fields in format and genotype fields strings.
+    # Keys of the dictionary returned by parse_to_dict; each holds the same information as the like-named attribute of
+    # VCFGenotypeInfo, except that alleles and genotype likelihoods are represented just by their values.
+    GENOTYPE_KEY = "genotype"  # str or None
+    GENOTYPE_SUBCLASS_BY_CLASS_KEY = "genotype_subclass_by_class"  # Dict[str, str] or None
+    FILTER_PASSING_READS_COUNT_KEY = "filter_passing_reads_count"  # int or None
+    GENOTYPE_CONFIDENCE_KEY = "genotype_confidence"  # float or None
+    UNFILTERED_READ_COUNTS_KEY = "unfiltered_read_counts"  # List[int or None], one per allele
+    GENOTYPE_LIKELIHOODS_KEY = "genotype_likelihoods"  # List[float or None], in the order given in the PL field
+    UNPROCESSED_INFO_KEY = "unprocessed_info"  # Dict[str, Any]
+
+    DELIMITER = ':'  # str: Delimiter between fields in format and genotype fields strings.
+    _MAX_NUM_CACHED_PLANS = 1024  # int: Number of distinct format strings whose parsing plans are kept at once.
+
+    # Dict(str, Callable[str, dict]): Special parsing functions by the VCF tag whose value they parse.
+    _DICT_PARSER_FUNCS = {GENOTYPE_TAG: _parse_genotype,  # GT
+                          UNFILTERED_ALLELE_DEPTH_TAG: _parse_unfiltered_reads_counts,  # AD
+                          FILTERED_ALLELE_DEPTH_TAG: _parse_filtered_reads_count,  # DP
+                          GENOTYPE_QUALITY_TAG: _parse_genotype_confidence,  # GQ
+                          NORMALIZED_SCALED_LIKELIHOODS_TAG: _parse_genotype_likelihoods}  # PL
+
+    # Dict(str, tuple): Parsing plans (see _get_plan) by the format string they were made for.
+    _plans_by_format_string = {}
+
+    @classmethod
+    def _get_plan(cls, format_key_string):
+        """Get the (cached) plan for parsing genotype fields strings with the input format string.
+
+        Args:
+            format_key_string (str): The VCF format string (e.g., 'GT:AD:DP:GQ:PL').
+
+        Returns:
+            Tuple[Tuple[int, str, Optional[Callable[str, dict]]]]: For each field in the format string, in order, its
+                index, its tag, and its parse_to_dict parsing function (None if it has no dedicated one).
+        """
+        plan = cls._plans_by_format_string.get(format_key_string)
+        if plan is None:
+            plan = tuple((index, curr_tag, cls._DICT_PARSER_FUNCS.get(curr_tag))
+                         for index, curr_tag in enumerate(format_key_string.split(cls.DELIMITER)))
+
+            # a VCF has few distinct format strings, but don't let a pathological one grow the cache without bound
+            if len(cls._plans_by_format_string) >= cls._MAX_NUM_CACHED_PLANS:
+                cls._plans_by_format_string.clear()
+            cls._plans_by_format_string[format_key_string] = plan
+        return plan
+
+    @classmethod
+    def parse_to_dict(cls, format_key_string, format_value_string, include_unprocessed=True):
+        """Parse the input format string and genotype fields string into a dictionary, without building objects.
+
+        This parses exactly as parse does (with the same warnings), but is considerably faster, so it is the better
+        choice when parsing the genotype fields of many samples.
+
+        Args:
+            format_key_string (str): The VCF format string (e.g., 'GT:AD:DP:GQ:PL') for this sample at this site.
+            format_value_string (str): The VCF genotype fields values string (e.g., '1/1:0,34:34:99:1187.2,101,0')
+                corresponding to the format_key_string for this sample at this site.
+            include_unprocessed (Optional[bool]): False to skip converting the values of fields without a dedicated
+                parser (their UNPROCESSED_INFO_KEY dictionary is then left empty).  Defaults to True.
+
+        Returns:
+            dict or None: The parsed information, keyed by the *_KEY constants of this class, unless the genotype
+                fields string has no real content or an error was encountered, in which case None is returned.
+
+        """
+        try:
+            if not cls.is_valid_genotype_fields_string(format_value_string):
+                return None
+            return cls._parse_to_dict_with_plan(cls._get_plan(format_key_string), format_value_string,
+                                                include_unprocessed)
+        except Exception as e:
+            cls._warn_of_parse_error(e)
+            return None  # contents can't be trusted
+
+    @classmethod
+    def parse_row_to_dicts(cls, format_key_string, format_value_strings, include_unprocessed=True):
+        """Parse the genotype fields strings of all the samples at one site, which share the input format string.
+
+        This gives the same results (and warnings) as calling parse_to_dict for each sample, but looks up the parsing
+        plan for the format string only once, and skips the many samples without real content (such as './.') cheaply.
+
+        Args:
+            format_key_string (str): The VCF format string (e.g., 'GT:AD:DP:GQ:PL') for this site.
+            format_value_strings (List[str]): The VCF genotype fields values string for each sample at this site.
+            include_unprocessed (Optional[bool]): False to skip converting the values of fields without a dedicated
+                parser, as for parse_to_dict.  Defaults to True.
+
+        Returns:
+            List[dict or None]: The parse_to_dict result for each sample, in the same order as format_value_strings.
+
+        """
+        try:
+            plan = cls._get_plan(format_key_string)
+        except Exception:
+            # let parse_to_dict report the error for each sample that has real content, as it would have anyway
+            return [cls.parse_to_dict(format_key_string, x, include_unprocessed) for x in format_value_strings]
+
+        result = []
+        for curr_value_string in format_value_strings:
+            curr_parsed_fields = None
+            try:
+                if cls.is_valid_genotype_fields_string(curr_value_string):
+                    curr_parsed_fields = cls._parse_to_dict_with_plan(plan, curr_value_string, include_unprocessed)
+            except Exception as e:
+                cls._warn_of_parse_error(e)
+            result.append(curr_parsed_fields)
+        return result
+
+    @classmethod
+    def _parse_to_dict_with_plan(cls, plan, format_value_string, include_unprocessed):
+        result = {cls.GENOTYPE_KEY: None,
+                  cls.GENOTYPE_SUBCLASS_BY_CLASS_KEY: None,
+                  cls.FILTER_PASSING_READS_COUNT_KEY: None,
+                  cls.GENOTYPE_CONFIDENCE_KEY: None,
+                  cls.UNFILTERED_READ_COUNTS_KEY: [],
+                  cls.GENOTYPE_LIKELIHOODS_KEY: [],
+                  cls.UNPROCESSED_INFO_KEY: {}}
+        format_values = format_value_string.split(cls.DELIMITER)
+        for index, curr_tag, parse_func in plan:
+            # NB: index even fields that won't be converted, so that too few values is still an error
+            curr_value = format_values[index]
+            if parse_func is not None:
+                parse_func(curr_value, result)
+            elif include_unprocessed:
+                result[cls.UNPROCESSED_INFO_KEY][curr_tag] = _parse_unprocessed_value(curr_value)
+        return result
 
-    # Dict(str, Callable[str, VCFGenotypeInfo]): Special parsing functions by the VCF tag whose value they parse.
-    _PARSER_FUNCS = {GENOTYPE_TAG: _fill_genotype,  # GT
-                     UNFILTERED_ALLELE_DEPTH_TAG: _fill_unfiltered_reads_counts,  # AD
-                     FILTERED_ALLELE_DEPTH_TAG: _fill_filtered_reads_count,  # DP
-                     GENOTYPE_QUALITY_TAG: _fill_genotype_confidence,  # GQ
-                     NORMALIZED_SCALED_LIKELIHOODS_TAG: _fill_genotype_likelihoods}  # PL
+    @staticmethod
+    def _warn_of_parse_error(error):
+        warn_msg = "Encountered error '{0}' so genotype fields information could not be captured for the " \
+                   "current variant.".format(error)
+        warnings.warn(warn_msg)
 
     @classmethod
     def parse(cls, format_key_string, format_value_string):
         """Parse the input format string and genotype fields string into a filled VCFGenotypeInfo object.
 
+        The parsing itself is done by parse_to_dict; this wraps its results in the VCFGenotypeInfo, Allele, and
+        GenotypeLikelihood objects.
+
         Args:
             format_key_string (str): The VCF format string (e.g., 'GT:AD:DP:GQ:PL') for this sample at this site.
             format_value_string (str): The VCF genotype fields values string (e.g., '1/1:0,34:34:99:1187.2,101,0')
@@ -502,30 +685,38 @@ class VCFGenotypeParser(object):
         Returns:
             VCFGenotypeInfo or None: A filled VCFGenotypeInfo for this sample at this site unless an error was
                 encountered, in which case None is returned.
-                encountered, in which case None is returned.
 
         """
-        result = None
-
-        try:
-            if cls.is_valid_genotype_fields_string(format_value_string):
-                result = VCFGenotypeInfo(format_value_string)
-                format_subkeys = format_key_string.split(cls._DELIMITER)
-                format_values = format_value_string.split(cls._DELIMITER)
-
-                for index, curr_key in enumerate(format_subkeys):
-                    curr_value = format_values[index]
-                    if curr_key in cls._PARSER_FUNCS:
-                        # if this key has a special parsing function associated with it, use that function
-                        parse_func = cls._PARSER_FUNCS[curr_key]
-                        result = parse_func(curr_value, result)
-                    else:
-                        # otherwise, capture this key/value with minimal processing to a catch-all dictionary
-                        result = _capture_unprocessed_field(curr_key, curr_value, result)
-        except Exception as e:
-            warn_msg = "Encountered error '{0}' so genotype fields information could not be captured for the " \
-                       "current variant.".format(e)
-            warnings.warn(warn_msg)
-            result = None  # reset result to None, as contents can't be trusted
+        parsed_fields = cls.parse_to_dict(format_key_string, format_value_string)
+        if parsed_fields is None:
+            return None
 
+        result = VCFGenotypeInfo(format_value_string)
+        cls._fill_from_parsed_fields(result, parsed_fields)
         return result
+
+    @classmethod
+    def _fill_from_parsed_fields(cls, genotype_info_to_fill, parsed_fields):
+        genotype_info_to_fill.genotype = parsed_fields[cls.GENOTYPE_KEY]
+        genotype_info_to_fill.genotype_subclass_by_class = parsed_fields[cls.GENOTYPE_SUBCLASS_BY_CLASS_KEY]
+        genotype_info_to_fill.filter_passing_reads_count = parsed_fields[cls.FILTER_PASSING_READS_COUNT_KEY]
+        genotype_info_to_fill.genotype_confidence = parsed_fields[cls.GENOTYPE_CONFIDENCE_KEY]
+        genotype_info_to_fill.alleles = [Allele(x) for x in parsed_fields[cls.UNFILTERED_READ_COUNTS_KEY]]
+        # NB: the allele numbers of the likelihoods are implied by their order (see _iter_likelihood_allele_numbers)
+        genotype_info_to_fill.genotype_likelihoods = [
+            GenotypeLikelihood(allele1_number, allele2_number, curr_likelihood)
+            for (allele1_number, allele2_number), curr_likelihood in zip(
+                _iter_likelihood_allele_numbers(), parsed_fields[cls.GENOTYPE_LIKELIHOODS_KEY])]
+        if len(parsed_fields[cls.UNPROCESSED_INFO_KEY]) > 0:
+            genotype_info_to_fill.unprocessed_info = parsed_fields[cls.UNPROCESSED_INFO_KEY]
+
+    @classmethod
+    def _get_parsed_fields(cls, genotype_info):
+        # the inverse of _fill_from_parsed_fields
+        return {cls.GENOTYPE_KEY: genotype_info.genotype,
+                cls.GENOTYPE_SUBCLASS_BY_CLASS_KEY: genotype_info.genotype_subclass_by_class,
+                cls.FILTER_PASSING_READS_COUNT_KEY: genotype_info.filter_passing_reads_count,
+                cls.GENOTYPE_CONFIDENCE_KEY: genotype_info.genotype_confidence,
+                cls.UNFILTERED_READ_COUNTS_KEY: [x.unfiltered_read_counts for x in genotype_info.alleles],
+                cls.GENOTYPE_LIKELIHOODS_KEY: [x.likelihood_neg_exponent for x in genotype_info.genotype_likelihoods],
+                cls.UNPROCESSED_INFO_KEY: dict(genotype_info.unprocessed_info)}
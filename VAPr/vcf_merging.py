@@ -1,3 +1,6 @@
+import concurrent.futures
+import functools
+import gzip
 import os
 import shlex
 import subprocess
@@ -8,9 +11,25 @@ __author__ = 'Adam Mark<a1mark@ucsd.edu>'
 VCF_EXTENSION = ".vcf"
 BGZIP_EXTENSION = ".gz"
 BGZIPPED_VCF_EXTENSION = VCF_EXTENSION + BGZIP_EXTENSION
+TABIX_INDEX_EXTENSION = ".tbi"
+DEFAULT_NUM_BGZIP_WORKERS = 4
 
-def bgzip_and_index_vcf(vcf_path):
-    """bgzip and index each vcf so it can be merged with bcftools."""
+def bgzip_and_index_vcf(vcf_path, num_bgzip_threads=1):
+    """bgzip and index each vcf so it can be merged with bcftools.
+
+    A vcf whose bgzipped copy and index are both newer than it is not compressed or indexed again.
+
+    Args:
+        vcf_path (str): Path to the vcf; if it is already bgzipped (ending in '.vcf.gz'), it is used as is.
+        num_bgzip_threads (Optional[int]): Number of threads for bgzip to compress with, if the installed bgzip
+            supports its '-@' option.  Defaults to 1.
+
+    Returns:
+        str: Path to the bgzipped vcf.
+
+    Raises:
+        RuntimeError: If bgzip or tabix fails.
+    """
 
     if vcf_path.endswith(BGZIPPED_VCF_EXTENSION):
         # TODO: someday: check that the input is *really* bgzipped, rather than just gzipped
@@ -19,22 +38,63 @@ def bgzip_and_index_vcf(vcf_path):
         bgzipped_vcf_path = vcf_path
     else:
         bgzipped_vcf_path = vcf_path + BGZIP_EXTENSION
-        bgzip_cmd_string = _build_bgzip_vcf_command_str(vcf_path)
+        if _is_bgzipped_and_indexed_vcf_up_to_date(vcf_path, bgzipped_vcf_path):
+            return bgzipped_vcf_path
+
+        if num_bgzip_threads > 1 and not _bgzip_supports_threads():
+            num_bgzip_threads = 1
+        bgzip_cmd_string = _build_bgzip_vcf_command_str(vcf_path, num_bgzip_threads)
         bgzip_args = shlex.split(bgzip_cmd_string)
-        with open(bgzipped_vcf_path, "w") as outfile:
+        # compress to a temporary file, so that an interrupted or failed bgzip never leaves an up-to-date-looking copy
+        temp_bgzipped_vcf_path = bgzipped_vcf_path + ".tmp"
+        with open(temp_bgzipped_vcf_path, "w") as outfile:
             p = subprocess.Popen(bgzip_args, stdout=outfile, stderr=subprocess.PIPE)
-            p.communicate()
+            _, bgzip_err = p.communicate()
+        if p.returncode != 0:
+            os.remove(temp_bgzipped_vcf_path)
+            raise RuntimeError("bgzip failed with exit code {0} on '{1}': {2}".format(
+                p.returncode, vcf_path, bgzip_err.decode('utf-8', 'replace').strip()))
+        os.replace(temp_bgzipped_vcf_path, bgzipped_vcf_path)
 
         index_cmd_string = _build_index_vcf_command_str(bgzipped_vcf_path)
         index_args = shlex.split(index_cmd_string)
-        subprocess.call(index_args)
+        index_return_code = subprocess.call(index_args)
+        if index_return_code != 0:
+            raise RuntimeError("tabix failed with exit code {0} on '{1}'".format(index_return_code,
+                                                                                 bgzipped_vcf_path))
 
     return bgzipped_vcf_path
 
 
+def bgzip_and_index_vcfs(vcf_path_list, num_workers=DEFAULT_NUM_BGZIP_WORKERS):
+    """bgzip and index many vcfs at once, as bgzip_and_index_vcf does for one.
+
+    Args:
+        vcf_path_list (list): Paths to the vcfs.
+        num_workers (Optional[int]): Maximum number of vcfs to compress and index at once; any cpus left over are
+            given to bgzip's own threads.  Defaults to DEFAULT_NUM_BGZIP_WORKERS.
+
+    Returns:
+        list: Path to the bgzipped copy of each distinct input vcf, in input order.
+    """
+
+    unique_vcf_path_list = list(dict.fromkeys(vcf_path_list))  # the same vcf must not be compressed twice at once
+    num_workers = max(1, min(num_workers, len(unique_vcf_path_list)))
+    num_bgzip_threads = max(1, (os.cpu_count() or 1) // num_workers)
+
+    # each thread just waits on its own bgzip and tabix processes, so threads suffice to run them concurrently
+    with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+        return list(executor.map(functools.partial(bgzip_and_index_vcf, num_bgzip_threads=num_bgzip_threads),
+                                 unique_vcf_path_list))
+
+
 # TODO: someday: refactor since raw_vcf_path_list and vcfs_gzipped are really mutually exclusive
-def merge_vcfs(input_dir, output_dir, project_name, raw_vcf_path_list=None, vcfs_gzipped=False):
-    """Merge vcf files into single multisample vcf, bgzip and index merged vcf file."""
+def merge_vcfs(input_dir, output_dir, project_name, raw_vcf_path_list=None, vcfs_gzipped=False,
+               num_bgzip_workers=DEFAULT_NUM_BGZIP_WORKERS):
+    """Merge vcf files into single multisample vcf, bgzip and index merged vcf file.
+
+    The input vcfs are bgzipped and indexed num_bgzip_workers at a time (see bgzip_and_index_vcfs) before merging.
+    """
 
     if raw_vcf_path_list is None:
         vcf_file_extension = BGZIPPED_VCF_EXTENSION if vcfs_gzipped else VCF_EXTENSION
@@ -45,7 +105,7 @@ def merge_vcfs(input_dir, output_dir, project_name, raw_vcf_path_list=None, vcfs
             raise ValueError("Input list of VCF files is empty.")
 
     if len(raw_vcf_path_list) > 1:
-        bgzipped_vcf_path_list = set([bgzip_and_index_vcf(vcf_fp) for vcf_fp in raw_vcf_path_list])
+        bgzipped_vcf_path_list = set(bgzip_and_index_vcfs(raw_vcf_path_list, num_bgzip_workers))
         single_vcf_path = os.path.join(output_dir, project_name + VCF_EXTENSION)
         _merge_bgzipped_indexed_vcfs(bgzipped_vcf_path_list, single_vcf_path)
     else:
@@ -63,6 +123,71 @@ def merge_vcfs(input_dir, output_dir, project_name, raw_vcf_path_list=None, vcfs
     return single_vcf_path
 
 
+def split_vcf(vcf_path, output_dir, num_shards):
+    """Split a vcf into at most num_shards vcfs of consecutive records, each with the full header.
+
+    The shards hold (nearly) equal numbers of records, in the same order as the input, so concatenating their records
+    in shard order reproduces the input; no index is needed, and the input needn't be sorted.
+
+    Args:
+        vcf_path (str): Path to the vcf to split; it may be bgzipped/gzipped, in which case its name must end with
+            '.gz'.
+        output_dir (str): Directory in which to write the shards.
+        num_shards (int): Maximum number of shards to make; fewer are made if the vcf has fewer records.
+
+    Returns:
+        List[str]: Paths of the (uncompressed) shard vcfs, in order.
+    """
+
+    header_lines = []
+    num_records = 0
+    with _open_vcf_for_reading(vcf_path) as vcf_file_obj:
+        for curr_line in vcf_file_obj:
+            if curr_line.startswith("#"):
+                header_lines.append(curr_line)
+            elif len(curr_line.strip()) > 0:
+                num_records += 1
+
+    num_records_per_shard = max(1, -(-num_records // num_shards))  # i.e., the ceiling of the division
+    base_name = os.path.basename(vcf_path)
+    for curr_extension in [BGZIPPED_VCF_EXTENSION, VCF_EXTENSION]:
+        if base_name.endswith(curr_extension):
+            base_name = base_name[:-len(curr_extension)]
+            break
+
+    shard_fps = []
+    shard_file_obj = None
+    num_shard_records = 0
+    try:
+        with _open_vcf_for_reading(vcf_path) as vcf_file_obj:
+            for curr_line in vcf_file_obj:
+                if curr_line.startswith("#") or len(curr_line.strip()) == 0:
+                    continue
+
+                if shard_file_obj is None or num_shard_records == num_records_per_shard:
+                    if shard_file_obj is not None:
+                        shard_file_obj.close()
+                    shard_fps.append(os.path.join(output_dir, "{0}_shard{1:04d}{2}".format(
+                        base_name, len(shard_fps), VCF_EXTENSION)))
+                    shard_file_obj = open(shard_fps[-1], "w")
+                    shard_file_obj.writelines(header_lines)
+                    num_shard_records = 0
+
+                shard_file_obj.write(curr_line)
+                num_shard_records += 1
+    finally:
+        if shard_file_obj is not None:
+            shard_file_obj.close()
+
+    return shard_fps
+
+
+def _open_vcf_for_reading(vcf_path):
+    if vcf_path.endswith(BGZIP_EXTENSION):
+        return gzip.open(vcf_path, "rt")
+    return open(vcf_path, "r")
+
+
 def _get_vcf_file_paths_list_in_directory(base_dir, vcf_file_extension):
     vcf_file_paths_list = []
     walker = os.walk(base_dir)
@@ -92,12 +217,37 @@ def _build_merge_vcf_command_str(raw_vcf_path_list):
     return command
 
 
-def _build_bgzip_vcf_command_str(vcf_path):
+def _is_bgzipped_and_indexed_vcf_up_to_date(vcf_path, bgzipped_vcf_path):
+    try:
+        vcf_mtime = os.stat(vcf_path).st_mtime_ns
+        bgzipped_vcf_mtime = os.stat(bgzipped_vcf_path).st_mtime_ns
+        index_mtime = os.stat(bgzipped_vcf_path + TABIX_INDEX_EXTENSION).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+    return vcf_mtime < bgzipped_vcf_mtime <= index_mtime
+
+
+@functools.lru_cache(maxsize=None)
+def _bgzip_supports_threads():
+    """Check (once) whether the installed bgzip has the '-@'/'--threads' option, added in htslib 1.4."""
+
+    try:
+        p = subprocess.Popen(['bgzip', '-h'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        help_output, _ = p.communicate()
+    except OSError:
+        return False
+    return b'--threads' in help_output
+
+
+def _build_bgzip_vcf_command_str(vcf_path, num_threads=1):
     """Generate command string to bgzip vcf file."""
 
-    command = " ".join([
-        'bgzip -c', vcf_path
-        ])
+    command_parts = ['bgzip -c']
+    if num_threads > 1:
+        command_parts.append('-@ {0}'.format(num_threads))
+    command_parts.append(vcf_path)
+    command = " ".join(command_parts)
     return command
 
 
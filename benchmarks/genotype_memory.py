@@ -0,0 +1,107 @@
+"""Measure the memory held by parsed VCF genotype fields, in bytes per parsed sample.
+
+Builds a wide multi-sample fixture in memory (many samples per variant, with a mix of genotypes, missing values, and
+multi-allelic sites), parses every sample's genotype fields, keeps all the results alive, and reports the memory
+allocated for them as measured by tracemalloc.  Run from the repository root with:
+
+    python benchmarks/genotype_memory.py [--num-variants 200] [--num-samples 1000]
+"""
+
+# built-in libraries
+import argparse
+import random
+import sys
+import tracemalloc
+import warnings
+
+# project libraries
+from VAPr.vcf_genotype_fields_parsing import VCFGenotypeParser
+
+_FORMAT_STRINGS = ["GT:AD:DP:GQ:PL", "GT:AD:DP:GQ:PL:SB", "GT:GQ:PL"]
+
+
+def make_genotype_fields_rows(num_variants, num_samples, seed=0):
+    """Make (format string, list of per-sample genotype fields strings) rows like those of a wide multi-sample VCF.
+
+    Args:
+      num_variants(int): number of rows to make
+      num_samples(int): number of samples per row
+      seed(int, optional): random seed, so the fixture is the same from run to run (Default value = 0)
+
+    Returns:
+      list: one (str, list) tuple per variant
+
+    """
+
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(num_variants):
+        format_string = rng.choice(_FORMAT_STRINGS)
+        num_alleles = 3 if rng.random() < 0.1 else 2
+        num_likelihoods = num_alleles * (num_alleles + 1) // 2
+        values_list = []
+        for _ in range(num_samples):
+            if rng.random() < 0.2:
+                values_list.append("./.:" + ":".join("." for _ in format_string.split(":")[1:]))
+                continue
+
+            genotype = "{0}/{1}".format(*sorted(rng.randrange(num_alleles) for _ in range(2)))
+            read_counts = [rng.randrange(60) for _ in range(num_alleles)]
+            field_values_by_tag = {"GT": genotype,
+                                   "AD": ",".join(str(x) for x in read_counts),
+                                   "DP": str(sum(read_counts)),
+                                   "GQ": str(rng.randrange(100)),
+                                   "PL": ",".join(str(rng.randrange(2000)) for _ in range(num_likelihoods)),
+                                   "SB": ",".join(str(rng.randrange(30)) for _ in range(4))}
+            values_list.append(":".join(field_values_by_tag[x] for x in format_string.split(":")))
+        rows.append((format_string, values_list))
+    return rows
+
+
+def measure_bytes_per_sample(parse_func, rows):
+    """Parse every sample in the rows and return the memory held by the results, per parsed sample.
+
+    Args:
+      parse_func(Callable[[str, str], Any]): parsing function, such as VCFGenotypeParser.parse
+      rows(list): rows made by make_genotype_fields_rows
+
+    Returns:
+      tuple: (float bytes per parsed sample, int number of parsed samples)
+
+    """
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        tracemalloc.start()
+        try:
+            baseline_size, _ = tracemalloc.get_traced_memory()
+            results = [parse_func(format_string, x) for format_string, values_list in rows for x in values_list]
+            results_size, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    num_parsed = sum(1 for x in results if x is not None)
+    return (results_size - baseline_size) / num_parsed, num_parsed
+
+
+def main(argv=None):
+    """Command-line entry point for the benchmark"""
+
+    parser = argparse.ArgumentParser(description="Measure the memory held by parsed VCF genotype fields.")
+    parser.add_argument("--num-variants", type=int, default=200, help="number of variants (default: 200)")
+    parser.add_argument("--num-samples", type=int, default=1000, help="number of samples per variant (default: 1000)")
+    args = parser.parse_args(argv)
+
+    rows = make_genotype_fields_rows(args.num_variants, args.num_samples)
+    parse_funcs_by_name = [("VCFGenotypeParser.parse", VCFGenotypeParser.parse)]
+    if hasattr(VCFGenotypeParser, "parse_to_dict"):
+        parse_funcs_by_name.append(("VCFGenotypeParser.parse_to_dict", VCFGenotypeParser.parse_to_dict))
+
+    for curr_name, curr_parse_func in parse_funcs_by_name:
+        bytes_per_sample, num_parsed = measure_bytes_per_sample(curr_parse_func, rows)
+        print("{0}: {1:.0f} bytes per parsed sample ({2} samples)".format(curr_name, bytes_per_sample, num_parsed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,6 +10,9 @@ setup(name='VAPr',
       license='MIT',
       packages=['VAPr'],
       zip_safe=False,
+      entry_points={
+            'console_scripts': [
+                  'vapr-build-myvariant-mirror = VAPr.myvariant_mirror:main']},
       extras_require={
             'docs': [
                   'sphinx >= 1.7',